@@ -244,5 +244,54 @@ def sync_tg_models() -> None:
         click.echo("Db schema synced with bot api")
 
 
+async def _migrate_clickhouse(target: int | None, *, show: bool, unlock: bool) -> None:
+    from djgram.contrib.analytics.schema import get_analytics_migrator
+    from djgram.db import clickhouse
+
+    migrator = get_analytics_migrator()
+    try:
+        if unlock:
+            async with clickhouse.connection() as client:
+                await migrator.unlock(client)
+            click.echo("Clickhouse migrations lock removed")
+            return
+
+        if show:
+            async with clickhouse.connection() as client:
+                pending = await migrator.get_pending(client)
+            for migration in pending:
+                click.echo(migration.path.name)
+            if not pending:
+                click.echo("All clickhouse migrations applied")
+            return
+
+        applied = await migrator.migrate(target)
+        for migration in applied:
+            click.echo(f"\033[32mApplied {migration.path.name}\033[0m")
+        if not applied:
+            click.echo("Nothing to migrate")
+
+    finally:
+        await clickhouse.close_pool()
+
+
+@cli.command()
+@click.option("--target", type=int, default=None, help="Последняя версия, которую нужно применить")
+@click.option("--show", is_flag=True, help="Только показать не применённые миграции")
+@click.option("--unlock", is_flag=True, help="Снять замок, оставленный упавшим процессом миграции")
+def migrate_clickhouse(target: int | None, show: bool, unlock: bool) -> None:  # noqa: FBT001
+    """
+    Применяет миграции схемы аналитики в clickhouse
+
+    Миграции, меняющие ключи сортировки, копируют таблицы целиком,
+    поэтому их нужно применять при остановленных ботах, иначе события, пришедшие во время копирования, теряются.
+
+    Настройки подключения берутся из configs.py в текущей папке
+    """
+    import asyncio
+
+    asyncio.run(_migrate_clickhouse(target, show=show, unlock=unlock))
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,100 @@
+"""
+Построение строк аналитики update'ов в цикле событий и в потоке
+
+Update'ы с большим текстом, сущностями и клавиатурой ставятся в очередь с заданной частотой,
+задержка цикла событий измеряется задачей, которая спит по 1 мс. Вставка ничего не делает.
+
+Запуск: python benchmarks/analytics_serialization.py
+"""
+
+import asyncio
+import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.dispatcher.middlewares.user_context import EventContext
+from aiogram.types import Update
+from djgram.contrib.analytics import writer
+from djgram.contrib.analytics.middlewares import save_event_to_clickhouse
+from djgram.contrib.analytics.sinks import AnalyticsSink
+from djgram.contrib.analytics.writer import AnalyticsWriter
+
+RATE = 1000
+SECONDS = 4
+PROBE_SLEEP = 0.001
+
+
+class NullSink(AnalyticsSink):
+    async def write(self, table_name: str, columns: dict[str, list[Any]], token: str | None = None) -> None:
+        pass
+
+
+def make_update(update_id: int) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 1700000000,
+                "chat": {"id": 1, "type": "private"},
+                "from": {"id": 1, "is_bot": False, "first_name": "user"},
+                "text": "x" * 3000,
+                "entities": [{"type": "bold", "offset": offset, "length": 1} for offset in range(100)],
+                "reply_markup": {
+                    "inline_keyboard": [
+                        [{"text": f"b{column}", "callback_data": f"d{column}"} for column in range(8)] for _ in range(8)
+                    ],
+                },
+            },
+        },
+    )
+
+
+async def run(serialization_workers: int) -> None:
+    writer._writer = AnalyticsWriter(serialization_workers=serialization_workers, sink=NullSink())
+    bot = Bot("1:TEST")
+    updates = [make_update(update_id) for update_id in range(200)]
+    event_context = EventContext(chat=None, user=None)
+
+    lags: list[float] = []
+    stop = False
+
+    async def probe() -> None:
+        while not stop:
+            start = time.perf_counter()
+            await asyncio.sleep(PROBE_SLEEP)
+            lags.append(time.perf_counter() - start - PROBE_SLEEP)
+
+    probe_task = asyncio.create_task(probe())
+
+    start = time.perf_counter()
+    sent = 0
+    on_loop_cost = 0.0
+    while time.perf_counter() - start < SECONDS:
+        call_start = time.perf_counter()
+        save_event_to_clickhouse(updates[sent % len(updates)], 0.01, event_context, bot)
+        on_loop_cost += time.perf_counter() - call_start
+        sent += 1
+        await asyncio.sleep(max(0.0, start + sent / RATE - time.perf_counter()))
+
+    stop = True
+    await probe_task
+    await writer.close_analytics_writer()
+    await bot.session.close()
+
+    lags.sort()
+    p50, p99 = (lags[int(len(lags) * quantile)] * 1e3 for quantile in (0.5, 0.99))
+    print(
+        f"serialization_workers={serialization_workers}: "
+        f"on-loop cost {on_loop_cost / sent * 1e6:.0f} us/update, "
+        f"loop lag p50={p50:.2f} p99={p99:.2f} max={lags[-1] * 1e3:.2f} ms",
+    )
+
+
+async def main() -> None:
+    for serialization_workers in (0, 1, 0, 1):
+        await run(serialization_workers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+"""
+Сохранение состояния диалога для аналитики: deepcopy против снимков
+
+Измеряется захват и сериализация состояния до обработки для dialog_data с N вложенными записями.
+
+Запуск: python benchmarks/dialog_snapshots.py
+"""
+
+import copy
+import functools
+import timeit
+
+import orjson
+from aiogram.fsm.state import State, StatesGroup
+from aiogram_dialog.api.entities import Context, Stack
+from djgram.contrib.analytics.dialog_analytics import ContextSnapshot, StackSnapshot
+
+
+class Group(StatesGroup):
+    state = State()
+
+
+def make_context(entries: int) -> tuple[Context, Stack]:
+    context = Context(
+        _intent_id="intent",
+        _stack_id="stack",
+        state=Group.state,
+        start_data={"a": 1},
+        dialog_data={f"k{i}": {"name": "x" * 20, "items": list(range(10)), "nested": {"v": i}} for i in range(entries)},
+        widget_data={f"w{i}": [i, "y"] for i in range(entries // 5)},
+    )
+    return context, Stack(intents=["a", "b", "c"])
+
+
+def deepcopy_and_dump(context: Context, stack: Stack) -> None:
+    context_copy = copy.deepcopy(context)
+    copy.deepcopy(stack)
+    for data in (context_copy.start_data, context_copy.dialog_data, context_copy.widget_data):
+        orjson.dumps(data)
+
+
+def take_snapshots(context: Context, stack: Stack) -> None:
+    ContextSnapshot.from_context(context)
+    StackSnapshot.from_stack(stack)
+
+
+def main() -> None:
+    for entries in (10, 100, 1000):
+        context, stack = make_context(entries)
+        number = 2000 if entries < 1000 else 200
+        old = timeit.timeit(functools.partial(deepcopy_and_dump, context, stack), number=number) / number * 1e6
+        new = timeit.timeit(functools.partial(take_snapshots, context, stack), number=number) / number * 1e6
+        print(f"dialog_data entries={entries}: deepcopy+dump {old:.0f} us, snapshot {new:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Лимитеры чатов: GCRAStore против TTLCache с объектами limiter.Limiter
+
+Запуск: python benchmarks/gcra_store.py
+"""
+
+import asyncio
+import gc
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+from cachetools import TTLCache
+from djgram.contrib.limits.base import acquire_tokens
+from djgram.contrib.limits.gcra import GCRAStore
+from limiter import Limiter
+
+CHATS = 1_000_000
+CALLS = 200_000
+ROUND_ROBIN_CHATS = 10_000
+
+
+def measure_memory(build: Callable[[], Any]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    obj = build()  # noqa: F841
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / 2**20
+
+
+def build_ttl_cache() -> TTLCache:
+    cache = TTLCache(maxsize=2**63, ttl=60)
+    for chat_id in range(CHATS):
+        cache[chat_id] = Limiter(1, 3)
+    return cache
+
+
+def build_gcra_store() -> GCRAStore:
+    store = GCRAStore(1, 3)
+    for chat_id in range(CHATS):
+        store.reserve(chat_id)
+    return store
+
+
+async def bench_ttl_cache(keys: Callable[[int], int]) -> float:
+    cache = TTLCache(maxsize=2**63, ttl=60)
+    start = time.perf_counter()
+    for i in range(CALLS):
+        key = keys(i)
+        limiter = cache.get(key)
+        if limiter is None:
+            limiter = cache[key] = Limiter(1e6, 3)
+        await acquire_tokens(limiter, 1)
+    return (time.perf_counter() - start) / CALLS * 1e6
+
+
+async def bench_gcra_store(keys: Callable[[int], int]) -> float:
+    store = GCRAStore(1e6, 3)
+    start = time.perf_counter()
+    for i in range(CALLS):
+        await store.acquire(keys(i))
+    return (time.perf_counter() - start) / CALLS * 1e6
+
+
+async def check_timing() -> None:
+    store = GCRAStore(10, 3)
+    start = time.monotonic()
+    times = []
+    for _ in range(8):
+        await store.acquire("chat")
+        times.append(round(time.monotonic() - start, 2))
+    print(f"10 rps with burst 3, request times: {times}")
+
+
+async def main() -> None:
+    print(
+        f"memory for {CHATS} chats: "
+        f"TTLCache+Limiter {measure_memory(build_ttl_cache):.0f} MiB, "
+        f"GCRAStore {measure_memory(build_gcra_store):.0f} MiB",
+    )
+
+    def new_key(i: int) -> int:
+        return i
+
+    def round_robin(i: int) -> int:
+        return i % ROUND_ROBIN_CHATS
+
+    print(
+        f"acquire on a new key: TTLCache+Limiter {await bench_ttl_cache(new_key):.1f} us, "
+        f"GCRAStore {await bench_gcra_store(new_key):.1f} us",
+    )
+    print(
+        f"acquire over {ROUND_ROBIN_CHATS} chats round robin: "
+        f"TTLCache+Limiter {await bench_ttl_cache(round_robin):.1f} us, "
+        f"GCRAStore {await bench_gcra_store(round_robin):.1f} us",
+    )
+    await check_timing()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
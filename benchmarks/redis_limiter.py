@@ -0,0 +1,78 @@
+"""
+Общий лимитер на redis: соблюдение скорости несколькими процессами и задержка acquire
+
+Запуск: python benchmarks/redis_limiter.py
+Нужны djgram[redis] и fakeredis[lua], настоящий redis-server не требуется
+"""
+
+import asyncio
+import time
+
+import fakeredis
+from djgram.contrib.limits.base import acquire_tokens
+from djgram.contrib.limits.redis_limiter import RedisLimiter
+from limiter import Limiter
+from redis.asyncio import Redis
+
+N = 2000
+
+
+async def check_shared_rate(seconds: float = 2) -> None:
+    # Два "процесса" с общей корзиной на 30 запросов в секунду
+    redis = fakeredis.FakeAsyncRedis()
+    limiters = [RedisLimiter(redis, 30, 3, prefetch=3) for _ in range(2)]
+    start = time.perf_counter()
+    acquired = 0
+
+    async def run(limiter: RedisLimiter) -> None:
+        nonlocal acquired
+        while time.perf_counter() - start < seconds:
+            await limiter.acquire()
+            acquired += 1
+
+    await asyncio.gather(*(run(limiter) for limiter in limiters))
+    print(f"shared rate: {acquired / seconds:.1f} req/s (expected 30 plus burst)")
+
+
+async def check_fallback() -> None:
+    limiter = RedisLimiter(Redis(port=1, socket_connect_timeout=0.1), 100, 5)
+    # Первый вызов включает неудачные попытки подключения клиента redis
+    start = time.perf_counter()
+    await limiter.acquire()
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(10):
+        await limiter.acquire()
+    print(
+        f"fallback to local limiter: first acquire {first:.3f} s, "
+        f"next 10 acquires {time.perf_counter() - start:.3f} s (expected 0.05 s with burst 5 at 100 rps)",
+    )
+
+
+async def bench_acquire(prefetch: int) -> None:
+    limiter = RedisLimiter(fakeredis.FakeAsyncRedis(), 1e4, 100, prefetch=prefetch)
+    start = time.perf_counter()
+    for _ in range(N):
+        await limiter.acquire()
+    print(f"prefetch={prefetch}: {(time.perf_counter() - start) / N * 1e6:.0f} us/acquire")
+
+
+async def bench_local() -> None:
+    limiter = Limiter(1e4, 100)
+    start = time.perf_counter()
+    for _ in range(N):
+        await acquire_tokens(limiter, 1)
+    print(f"local Limiter: {(time.perf_counter() - start) / N * 1e6:.0f} us/acquire")
+
+
+async def main() -> None:
+    await check_shared_rate()
+    await check_fallback()
+    for prefetch in (1, 3, 10):
+        await bench_acquire(prefetch)
+    await bench_local()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 import os
+import warnings
 from datetime import timedelta
 
 from djgram.contrib.local_server.constants import TelegramLocalServerStatsAverage
@@ -17,12 +18,79 @@ CLICKHOUSE_PORT: int = 9000
 CLICKHOUSE_DB: str = "default"
 CLICKHOUSE_USER: str = "default"
 CLICKHOUSE_PASSWORD: str = ""
+#: Максимальное число соединений в пуле
+CLICKHOUSE_POOL_MAX_SIZE: int = 10
+#: Через сколько секунд простоя соединение закрывается
+CLICKHOUSE_POOL_IDLE_TIMEOUT: float = 300
+#: Через сколько секунд простоя соединение проверяется через ping перед использованием
+CLICKHOUSE_POOL_HEALTH_CHECK_INTERVAL: float = 30
+#: Пауза перед повторным подключением после первой ошибки в секундах, удваивается с каждой ошибкой
+CLICKHOUSE_RECONNECT_BACKOFF_MIN: float = 0.5
+#: Максимальная пауза перед повторным подключением в секундах
+CLICKHOUSE_RECONNECT_BACKOFF_MAX: float = 30
+#: Таблица в clickhouse с применёнными миграциями схемы
+CLICKHOUSE_MIGRATIONS_TABLE = "schema_migrations"
+#: Применять миграции схемы аналитики при запуске бота, а не только предупреждать о них
+#   Миграции, меняющие ключи сортировки, копируют таблицы целиком, и события, пришедшие во время копирования,
+#   теряются. Поэтому по умолчанию миграции применяются только командой python -m djgram migrate-clickhouse
+#   при остановленных ботах
+CLICKHOUSE_MIGRATE_ON_STARTUP = False
 
 #: Нужно ли обновлять полную информацию о чате на каждом взаимодействии пользователя с ботом
 #   Если включено, то каждый раз будет вызываться метод getChat https://core.telegram.org/bots/api#getchat
 TELEGRAM_CHAT_FULL_INFO_UPDATE_ON_EACH_EVENT = False
 #: Период обновления полной информации о чате
 TELEGRAM_CHAT_FULL_INFO_UPDATE_PERIOD = timedelta(hours=1)
+#: Ждать ли получения полной информации о чате перед обработкой update'а.
+#   По умолчанию обработчик получает сохранённую в базе информацию, а новая запрашивается в фоне.
+#   Если информации о чате ещё нет в базе, она запрашивается сразу в любом случае
+TELEGRAM_CHAT_FULL_INFO_WAIT_FOR_UPDATE = False
+#: Сколько запросов полной информации о чате выполнять одновременно в фоне
+TELEGRAM_CHAT_FULL_INFO_REFRESH_CONCURRENCY = 4
+#: Сколько полученных записей полной информации о чате сохранять в базу за раз
+TELEGRAM_CHAT_FULL_INFO_SAVE_BATCH_SIZE = 100
+#: Сколько секунд полученная полная информация о чате может ждать сохранения в базу
+TELEGRAM_CHAT_FULL_INFO_SAVE_INTERVAL = 1.0
+#: Раз в сколько секунд искать чаты с устаревшей полной информацией и обновлять их
+TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_INTERVAL = 600
+#: Сколько устаревших чатов выбирать из базы и сохранять за раз
+TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_BATCH_SIZE = 100
+#: Сколько запросов getChat в секунду можно тратить на обновление устаревших чатов,
+#   отдельно от остальных запросов к bot api
+TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_RATE = 5
+#: Сколько последних сохранённых пользователей и чатов telegram помнить,
+#   чтобы не обращаться к базе, когда они не изменились. 0 - не кешировать
+TELEGRAM_OBJECT_CACHE_SIZE = 10_000
+#: Через сколько секунд закешированный пользователь или чат снова сверяется с базой
+TELEGRAM_OBJECT_CACHE_TTL = 300
+
+#: Сколько строк аналитики одной таблицы записывать в clickhouse за раз
+ANALYTICS_WRITER_BATCH_SIZE = 1000
+#: Сколько секунд строка аналитики может ждать записи в clickhouse
+ANALYTICS_WRITER_FLUSH_INTERVAL = 1
+#: Сколько строк аналитики всего может ждать записи, остальные отбрасываются
+ANALYTICS_WRITER_MAX_QUEUE_SIZE = 100_000
+#: Сколько потоков строят строки аналитики (model_dump, orjson) вне цикла событий, 0 - строить в цикле событий
+ANALYTICS_SERIALIZATION_WORKERS = 1
+#: Папка для журнала аналитики, которую не удалось записать в clickhouse, None - не сохранять
+ANALYTICS_SPILL_DIR = "analytics_spill"
+#: Размер сегмента журнала в байтах, после которого начинается новый сегмент
+ANALYTICS_SPILL_SEGMENT_SIZE = 16 * 1024 * 1024
+#: Максимальный размер журнала в байтах, аналитика сверх него отбрасывается
+ANALYTICS_SPILL_MAX_SIZE = 1024 * 1024 * 1024
+#: Сколько последних вставок в каждую таблицу аналитики clickhouse помнит для отбрасывания повторов
+#   из журнала (non_replicated_deduplication_window). Используется миграцией 0006_deduplication_window
+ANALYTICS_DEDUPLICATION_WINDOW = 1000
+#: Приёмник аналитики, путь до наследника djgram.contrib.analytics.sinks.AnalyticsSink
+#   Есть ClickHouseSink для записи в clickhouse, FileSink для записи в сжатые файлы ndjson без сети
+#   и MemorySink с кольцевым буфером в памяти для тестов
+ANALYTICS_SINK = "djgram.contrib.analytics.sinks.ClickHouseSink"
+#: Папка для файлов аналитики FileSink
+ANALYTICS_FILE_SINK_DIR = "analytics_files"
+#: Размер файла аналитики FileSink в байтах до сжатия, после которого начинается новый файл
+ANALYTICS_FILE_SINK_MAX_FILE_SIZE = 64 * 1024 * 1024
+#: Время в секундах, после которого FileSink начинает новый файл аналитики
+ANALYTICS_FILE_SINK_MAX_FILE_AGE = 60 * 60
 
 #: Таблица в clickhouse, в которую логируются все обновления телеграмм
 #   https://core.telegram.org/bots/api#getting-updates
@@ -37,8 +105,37 @@ ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_GENERAL_TABLE = "local_server_general_stat
 ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_BOT_TABLE = "local_server_bot_statistics"
 #: Период сбора статистики локального сервера в секундах
 ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_COLLECTION_PERIOD = 60
-#: Какое среднее сохраняется в статистику, возможные варианты
-ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX = TelegramLocalServerStatsAverage.ONE_MINUTE
+#: Какие средние сохраняются в статистику, по строке на каждое за один сбор
+ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES = tuple(TelegramLocalServerStatsAverage)
+#: Таблица в clickhouse, в которую сохраняется статистика лимитера запросов к bot api
+ANALYTICS_LIMITER_STATS_TABLE = "limiter_statistics"
+#: Период сбора статистики лимитера в секундах
+ANALYTICS_LIMITER_STATS_COLLECTION_PERIOD = 60
+#: Через сколько дней удаляются события аналитики: update, bot_send_analytics, dialog_analytics
+#   Используется при создании таблиц миграциями, потом меняется только через ALTER TABLE ... MODIFY TTL
+ANALYTICS_EVENTS_TTL_DAYS = 365
+#: Через сколько дней удаляется статистика лимитера, локального сервера и выборки аналитики
+ANALYTICS_STATISTICS_TTL_DAYS = 90
+
+#: Доля сохраняемых строк аналитики для таблицы от 0 до 1, по умолчанию сохраняются все строки
+#   Например, 0.1 для ANALYTICS_BOT_SEND_TABLE сохраняет каждый десятый вызов bot api
+ANALYTICS_SAMPLING_RATES: dict[str, float] = {}
+#: Доля сохраняемых строк для ключа в таблице, важнее ANALYTICS_SAMPLING_RATES
+#   Ключ - тип события для update, метод bot api для bot_send_analytics, обработчик для dialog_analytics
+#   Например, 0 для GetChat в ANALYTICS_BOT_SEND_TABLE не сохраняет вызовы getChat
+ANALYTICS_SAMPLING_KEY_RATES: dict[str, dict[str, float]] = {}
+#: Приоритет таблиц при переполнении очереди записи, 0 - не сбрасываются, чем больше, тем раньше сбрасываются
+ANALYTICS_SHEDDING_PRIORITIES: dict[str, int] = {
+    ANALYTICS_DIALOG_TABLE: 0,
+    ANALYTICS_UPDATES_TABLE: 1,
+    ANALYTICS_BOT_SEND_TABLE: 2,
+}
+#: Заполнение очереди записи от 0 до 1, с которого начинают сбрасываться строки наименее важных таблиц
+ANALYTICS_SHEDDING_HIGH_WATER_MARK = 0.5
+#: Таблица в clickhouse, в которую сохраняется число увиденных, пропущенных и отброшенных строк аналитики
+ANALYTICS_SAMPLING_STATS_TABLE = "analytics_sampling_statistics"
+#: Период сохранения статистики выборки аналитики в секундах
+ANALYTICS_SAMPLING_STATS_PERIOD = 60
 
 #: Путь до папки с диаграммами диалогов
 DIALOG_DIAGRAMS_DIR = "dialog_diagrams"
@@ -48,6 +145,12 @@ ENABLE_DIALOG_DIAGRAMS_GENERATION = False
 
 #: Какое время пользователь считает активным для получения рассылки
 ACTIVE_USER_TIMEOUT = 60 * 60 * 24 * 14
+#: Не чаще чем раз в сколько секунд записывать время последнего взаимодействия пользователя.
+#   0 - записывать при каждом update'е
+AUTH_LAST_INTERACTION_UPDATE_INTERVAL = 0
+#: Раз в сколько секунд записывать накопленное время последнего взаимодействия пользователей одним UPDATE в фоне.
+#   0 - записывать в сессии update'а
+AUTH_LAST_INTERACTION_FLUSH_INTERVAL = 0
 
 TELEGRAM_BROADCAST_TIMEOUT = 0.05  # limit to 20 messages per second (max = 30)
 TELEGRAM_BROADCAST_LOGGING_PERIOD = 5  # sec
@@ -71,5 +174,19 @@ ADMIN_ROWS_PER_PAGE = 5
 if os.path.exists("configs.py"):  # noqa: PTH110
     from configs import *  # noqa: F401,F403,RUF100
 
-if ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX not in (1, 2, 3, 4):
-    raise ValueError("ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX should be in (1, 2, 3, 4)")
+# Старая настройка с одним окном усреднения
+if "ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX" in globals():
+    warnings.warn(
+        "ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX is deprecated, "
+        "use ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES with a tuple of windows",
+        FutureWarning,
+        stacklevel=1,
+    )
+    ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES = (
+        globals()["ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX"],
+    )
+
+if not ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES or any(
+    index not in (1, 2, 3, 4) for index in ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES
+):
+    raise ValueError("ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES should contain values from (1, 2, 3, 4)")
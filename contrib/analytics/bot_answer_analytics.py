@@ -1,4 +1,4 @@
-import asyncio
+import functools
 import logging
 import os
 import time
@@ -12,13 +12,12 @@ from aiogram.methods import TelegramMethod
 from aiogram.types import BufferedInputFile, FSInputFile, InputFile, URLInputFile
 from djgram.configs import ANALYTICS_BOT_SEND_TABLE
 from djgram.contrib.logs.context import UPDATE_ID
-from djgram.db import clickhouse
 from djgram.utils.input_file_ext import S3FileInput
 from djgram.utils.serialization import jsonify
 from djgram.utils.upload import LoggingInputFile
 
-from .misc import BOT_SEND_ANALYTICS_DDL_SQL
 from .utils import set_defaults
+from .writer import admit_analytics, write_analytics_deferred
 
 T = TypeVar("T")
 
@@ -26,8 +25,6 @@ BotCallMethod: TypeAlias = Callable[[Bot, TelegramMethod[T], int | None], Awaita
 
 logger = logging.getLogger(__name__)
 
-_pending_tasks = set[asyncio.Task]()
-
 
 def _serialize_input_file(input_file: InputFile) -> dict[str, Any]:
     if isinstance(input_file, LoggingInputFile):
@@ -69,6 +66,31 @@ def _serialize_default(obj: Any) -> Any:
     raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
 
 
+def get_bot_send_dict_for_clickhouse(  # noqa: PLR0913
+    *,
+    bot: Bot,
+    method: TelegramMethod[Any],
+    answer: Any,
+    date: datetime,
+    execution_time: float,
+    request_timeout: int | None,
+    update_id: int | None,
+) -> dict[str, Any]:
+    method_data = method.model_dump(mode="python", exclude_unset=True)
+    method_data = set_defaults(method_data, bot)
+
+    return {
+        "update_id": update_id,
+        "bot_id": bot.id,
+        "date": date,
+        "method": method.__class__.__name__,
+        "method_data": orjson.dumps(method_data, default=_serialize_default),
+        "execution_time": execution_time,
+        "request_timeout": request_timeout,
+        "answer": orjson.dumps(jsonify(answer)),
+    }
+
+
 def analytics_wrapper(original_call: BotCallMethod) -> BotCallMethod:
     """
     Логирует все вызываемые методы bot api в clickhouse
@@ -81,23 +103,22 @@ def analytics_wrapper(original_call: BotCallMethod) -> BotCallMethod:
         answer = await original_call(self, method, request_timeout)
         end = time.perf_counter()
 
-        method_data = method.model_dump(mode="python", exclude_unset=True)
-        method_data = set_defaults(method_data, self)
-
-        data = {
-            "update_id": UPDATE_ID.get(),
-            "bot_id": self.id,
-            "date": date,
-            "method": method.__class__.__name__,
-            "method_data": orjson.dumps(method_data, default=_serialize_default),
-            "execution_time": end - start,
-            "request_timeout": request_timeout,
-            "answer": orjson.dumps(jsonify(answer)),
-        }
-
-        task = asyncio.create_task(clickhouse.safe_insert_dict(ANALYTICS_BOT_SEND_TABLE, data))
-        task.add_done_callback(_pending_tasks.remove)
-        _pending_tasks.add(task)
+        method_name = method.__class__.__name__
+        if not admit_analytics(ANALYTICS_BOT_SEND_TABLE, method_name):
+            return answer
+
+        # Ответ неизменяемый, а метод вызывающий может изменить после вызова, поэтому копируем его
+        build = functools.partial(
+            get_bot_send_dict_for_clickhouse,
+            bot=self,
+            method=method.model_copy(),
+            answer=answer,
+            date=date,
+            execution_time=end - start,
+            request_timeout=request_timeout,
+            update_id=UPDATE_ID.get(),
+        )
+        write_analytics_deferred(ANALYTICS_BOT_SEND_TABLE, build, method_name, admitted=True)
 
         return answer
 
@@ -105,11 +126,5 @@ def analytics_wrapper(original_call: BotCallMethod) -> BotCallMethod:
 
 
 def setup_bot_answer_analytics() -> None:
-    logger.debug("Ensuring clickhouse tables for bot send analytics")
-    with open(BOT_SEND_ANALYTICS_DDL_SQL, encoding="utf-8") as sql_file:  # noqa: PTH123
-        task = clickhouse.run_sql_from_sync(sql_file.read())
-        task.add_done_callback(_pending_tasks.remove)
-        _pending_tasks.add(task)
-
     # noinspection PyTypeChecker
     Bot.__call__ = analytics_wrapper(Bot.__call__)  # pyright: ignore [reportAttributeAccessIssue]
@@ -55,10 +55,10 @@ Todo: улучшить взаимодействие с наследниками
 - [ ] StubScroll
 """
 
-import asyncio
-import copy
+import functools
 import logging
 import time
+from dataclasses import dataclass
 from datetime import UTC, datetime
 from typing import TYPE_CHECKING, Any, Self, cast
 
@@ -76,8 +76,7 @@ from aiogram_dialog.widgets.common import Actionable
 from aiogram_dialog.widgets.input import BaseInput, MessageInput, TextInput
 from aiogram_dialog.widgets.kbd import Calendar, Keyboard
 from djgram.configs import ANALYTICS_DIALOG_TABLE
-from djgram.contrib.analytics.misc import DIALOG_ANALYTICS_DDL_SQL
-from djgram.db import clickhouse
+from djgram.contrib.analytics.writer import admit_analytics, write_analytics_deferred
 from djgram.system_configs import MIDDLEWARE_AUTH_USER_KEY
 from djgram.utils.misc import suppress_decorator_async
 from pydantic import ConfigDict
@@ -86,16 +85,155 @@ if TYPE_CHECKING:
     from aiogram.filters import CommandObject
 logger = logging.getLogger("dialog_analytics")
 
-# Задачи сохранения аналитики в clickhouse
-# Временно сохраняем из тут, чтобы сборщик мусора не убил раньше времени
-# https://docs.python.org/3.12/library/asyncio-task.html#asyncio.create_task
-_pending_tasks = set[asyncio.Task]()
-
 DIALOG_ANALYTICS_ENABLED = False
 
 
-def _json_dump_optional(obj: Any, name: str) -> str:
-    return orjson.dumps(getattr(obj, name, None)).decode()
+def _json_dump_optional(obj: Any, name: str) -> str | None:
+    try:
+        return orjson.dumps(getattr(obj, name, None)).decode()
+    except TypeError as exc:
+        logger.warning("Can not serialize %s for dialog analytics: %s", name, exc)
+        return None
+
+
+# Так сериализуются данные диалога, когда контекста нет
+_NULL_JSON = "null"
+
+
+@dataclass(frozen=True, slots=True)
+class ContextSnapshot:
+    """
+    Поля Context, которые сохраняются в аналитику, на момент создания снимка
+
+    Данные диалога сразу сериализуются в json: это дешевле deepcopy и не зависит от их дальнейших изменений.
+    """
+
+    id: str
+    stack_id: str
+    state: State
+    start_data: str | None
+    dialog_data: str | None
+    widget_data: str | None
+
+    @classmethod
+    def from_context(cls, context: "Context | ContextSnapshot | None") -> "ContextSnapshot | None":
+        if context is None or isinstance(context, ContextSnapshot):
+            return context
+
+        return cls(
+            id=context.id,
+            stack_id=context.stack_id,
+            state=context.state,
+            start_data=_json_dump_optional(context, "start_data"),
+            dialog_data=_json_dump_optional(context, "dialog_data"),
+            widget_data=_json_dump_optional(context, "widget_data"),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class StackSnapshot:
+    """
+    Поля Stack, которые сохраняются в аналитику, на момент создания снимка
+    """
+
+    id: str
+    intents: list[str]
+    last_message_id: int | None
+    last_reply_keyboard: bool
+    last_media_id: str | None
+    last_media_unique_id: str | None
+    last_income_media_group_id: str | None
+
+    @classmethod
+    def from_stack(cls, stack: "Stack | StackSnapshot | None") -> "StackSnapshot | None":
+        if stack is None or isinstance(stack, StackSnapshot):
+            return stack
+
+        return cls(
+            id=stack.id,
+            intents=stack.intents.copy(),
+            last_message_id=stack.last_message_id,
+            last_reply_keyboard=stack.last_reply_keyboard,
+            last_media_id=stack.last_media_id,
+            last_media_unique_id=stack.last_media_unique_id,
+            last_income_media_group_id=stack.last_income_media_group_id,
+        )
+
+
+@dataclass(slots=True)
+class DialogEvent:
+    """
+    Данные взаимодействия с диалогом, собранные в обработчике
+
+    Содержит только значения, ссылки на неизменяемые объекты aiogram и снимки состояния диалога,
+    поэтому не зависит от следующих обработчиков. Построение и проверка DialogAnalytics выполняются в пуле потоков.
+    """
+
+    date: datetime
+    update_id: int
+    processor: str
+    processed: bool
+    process_time: float | None
+    not_processed_reason: str | None
+    widget_id: str | None
+    widget_type: str
+    callback: CallbackQuery | None
+    message: Message | None
+    event_context: EventContext
+    user_id: int | None
+    command: "CommandObject | None"
+    original_callback_data: str | None
+    state_before: str | None
+    state_new: str | None
+    widget_fields: dict[str, Any]
+    aiogd_context_before: ContextSnapshot | None
+    aiogd_stack_before: StackSnapshot | None
+    aiogd_context_new: ContextSnapshot | None
+    aiogd_stack_new: StackSnapshot | None
+
+    @classmethod
+    def capture(  # noqa: PLR0913
+        cls,
+        *,
+        processor: str,
+        processed: bool,
+        process_time: float | None,
+        not_processed_reason: str | None,
+        widget: Actionable | None,
+        callback: CallbackQuery | None,
+        message: Message | None,
+        middleware_data: dict[str, Any],
+        state_before: str | None,
+        state_new: str | None,
+        widget_fields: dict[str, Any],
+        aiogd_context_before: ContextSnapshot | Context | None,
+        aiogd_stack_before: StackSnapshot | Stack | None,
+    ) -> Self:
+        user = middleware_data[MIDDLEWARE_AUTH_USER_KEY]
+
+        return cls(
+            date=datetime.now(tz=UTC),
+            update_id=middleware_data["event_update"].update_id,
+            processor=processor,
+            processed=processed,
+            process_time=process_time,
+            not_processed_reason=not_processed_reason,
+            widget_id=getattr(widget, "widget_id", None),
+            widget_type=type(widget).__name__,
+            callback=callback,
+            message=message,
+            event_context=middleware_data[EVENT_CONTEXT_KEY],
+            user_id=user.id if user is not None else None,
+            command=middleware_data.get("command"),
+            original_callback_data=middleware_data.get(CALLBACK_DATA_KEY),
+            state_before=state_before,
+            state_new=state_new,
+            widget_fields=widget_fields,
+            aiogd_context_before=ContextSnapshot.from_context(aiogd_context_before),
+            aiogd_stack_before=StackSnapshot.from_stack(aiogd_stack_before),
+            aiogd_context_new=ContextSnapshot.from_context(middleware_data[CONTEXT_KEY]),
+            aiogd_stack_new=StackSnapshot.from_stack(middleware_data[STACK_KEY]),
+        )
 
 
 class DialogAnalytics(pydantic.BaseModel):
@@ -181,15 +319,7 @@ class DialogAnalytics(pydantic.BaseModel):
     aiogd_stack_last_income_media_group_id_new: str | None = None
 
     @staticmethod
-    def get_user_id(middleware_data: dict[str, Any]) -> int | None:
-        user = middleware_data[MIDDLEWARE_AUTH_USER_KEY]
-        if user is None:
-            return None
-
-        return user.id
-
-    @staticmethod
-    def get_widget_text(callback: CallbackQuery | None, middleware_data: dict[str, Any]) -> str | None:
+    def get_widget_text(callback: CallbackQuery | None, aiogd_original_callback_data: str | None) -> str | None:
         if callback is None:
             return None
 
@@ -198,8 +328,6 @@ class DialogAnalytics(pydantic.BaseModel):
         if (reply_markup := getattr(callback.message, "reply_markup", None)) is None:
             return None
 
-        aiogd_original_callback_data = middleware_data[CALLBACK_DATA_KEY]
-
         for row in reply_markup.inline_keyboard:
             for button in row:
                 if button.callback_data == aiogd_original_callback_data:
@@ -218,42 +346,32 @@ class DialogAnalytics(pydantic.BaseModel):
         return None
 
     @classmethod
-    def from_event(  # noqa: PLR0913
-        cls,
-        *,
-        processor: str,
-        processed: bool,
-        process_time: float | None,
-        not_processed_reason: str | None,
-        widget: Actionable | None,
-        callback: CallbackQuery | None,
-        message: Message | None,
-        middleware_data: dict[str, Any],
-        state_before: str | None,
-        state_new: str | None,
-        aiogd_context_before: Context | None,
-        aiogd_stack_before: Stack | None,
-    ) -> Self:
-        event_context: EventContext = middleware_data[EVENT_CONTEXT_KEY]
-
-        aiogd_context_new: Context = middleware_data[CONTEXT_KEY]
-        aiogd_stack_new: Stack = middleware_data[STACK_KEY]
+    def from_event(cls, event: DialogEvent) -> Self:
+        """
+        Строит статистику из данных, собранных в обработчике
+        """
+        callback = event.callback
+        message = event.message
+        command = event.command
+        event_context = event.event_context
+        aiogd_context_before = event.aiogd_context_before
+        aiogd_stack_before = event.aiogd_stack_before
+        aiogd_context_new = event.aiogd_context_new
+        aiogd_stack_new = event.aiogd_stack_new
 
         aiogd_context_state_before: State | None = getattr(aiogd_context_before, "state", None)
         aiogd_context_state_new: State | None = getattr(aiogd_context_new, "state", None)
 
-        command: CommandObject | None = middleware_data.get("command")
-
         # noinspection PyProtectedMember
         return cls(
-            date=datetime.now(tz=UTC),
-            update_id=middleware_data["event_update"].update_id,
+            date=event.date,
+            update_id=event.update_id,
             callback_query=callback.model_dump_json(exclude_unset=True) if callback is not None else None,
             message=message.model_dump_json(exclude_unset=True) if message is not None else None,
-            processor=processor,
-            processed=processed,
-            process_time=process_time,
-            not_processed_reason=not_processed_reason,
+            processor=event.processor,
+            processed=event.processed,
+            process_time=event.process_time,
+            not_processed_reason=event.not_processed_reason,
             command_prefix=command.prefix if command is not None else None,
             command_command=command.command if command is not None else None,
             command_mention=command.mention if command is not None else None,
@@ -263,24 +381,25 @@ class DialogAnalytics(pydantic.BaseModel):
             telegram_chat_id=event_context.chat_id,
             telegram_thread_id=event_context.thread_id,
             telegram_business_connection_id=event_context.business_connection_id,
-            user_id=cls.get_user_id(middleware_data),
+            user_id=event.user_id,
             # Widget info
-            widget_id=getattr(widget, "widget_id", None),
-            widget_type=type(widget).__name__,
-            widget_text=cls.get_widget_text(callback, middleware_data),
+            widget_id=event.widget_id,
+            widget_type=event.widget_type,
+            widget_text=cls.get_widget_text(callback, event.original_callback_data),
+            **event.widget_fields,
             # FSM state
-            state=state_before or getattr(aiogd_context_state_before, "state", None),
-            state_new=state_new or getattr(aiogd_context_state_new, "state", None),
-            aiogd_original_callback_data=middleware_data.get(CALLBACK_DATA_KEY),
+            state=event.state_before or getattr(aiogd_context_state_before, "state", None),
+            state_new=event.state_new or getattr(aiogd_context_state_new, "state", None),
+            aiogd_original_callback_data=event.original_callback_data,
             # aiogram_dialog.api.entities.Context
             # Контекста может не быть, когда взаимодействие происходит вне aiogram-dialog
             aiogd_context_intent_id=getattr(aiogd_context_before, "id", None),
             aiogd_context_stack_id=getattr(aiogd_context_before, "stack_id", None),
             aiogd_context_state=getattr(aiogd_context_state_before, "state", None),
             aiogd_context_state_group_name=cls.get_aiogd_context_group_name(aiogd_context_state_before),
-            aiogd_context_start_data=_json_dump_optional(aiogd_context_before, "start_data"),
-            aiogd_context_dialog_data=_json_dump_optional(aiogd_context_before, "dialog_data"),
-            aiogd_context_widget_data=_json_dump_optional(aiogd_context_before, "widget_data"),
+            aiogd_context_start_data=getattr(aiogd_context_before, "start_data", _NULL_JSON),
+            aiogd_context_dialog_data=getattr(aiogd_context_before, "dialog_data", _NULL_JSON),
+            aiogd_context_widget_data=getattr(aiogd_context_before, "widget_data", _NULL_JSON),
             # aiogram_dialog.api.entities.Stack
             aiogd_stack_id=getattr(aiogd_stack_before, "id", None),
             aiogd_stack_intents=getattr(aiogd_stack_before, "intents", []),
@@ -296,9 +415,9 @@ class DialogAnalytics(pydantic.BaseModel):
             aiogd_context_stack_id_new=getattr(aiogd_context_new, "stack_id", None),
             aiogd_context_state_new=getattr(aiogd_context_state_new, "state", None),
             aiogd_context_state_group_name_new=cls.get_aiogd_context_group_name(aiogd_context_state_new),
-            aiogd_context_start_data_new=_json_dump_optional(aiogd_context_new, "start_data"),
-            aiogd_context_dialog_data_new=_json_dump_optional(aiogd_context_new, "dialog_data"),
-            aiogd_context_widget_data_new=_json_dump_optional(aiogd_context_new, "widget_data"),
+            aiogd_context_start_data_new=getattr(aiogd_context_new, "start_data", _NULL_JSON),
+            aiogd_context_dialog_data_new=getattr(aiogd_context_new, "dialog_data", _NULL_JSON),
+            aiogd_context_widget_data_new=getattr(aiogd_context_new, "widget_data", _NULL_JSON),
             # aiogram_dialog.api.entities.Stack
             aiogd_stack_id_new=getattr(aiogd_stack_new, "id", None),
             aiogd_stack_intents_new=getattr(aiogd_stack_new, "intents", []),
@@ -309,33 +428,62 @@ class DialogAnalytics(pydantic.BaseModel):
             aiogd_stack_last_income_media_group_id_new=getattr(aiogd_stack_new, "last_income_media_group_id", None),
         )
 
-    async def extend_from_calendar(
-        self,
+    @staticmethod
+    async def get_calendar_fields(
         calendar: Calendar,
         widget_data: dict[str, Any],
         manager: DialogManager,
-    ) -> None:
+    ) -> dict[str, Any]:
         # noinspection PyProtectedMember
         calendar_user_config = await calendar._get_user_config(widget_data, manager)  # noqa: SLF001
 
-        self.calendar_user_config_firstweekday = calendar_user_config.firstweekday
+        fields: dict[str, Any] = {"calendar_user_config_firstweekday": calendar_user_config.firstweekday}
         _timezone = calendar_user_config.timezone
         if _timezone is not None:
-            self.calendar_user_config_timezone_name = _timezone.tzname(None)
-            self.calendar_user_config_timezone_offset = _timezone.utcoffset(None).seconds
+            fields["calendar_user_config_timezone_name"] = _timezone.tzname(None)
+            fields["calendar_user_config_timezone_offset"] = _timezone.utcoffset(None).seconds
+
+        return fields
 
-    async def extend_from(self, keyboard: Keyboard, middleware_data: dict[str, Any]) -> None:
+    @classmethod
+    async def get_widget_fields(cls, keyboard: Keyboard, middleware_data: dict[str, Any]) -> dict[str, Any]:
+        """
+        Возвращает дополнительные данные виджета для from_event
+        """
         aiogd_context: Context = middleware_data[CONTEXT_KEY]
         dialog_manager = middleware_data.get(MANAGER_KEY)
 
         if isinstance(keyboard, Calendar):
-            await self.extend_from_calendar(keyboard, aiogd_context.widget_data, cast(DialogManager, dialog_manager))
-            return
+            return await cls.get_calendar_fields(
+                keyboard,
+                aiogd_context.widget_data,
+                cast(DialogManager, dialog_manager),
+            )
+
+        return {}
+
 
-    async def save_to_clickhouse(self) -> None:
-        task = asyncio.create_task(clickhouse.safe_insert_dict(ANALYTICS_DIALOG_TABLE, self.model_dump(mode="python")))
-        task.add_done_callback(_pending_tasks.remove)
-        _pending_tasks.add(task)
+def _build_dialog_analytics_row(event: DialogEvent) -> dict:
+    return DialogAnalytics.from_event(event).model_dump(mode="python")
+
+
+def _save_dialog_event(event: DialogEvent, log_message: str) -> None:
+    # Модель строится и проверяется в пуле потоков записи аналитики
+    write_analytics_deferred(
+        ANALYTICS_DIALOG_TABLE,
+        functools.partial(_build_dialog_analytics_row, event),
+        event.processor,
+        admitted=True,
+    )
+    logger.info(
+        log_message,
+        event.user_id,
+        event.event_context.chat_id,
+        event.widget_type,
+        event.widget_id,
+        getattr(event.aiogd_context_before, "id", None),
+        getattr(getattr(event.aiogd_context_before, "state", None), "state", None),
+    )
 
 
 @suppress_decorator_async(Exception, logging_level=logging.ERROR)
@@ -348,10 +496,19 @@ async def save_keyboard_statistics(  # noqa: PLR0913
     callback: CallbackQuery,
     middleware_data: dict[str, Any],
     state_before: str | None,
-    aiogd_context_before: Context | None,
-    aiogd_stack_before: Stack | None,
+    aiogd_context_before: ContextSnapshot | Context | None,
+    aiogd_stack_before: StackSnapshot | Stack | None,
 ) -> None:
-    dialog_analytics = DialogAnalytics.from_event(
+    """
+    Собирает данные нажатия на кнопку, статистика строится и сохраняется в фоне
+    """
+    if not admit_analytics(ANALYTICS_DIALOG_TABLE, processor):
+        return
+
+    # Новое состояние и данные виджета читаются сразу, пока их не изменили следующие обработчики
+    state_new = await middleware_data["state"].get_state()
+    widget_fields = await DialogAnalytics.get_widget_fields(keyboard, middleware_data) if keyboard is not None else {}
+    event = DialogEvent.capture(
         processor=processor,
         processed=processed,
         process_time=process_time,
@@ -361,23 +518,12 @@ async def save_keyboard_statistics(  # noqa: PLR0913
         message=None,
         middleware_data=middleware_data,
         state_before=state_before,
-        state_new=await middleware_data["state"].get_state(),
+        state_new=state_new,
+        widget_fields=widget_fields,
         aiogd_context_before=aiogd_context_before,
         aiogd_stack_before=aiogd_stack_before,
     )
-    if keyboard is not None:
-        await dialog_analytics.extend_from(keyboard, middleware_data)
-
-    await dialog_analytics.save_to_clickhouse()
-    logger.info(
-        "User %s in chat %s clicked on %s %s in dialog %s (state %s)",
-        dialog_analytics.user_id,
-        dialog_analytics.telegram_chat_id,
-        dialog_analytics.widget_type,
-        dialog_analytics.widget_id,
-        dialog_analytics.aiogd_context_intent_id,
-        dialog_analytics.aiogd_context_state,
-    )
+    _save_dialog_event(event, "User %s in chat %s clicked on %s %s in dialog %s (state %s)")
 
 
 async def keyboard_process_callback(
@@ -388,9 +534,10 @@ async def keyboard_process_callback(
 ) -> bool:
     # TODO: разобраться, когда у callback нет data
     if callback.data == self.widget_id:
-        aiogd_context_before: Context = copy.deepcopy(manager.middleware_data[CONTEXT_KEY])
-        aiogd_stack_before: Stack = copy.deepcopy(manager.middleware_data[STACK_KEY])
-        state_before: str | None = await manager.middleware_data["state"].get_state()
+        aiogd_context_before = ContextSnapshot.from_context(manager.middleware_data[CONTEXT_KEY])
+        aiogd_stack_before = StackSnapshot.from_stack(manager.middleware_data[STACK_KEY])
+        # Состояние FSM до обработки уже прочитано FSMContextMiddleware aiogram
+        state_before: str | None = manager.middleware_data.get("raw_state")
 
         start = time.perf_counter()
         processed = await self._process_own_callback(
@@ -414,9 +561,10 @@ async def keyboard_process_callback(
 
     prefix = self.callback_prefix()
     if prefix and callback.data.startswith(prefix):  # pyright: ignore [reportOptionalMemberAccess]
-        aiogd_context_before: Context = copy.deepcopy(manager.middleware_data[CONTEXT_KEY])
-        aiogd_stack_before: Stack = copy.deepcopy(manager.middleware_data[STACK_KEY])
-        state_before: str | None = await manager.middleware_data["state"].get_state()
+        aiogd_context_before = ContextSnapshot.from_context(manager.middleware_data[CONTEXT_KEY])
+        aiogd_stack_before = StackSnapshot.from_stack(manager.middleware_data[STACK_KEY])
+        # Состояние FSM до обработки уже прочитано FSMContextMiddleware aiogram
+        state_before: str | None = manager.middleware_data.get("raw_state")
 
         start = time.perf_counter()
         processed = await self._process_item_callback(
@@ -457,10 +605,18 @@ async def save_input_statistics(  # noqa: PLR0913
     message: Message,
     middleware_data: dict[str, Any],
     state_before: str | None,
-    aiogd_context_before: Context | None,
-    aiogd_stack_before: Stack | None,
+    aiogd_context_before: ContextSnapshot | Context | None,
+    aiogd_stack_before: StackSnapshot | Stack | None,
 ) -> None:
-    dialog_analytics = DialogAnalytics.from_event(
+    """
+    Собирает данные ввода, статистика строится и сохраняется в фоне
+    """
+    if not admit_analytics(ANALYTICS_DIALOG_TABLE, processor):
+        return
+
+    # Новое состояние читается сразу, пока его не изменили следующие обработчики
+    state_new = await middleware_data["state"].get_state()
+    event = DialogEvent.capture(
         processor=processor,
         processed=processed,
         process_time=process_time,
@@ -470,21 +626,12 @@ async def save_input_statistics(  # noqa: PLR0913
         message=message,
         middleware_data=middleware_data,
         state_before=state_before,
-        state_new=await middleware_data["state"].get_state(),
+        state_new=state_new,
+        widget_fields={},
         aiogd_context_before=aiogd_context_before,
         aiogd_stack_before=aiogd_stack_before,
     )
-
-    await dialog_analytics.save_to_clickhouse()
-    logger.info(
-        "User %s in chat %s input in %s %s in dialog %s (state %s)",
-        dialog_analytics.user_id,
-        dialog_analytics.telegram_chat_id,
-        dialog_analytics.widget_type,
-        dialog_analytics.widget_id,
-        dialog_analytics.aiogd_context_intent_id,
-        dialog_analytics.aiogd_context_state,
-    )
+    _save_dialog_event(event, "User %s in chat %s input in %s %s in dialog %s (state %s)")
 
 
 async def message_input_process_message(
@@ -501,9 +648,10 @@ async def message_input_process_message(
         ):
             processed = False
 
-    aiogd_context_before: Context = copy.deepcopy(manager.middleware_data[CONTEXT_KEY])
-    aiogd_stack_before: Stack = copy.deepcopy(manager.middleware_data[STACK_KEY])
-    state_before: str | None = await manager.middleware_data["state"].get_state()
+    aiogd_context_before = ContextSnapshot.from_context(manager.middleware_data[CONTEXT_KEY])
+    aiogd_stack_before = StackSnapshot.from_stack(manager.middleware_data[STACK_KEY])
+    # Состояние FSM до обработки уже прочитано FSMContextMiddleware aiogram
+    state_before: str | None = manager.middleware_data.get("raw_state")
 
     if processed:
         start = time.perf_counter()
@@ -534,9 +682,10 @@ async def text_input_process_message(
     dialog: DialogProtocol,
     manager: DialogManager,
 ) -> bool:
-    aiogd_context_before: Context = copy.deepcopy(manager.middleware_data[CONTEXT_KEY])
-    aiogd_stack_before: Stack = copy.deepcopy(manager.middleware_data[STACK_KEY])
-    state_before: str | None = await manager.middleware_data["state"].get_state()
+    aiogd_context_before = ContextSnapshot.from_context(manager.middleware_data[CONTEXT_KEY])
+    aiogd_stack_before = StackSnapshot.from_stack(manager.middleware_data[STACK_KEY])
+    # Состояние FSM до обработки уже прочитано FSMContextMiddleware aiogram
+    state_before: str | None = manager.middleware_data.get("raw_state")
 
     if message.content_type != ContentType.TEXT:
         await save_input_statistics(
@@ -614,12 +763,6 @@ def patch_input() -> None:
 
 
 def setup_dialog_analytics() -> None:
-    logger.debug("Ensuring clickhouse tables for dialog analytics")
-    with open(DIALOG_ANALYTICS_DDL_SQL, encoding="utf-8") as sql_file:  # noqa: PTH123
-        task = clickhouse.run_sql_from_sync(sql_file.read())
-        task.add_done_callback(_pending_tasks.remove)
-        _pending_tasks.add(task)
-
     patch_keyboard()
     patch_input()
 
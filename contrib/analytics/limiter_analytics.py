@@ -0,0 +1,129 @@
+"""
+Периодическое сохранение метрик лимитера запросов к bot api в clickhouse
+"""
+
+import logging
+from datetime import UTC, datetime
+from typing import Any
+
+from aiogram import Bot
+from djgram.configs import ANALYTICS_LIMITER_STATS_COLLECTION_PERIOD, ANALYTICS_LIMITER_STATS_TABLE
+from djgram.contrib.analytics.writer import prepare_analytics_writer, write_analytics
+from djgram.contrib.limits.limiter import LimitCaller
+from djgram.contrib.limits.metrics import LimiterMetricsSnapshot, WaitHistogram
+from djgram.utils.async_tools import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+class LimiterStatsCollector:
+    """
+    Сохраняет изменения метрик лимитера за каждый период
+    """
+
+    def __init__(self, bot_id: int, limit_caller: LimitCaller):
+        """
+        Args:
+            bot_id: id бота, с которым сохраняется статистика
+            limit_caller: лимитер, метрики которого сохраняются
+        """
+        self.bot_id = bot_id
+        self.limit_caller = limit_caller
+        self._previous = limit_caller.get_metrics()
+
+    def get_rows(self, current: LimiterMetricsSnapshot) -> list[dict[str, Any]]:
+        """
+        Возвращает строки для вставки в clickhouse, по одной на каждый вид лимитов
+        """
+        previous = self._previous
+        period = current.date - previous.date
+        calls = current.calls - previous.calls
+
+        common = {
+            "date": datetime.fromtimestamp(current.date, tz=UTC),
+            "bot_id": self.bot_id,
+            "period": period,
+            "calls": calls,
+            "tokens": current.tokens - previous.tokens,
+            "throughput": calls / period if period > 0 else 0,
+            "in_flight": current.in_flight,
+            "queued": current.queued,
+            "global_queue_depth": current.global_queue_depth,
+        }
+
+        kinds = current.wait_time.keys() | current.retry_after_events.keys() | current.rates.keys()
+        rows = []
+        for kind in sorted(kinds):
+            histogram = current.wait_time.get(kind)
+            if histogram is None:
+                histogram = WaitHistogram(self.limit_caller.metrics.wait_time_buckets)
+            previous_histogram = previous.wait_time.get(kind)
+            if previous_histogram is not None:
+                histogram -= previous_histogram
+
+            rows.append(
+                {
+                    **common,
+                    "kind": kind,
+                    "wait_count": histogram.count,
+                    "wait_sum": histogram.total,
+                    "wait_p50": histogram.quantile(0.5),
+                    "wait_p90": histogram.quantile(0.9),
+                    "wait_p99": histogram.quantile(0.99),
+                    "wait_buckets": list(histogram.bounds),
+                    "wait_counts": histogram.counts,
+                    "retry_after_events": (
+                        current.retry_after_events.get(kind, 0) - previous.retry_after_events.get(kind, 0)
+                    ),
+                    "parked_requests": current.parked_requests.get(kind, 0) - previous.parked_requests.get(kind, 0),
+                    "parked_seconds": current.parked_seconds.get(kind, 0) - previous.parked_seconds.get(kind, 0),
+                    "rate": current.rates.get(kind),
+                },
+            )
+
+        return rows
+
+    async def collect_and_save(self) -> None:
+        try:
+            current = self.limit_caller.get_metrics()
+            rows = self.get_rows(current)
+            self._previous = current
+
+            for row in rows:
+                write_analytics(ANALYTICS_LIMITER_STATS_TABLE, row, admitted=True)
+
+            logger.debug("Limiter statistics queued for saving")
+
+        except Exception as exc:
+            logger.exception(
+                "Limiter statistics collection error: %s: %s",
+                exc.__class__.__name__,
+                exc,  # noqa: TRY401
+                exc_info=exc,
+            )
+
+
+_pending_tasks = set[PeriodicTask]()
+
+
+async def run_limiter_stats_collection_in_background(bot: Bot, limit_caller: LimitCaller | None = None) -> None:
+    """
+    Запускает периодическое сохранение метрик лимитера в clickhouse
+
+    Args:
+        bot: бот, запросы которого ограничивает лимитер
+        limit_caller: лимитер, по умолчанию используется лимитер бота
+    """
+    if limit_caller is None:
+        limit_caller = getattr(bot, "caller", None)
+        if limit_caller is None:
+            # Так же лимитер создаётся при первом запросе в LimitedBot
+            limit_caller = bot.caller = LimitCaller()  # pyright: ignore [reportAttributeAccessIssue]
+
+    await prepare_analytics_writer()
+
+    logger.info("Start limiter statistics collection every %s sec", ANALYTICS_LIMITER_STATS_COLLECTION_PERIOD)
+    collector = LimiterStatsCollector(bot.id, limit_caller)
+    task = PeriodicTask(collector.collect_and_save, ANALYTICS_LIMITER_STATS_COLLECTION_PERIOD)
+    _pending_tasks.add(task)  # Сохраняем, чтобы gc не убил
+    task.start()
@@ -1,18 +1,28 @@
+"""
+Сбор статистики локального сервера bot api в clickhouse
+
+За один запрос сохраняются все окна усреднения из ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES,
+по строке на каждое окно, а строки каждой таблицы записываются одним пакетом через AnalyticsWriter.
+Производные метрики (изменение частоты запросов, рост памяти, время выполнения запросов)
+считаются относительно предыдущего сбора.
+"""
+
 import logging
+import math
 import sys
 import time
+from collections.abc import Iterable
 from datetime import UTC, datetime
 from typing import TypeAlias
 
 import aiohttp
 from djgram.configs import (
-    ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX,
+    ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES,
     ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_BOT_TABLE,
     ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_COLLECTION_PERIOD,
     ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_GENERAL_TABLE,
 )
-from djgram.contrib.analytics.misc import LOCAL_SERVER_ANALYTICS_DDL_SQL
-from djgram.db import clickhouse
+from djgram.contrib.analytics.writer import prepare_analytics_writer, write_analytics
 from djgram.utils.async_tools import PeriodicTask
 
 StatValueType: TypeAlias = int | float | str | datetime
@@ -35,60 +45,11 @@ _mod = {
 # https://github.com/tdlib/telegram-bot-api/blob/master/telegram-bot-api/Stats.h#L61
 _durations = [0, 0, 5, 60, 60 * 60]
 
-
-async def get_stats() -> str:
-    """
-    Возвращает текст со статистикой локального телеграм сервера
-
-    Например:
-
-    DURATION	inf	5sec	1min	1hour
-    uptime	7199.051260
-    bot_count	1
-    active_bot_count	1
-    rss	30868KB
-    vm	43068KB
-    rss_peak	30876KB
-    vm_peak	43136KB
-    total_cpu	1.386936%	1.166181%	1.190551%	1.386936%
-    user_cpu	0.472083%	0.666389%	0.416276%	0.472083%
-    system_cpu	0.914853%	0.499792%	0.774274%	0.914853%
-    buffer_memory	89400B
-    active_webhook_connections	0
-    active_requests	0
-    active_network_queries	0
-    request_count	0.098749	0.000000	0.023310	0.098763
-    request_bytes	35.706418	0.000000	7.295909	35.711378
-    request_file_count	0.000000	0.000000	0.000000	0.000000
-    request_files_bytes	0.000000	0.000000	0.000000	0.000000
-    request_max_bytes	0	0	0	0
-    response_count	0.098749	0.000000	0.023310	0.098763
-    response_count_ok	0.098749	0.000000	0.023310	0.098763
-    response_count_error	0.000000	0.000000	0.000000	0.000000
-    response_bytes	2.339984	0.000000	2.459164	2.340309
-    update_count	0.000000	0.000000	0.000000	0.000000
-
-    id	1111111111
-    uptime	7198.608074
-    token	1111111111:aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa
-    username	bot1
-    head_update_id	12345678
-    request_count/sec	0.098755	0.000000	0.023310	0.098769
-    update_count/sec	0.000000	0.000000	0.000000	0.000000
-
-    id	2222222222
-    uptime	7198.608074
-    token	2222222222:aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa
-    username	bot2
-    head_update_id	12345678
-    request_count/sec	0.098755	0.000000	0.023310	0.098769
-    update_count/sec	0.000000	0.000000	0.000000	0.000000
-    """
-    async with (
-        aiohttp.ClientSession() as session,
-        session.get(TELEGRAM_LOCAL_SERVER_STATS_URL) as resp,
-    ):
-        return (await resp.text()).strip()
+# Метрики, для которых сохраняется изменение с прошлого сбора (<name>_delta) и скорость роста (<name>_growth)
+_GENERAL_DELTA_METRICS = ("request_count", "response_count")
+_GENERAL_GROWTH_METRICS = ("rss",)
+_BOT_DELTA_METRICS = ("request_count_per_sec", "update_count_per_sec")
+_BOT_GROWTH_METRICS = ("pending_update_count",)
 
 
 def parse_value(text: str) -> StatValueType:  # noqa: PLR0911
@@ -118,107 +79,311 @@ def parse_value(text: str) -> StatValueType:  # noqa: PLR0911
             return text
 
 
-def parse_stats_block(text: str, duration_idx: int) -> StatDictType:
+def parse_stats_block(text: str) -> tuple[StatDictType, dict[str, list[StatValueType]]]:
     """
-    Парсит и возвращает блок статистики в удобном виде
+    Парсит блок статистики за один проход
+
+    Returns:
+        Значения без окон усреднения и значения по всем окнам усреднения
     """
-    split = text.split("\n")
+    lines = text.split("\n")
 
-    first_line = split[0]
-    result = {}
+    scalars: StatDictType = {}
+    windows: dict[str, list[StatValueType]] = {}
+    first_line = lines[0]
     if first_line.startswith("id"):
-        result["id"] = int(first_line.split("\t", maxsplit=1)[-1])
+        scalars["id"] = int(first_line.split("\t", maxsplit=1)[-1])
 
-    for line in split[1:]:  # skip header: DURATION inf 5sec 1min 1hour
-        values = line.split("\t")
-        if len(values) > 2:  # noqa: PLR2004
-            result[values[0]] = parse_value(values[duration_idx])
+    for line in lines[1:]:  # skip header: DURATION inf 5sec 1min 1hour
+        name, *values = line.split("\t")
+        if len(values) > 1:
+            windows[name] = [parse_value(value) for value in values]
         else:
-            result[values[0]] = parse_value(values[1])
-
-    result["duration"] = _durations[duration_idx]
+            scalars[name] = parse_value(values[0])
 
-    return result
+    return scalars, windows
 
 
-def parse_stats(stats: str, duration_idx: int) -> tuple[StatDictType, ...]:
+def expand_stats_block(
+    scalars: StatDictType,
+    windows: dict[str, list[StatValueType]],
+    average_indexes: Iterable[int],
+) -> list[StatDictType]:
     """
-    Парсит и возвращает неочищенную статистику локального телеграм сервера в виде (общая, бот1, бот2, бот3, ...)
+    Возвращает по строке статистики на каждое окно усреднения
     """
-    return tuple(parse_stats_block(block, duration_idx) for block in stats.split("\n\n"))
+    rows = []
+    for index in average_indexes:
+        row = scalars.copy()
+        for name, values in windows.items():
+            row[name] = values[index - 1]
+        row["duration"] = _durations[index]
+        rows.append(row)
 
+    return rows
 
-async def collect_stats(duration_idx: int) -> tuple[StatDictType, ...]:
+
+def parse_stats(stats: str, average_indexes: Iterable[int]) -> tuple[list[StatDictType], ...]:
     """
-    Возвращает очищенную статистику локального телеграм сервера в виде (общая, бот1, бот2, бот3, ...)
+    Парсит неочищенную статистику локального телеграм сервера в виде (общая, бот1, бот2, бот3, ...),
+    для каждого блока возвращается по строке на окно усреднения
     """
-    start = time.perf_counter()
-    stats = await get_stats()
-    end = time.perf_counter()
-    now = datetime.now(tz=UTC)
-    collection_time = end - start
-
-    stats = parse_stats(stats, duration_idx)
-    for stat in stats:
-        stat["date"] = now
-        stat["collection_time"] = collection_time
+    average_indexes = tuple(average_indexes)
+    result = []
+    for i, block in enumerate(stats.split("\n\n")):
+        scalars, windows = parse_stats_block(block)
+        if i > 0:
+            scalars.pop("token", None)  # Безопасность
+            # request_count/sec -> request_count_per_sec
+            windows = {name.replace("/", "_per_"): values for name, values in windows.items()}
+            scalars = {name.replace("/", "_per_"): value for name, value in scalars.items()}
+
+        result.append(expand_stats_block(scalars, windows, average_indexes))
+
+    return tuple(result)
+
+
+def _get_number(row: StatDictType, name: str) -> float | None:
+    value = row.get(name)
+    if isinstance(value, int | float):
+        return value
+
+    return None
+
+
+def add_derived_metrics(  # noqa: PLR0913
+    row: StatDictType,
+    previous: StatDictType | None,
+    period: float,
+    delta_metrics: Iterable[str],
+    growth_metrics: Iterable[str],
+    active_metric: str,
+    rate_metric: str,
+) -> None:
+    """
+    Добавляет в строку производные метрики
+
+    Args:
+        row: текущая строка
+        previous: строка того же блока и окна усреднения с прошлого сбора
+        period: время с прошлого сбора в секундах
+        delta_metrics: метрики, для которых сохраняется изменение, <name>_delta
+        growth_metrics: метрики, для которых сохраняется скорость роста в секунду, <name>_growth
+        active_metric: число выполняемых запросов
+        rate_metric: частота запросов в секунду
+    """
+    for name in delta_metrics:
+        current = _get_number(row, name)
+        before = _get_number(previous, name) if previous is not None else None
+        row[f"{name}_delta"] = current - before if current is not None and before is not None else math.nan
+
+    for name in growth_metrics:
+        current = _get_number(row, name)
+        before = _get_number(previous, name) if previous is not None else None
+        if current is not None and before is not None and period > 0:
+            row[f"{name}_growth"] = (current - before) / period
+        else:
+            row[f"{name}_growth"] = math.nan
 
-    for bot in stats[1:]:
-        bot.pop("token")  # Безопасность
+    # Закон Литтла: среднее время выполнения = число выполняемых запросов / частота запросов
+    active = _get_number(row, active_metric)
+    rate = _get_number(row, rate_metric)
+    row["active_request_time"] = active / rate if active is not None and rate else math.nan
 
-        km = {}
-        for key in bot:
-            if "/" in key:
-                km[key] = key.replace("/", "_per_")
 
-        for orig, new in km.items():
-            bot[new] = bot.pop(orig)
+class LocalServerStatsCollector:
+    """
+    Собирает статистику локального сервера через одно постоянное http соединение
+    """
 
-    return stats
+    def __init__(
+        self,
+        url: str = TELEGRAM_LOCAL_SERVER_STATS_URL,
+        average_indexes: Iterable[int] = ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES,
+        request_timeout: float = 10,
+    ):
+        """
+        Args:
+            url: адрес статистики локального сервера
+            average_indexes: окна усреднения, см. TelegramLocalServerStatsAverage
+            request_timeout: время ожидания ответа сервера в секундах
+        """
+        self.url = url
+        self.average_indexes = tuple(average_indexes)
+        self.request_timeout = request_timeout
+
+        self._session: aiohttp.ClientSession | None = None
+        # (id бота или None для общей статистики, окно усреднения) -> строка прошлого сбора
+        self._previous: dict[tuple[int | None, int], StatDictType] = {}
+        self._previous_time: float | None = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.request_timeout))
+
+        return self._session
+
+    async def get_stats(self) -> str:
+        """
+        Возвращает текст со статистикой локального телеграм сервера
+
+        Например:
+
+        DURATION	inf	5sec	1min	1hour
+        uptime	7199.051260
+        bot_count	1
+        active_bot_count	1
+        rss	30868KB
+        vm	43068KB
+        rss_peak	30876KB
+        vm_peak	43136KB
+        total_cpu	1.386936%	1.166181%	1.190551%	1.386936%
+        user_cpu	0.472083%	0.666389%	0.416276%	0.472083%
+        system_cpu	0.914853%	0.499792%	0.774274%	0.914853%
+        buffer_memory	89400B
+        active_webhook_connections	0
+        active_requests	0
+        active_network_queries	0
+        request_count	0.098749	0.000000	0.023310	0.098763
+        request_bytes	35.706418	0.000000	7.295909	35.711378
+        request_file_count	0.000000	0.000000	0.000000	0.000000
+        request_files_bytes	0.000000	0.000000	0.000000	0.000000
+        request_max_bytes	0	0	0	0
+        response_count	0.098749	0.000000	0.023310	0.098763
+        response_count_ok	0.098749	0.000000	0.023310	0.098763
+        response_count_error	0.000000	0.000000	0.000000	0.000000
+        response_bytes	2.339984	0.000000	2.459164	2.340309
+        update_count	0.000000	0.000000	0.000000	0.000000
+
+        id	1111111111
+        uptime	7198.608074
+        token	1111111111:aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa
+        username	bot1
+        head_update_id	12345678
+        request_count/sec	0.098755	0.000000	0.023310	0.098769
+        update_count/sec	0.000000	0.000000	0.000000	0.000000
+
+        id	2222222222
+        uptime	7198.608074
+        token	2222222222:aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa
+        username	bot2
+        head_update_id	12345678
+        request_count/sec	0.098755	0.000000	0.023310	0.098769
+        update_count/sec	0.000000	0.000000	0.000000	0.000000
+        """
+        async with self.get_session().get(self.url) as resp:
+            return (await resp.text()).strip()
+
+    async def collect(self) -> tuple[list[StatDictType], list[StatDictType]]:
+        """
+        Возвращает очищенную статистику локального телеграм сервера с производными метриками
+
+        Returns:
+            Строки общей статистики и строки статистики ботов, по строке на каждое окно усреднения
+        """
+        start = time.perf_counter()
+        stats = await self.get_stats()
+        end = time.perf_counter()
+        now = datetime.now(tz=UTC)
+        collection_time = end - start
+
+        period = end - self._previous_time if self._previous_time is not None else 0
+        previous, self._previous = self._previous, {}
+        self._previous_time = end
+
+        general, *bots = parse_stats(stats, self.average_indexes)
+        for row in general:
+            add_derived_metrics(
+                row,
+                previous.get((None, row["duration"])),
+                period,
+                _GENERAL_DELTA_METRICS,
+                _GENERAL_GROWTH_METRICS,
+                "active_requests",
+                "request_count",
+            )
+            response_count = _get_number(row, "response_count")
+            response_count_error = _get_number(row, "response_count_error")
+            row["response_error_ratio"] = (
+                response_count_error / response_count if response_count and response_count_error is not None else 0.0
+            )
+            self._previous[(None, row["duration"])] = row.copy()
+
+        bot_rows = []
+        for bot in bots:
+            for row in bot:
+                key = (row.get("id"), row["duration"])
+                add_derived_metrics(
+                    row,
+                    previous.get(key),
+                    period,
+                    _BOT_DELTA_METRICS,
+                    _BOT_GROWTH_METRICS,
+                    "active_request_count",
+                    "request_count_per_sec",
+                )
+                self._previous[key] = row.copy()
+                bot_rows.append(row)
 
+        for row in (*general, *bot_rows):
+            row["date"] = now
+            row["collection_time"] = collection_time
 
-async def collect_and_save() -> None:
-    try:
-        general, *bots = await collect_stats(ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX)
+        return general, bot_rows
 
-        async with clickhouse.connection() as clickhouse_connection:
-            await clickhouse.insert_dict(
-                clickhouse_connection,
-                ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_GENERAL_TABLE,
-                general,
+    async def collect_and_save(self) -> None:
+        try:
+            general, bots = await self.collect()
+
+            # Строки одной таблицы уходят в приёмник одним пакетом
+            for row in general:
+                write_analytics(ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_GENERAL_TABLE, row, admitted=True)
+            for row in bots:
+                write_analytics(ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_BOT_TABLE, row, admitted=True)
+
+            logger.debug("Local server statistics queued for saving")
+
+        except Exception as exc:
+            logger.exception(
+                "Local server statistics collection error: %s: %s",
+                exc.__class__.__name__,
+                exc,  # noqa: TRY401
+                exc_info=exc,
             )
+            return
 
-            for bot in bots:
-                await clickhouse.insert_dict(
-                    clickhouse_connection,
-                    ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_BOT_TABLE,
-                    bot,
-                )
-
-        logger.debug("Local server statistics saved to clickhouse")
-
-    except Exception as exc:
-        logger.exception(
-            "Local server statistics saving to clickhouse error: %s: %s",
-            exc.__class__.__name__,
-            exc,  # noqa: TRY401
-            exc_info=exc,
-        )
-        return
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
 
 _pending_tasks = set[PeriodicTask]()
+_collectors = set[LocalServerStatsCollector]()
 
 
 async def run_telegram_local_server_stats_collection_in_background() -> None:
-    logger.debug("Ensuring clickhouse tables for local server statistics")
-    with open(LOCAL_SERVER_ANALYTICS_DDL_SQL, encoding="utf-8") as sql_file:  # noqa: ASYNC230,PTH123
-        await clickhouse.run_sql(sql_file.read())
+    await prepare_analytics_writer()
 
     logger.info(
         "Start local server statistics collection every %s sec",
         ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_COLLECTION_PERIOD,
     )
-    task = PeriodicTask(collect_and_save, ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_COLLECTION_PERIOD)
+    collector = LocalServerStatsCollector()
+    _collectors.add(collector)
+    task = PeriodicTask(collector.collect_and_save, ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_COLLECTION_PERIOD)
     _pending_tasks.add(task)  # Сохраняем, чтобы gc не убил
     task.start()
+
+
+async def stop_telegram_local_server_stats_collection() -> None:
+    """
+    Останавливает сбор статистики и закрывает соединение с локальным сервером
+    """
+    for task in _pending_tasks:
+        await task.stop()
+    _pending_tasks.clear()
+
+    for collector in _collectors:
+        await collector.close()
+    _collectors.clear()
@@ -2,8 +2,7 @@
 Посредники для аналитики
 """
 
-import asyncio
-import copy
+import functools
 import logging
 import time
 from collections.abc import Awaitable, Callable
@@ -16,14 +15,12 @@ from aiogram import BaseMiddleware, Bot
 from aiogram.dispatcher.middlewares.user_context import EVENT_CONTEXT_KEY, EventContext, UserContextMiddleware
 from aiogram.types import CallbackQuery, Message, Update
 from aiogram_dialog import DialogProtocol
-from aiogram_dialog.api.entities import Context, Stack
 from aiogram_dialog.api.internal import CONTEXT_KEY, STACK_KEY
 from djgram.configs import ANALYTICS_UPDATES_TABLE
-from djgram.db import clickhouse
 
-from .dialog_analytics import save_input_statistics, save_keyboard_statistics
-from .misc import UPDATE_DDL_SQL
+from .dialog_analytics import ContextSnapshot, StackSnapshot, save_input_statistics, save_keyboard_statistics
 from .utils import set_defaults
+from .writer import admit_analytics, write_analytics_deferred
 
 T = TypeVar("T")
 V = TypeVar("V")
@@ -36,12 +33,13 @@ def get_update_dict_for_clickhouse(
     execution_time: float,
     event_context: EventContext,
     bot: Bot,
+    date: datetime | None = None,
 ) -> dict[str, Any]:
     event = update.model_dump(mode="python", exclude_unset=True)
     event = set_defaults(event, bot)
 
     return {
-        "date": datetime.now(tz=UTC),
+        "date": date or datetime.now(tz=UTC),
         "execution_time": execution_time,
         "event_type": update.event_type,  # property
         CONTENT_TYPE_KEY: getattr(update.event, CONTENT_TYPE_KEY, None),
@@ -55,24 +53,30 @@ def get_update_dict_for_clickhouse(
     }
 
 
-async def save_event_to_clickhouse(
+def save_event_to_clickhouse(
     update: Update,
     execution_time: float,
     event_context: EventContext,
     bot: Bot,
-) -> int | None:
+) -> bool:
     """
-    Сохраняет update в clickhouse
+    Ставит update в очередь на сохранение в clickhouse
     """
+    event_type = update.event_type
+    if not admit_analytics(ANALYTICS_UPDATES_TABLE, event_type):
+        return False
 
-    data = get_update_dict_for_clickhouse(
+    # update и event_context неизменяемые, поэтому строку можно построить в другом потоке
+    build = functools.partial(
+        get_update_dict_for_clickhouse,
         update=update,
         execution_time=execution_time,
         event_context=event_context,
         bot=bot,
+        date=datetime.now(tz=UTC),
     )
 
-    return await clickhouse.safe_insert_dict(ANALYTICS_UPDATES_TABLE, data)
+    return write_analytics_deferred(ANALYTICS_UPDATES_TABLE, build, event_type, admitted=True)
 
 
 class SaveUpdateToClickHouseMiddleware(BaseMiddleware):
@@ -80,18 +84,6 @@ class SaveUpdateToClickHouseMiddleware(BaseMiddleware):
     Сохраняет все update'ы в ClickHouse
     """
 
-    def __init__(self):  # noqa: D107
-        # Задачи сохранения аналитики в clickhouse
-        # Временно сохраняем из тут, чтобы сборщик мусора не убил раньше времени
-        # https://docs.python.org/3.12/library/asyncio-task.html#asyncio.create_task
-        self.pending_tasks = set[asyncio.Task]()
-
-        logger.debug("Ensuring clickhouse tables for updates")
-        with open(UPDATE_DDL_SQL, encoding="utf-8") as sql_file:  # noqa: PTH123
-            task = clickhouse.run_sql_from_sync(sql_file.read())
-            task.add_done_callback(self.pending_tasks.remove)
-            self.pending_tasks.add(task)
-
     async def __call__(  # pyright: ignore [reportIncompatibleMethodOverride]
         self,
         handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
@@ -107,17 +99,15 @@ class SaveUpdateToClickHouseMiddleware(BaseMiddleware):
         if event_context is not None:
             event_context = UserContextMiddleware.resolve_event_context(update)
 
-        task = asyncio.create_task(
+        try:
             save_event_to_clickhouse(
                 update=update,
                 execution_time=finish - start,
                 event_context=cast(EventContext, event_context),
                 bot=data["bot"],
-            ),
-        )
-        task.add_done_callback(self.pending_tasks.remove)
-        # Храним ссылку на задачу, чтобы она не уничтожилась в процессе выполнения
-        self.pending_tasks.add(task)
+            )
+        except Exception as exc:
+            logger.exception("Saving update to clickhouse error: %s", exc, exc_info=exc)  # noqa: TRY401
 
         return result
 
@@ -134,8 +124,8 @@ class DialogAnalyticsInnerMiddleware(BaseMiddleware, Generic[T]):
         event: T,
         middleware_data: dict[str, Any],
         state_before: str | None,
-        aiogd_stack_before: Stack | None,
-        aiogd_context_before: Context | None,
+        aiogd_stack_before: StackSnapshot | None,
+        aiogd_context_before: ContextSnapshot | None,
     ) -> None:
         raise NotImplementedError
 
@@ -151,9 +141,10 @@ class DialogAnalyticsInnerMiddleware(BaseMiddleware, Generic[T]):
         if hasattr(event_handler, "__self__") and isinstance(event_handler.__self__, DialogProtocol):
             return await handler(event, data)
 
-        aiogd_stack_before: Stack | None = copy.deepcopy(data.get(STACK_KEY))
-        aiogd_context_before: Context | None = copy.deepcopy(data.get(CONTEXT_KEY))
-        state_before: str | None = await data["state"].get_state()
+        aiogd_stack_before = StackSnapshot.from_stack(data.get(STACK_KEY))
+        aiogd_context_before = ContextSnapshot.from_context(data.get(CONTEXT_KEY))
+        # Состояние FSM до обработки уже прочитано FSMContextMiddleware aiogram
+        state_before: str | None = data.get("raw_state")
 
         start = time.perf_counter()
         result = await handler(event, data)
@@ -179,8 +170,8 @@ class DialogAnalyticsInnerMessageMiddleware(DialogAnalyticsInnerMiddleware[Messa
         event: Message,
         middleware_data: dict[str, Any],
         state_before: str | None,
-        aiogd_stack_before: Stack | None,
-        aiogd_context_before: Context | None,
+        aiogd_stack_before: StackSnapshot | None,
+        aiogd_context_before: ContextSnapshot | None,
     ) -> None:
         await save_input_statistics(
             processor=cls.__name__,
@@ -204,8 +195,8 @@ class DialogAnalyticsInnerCallbackQueryMiddleware(DialogAnalyticsInnerMiddleware
         event: CallbackQuery,
         middleware_data: dict[str, Any],
         state_before: str | None,
-        aiogd_stack_before: Stack | None,
-        aiogd_context_before: Context | None,
+        aiogd_stack_before: StackSnapshot | None,
+        aiogd_context_before: ContextSnapshot | None,
     ) -> None:
         await save_keyboard_statistics(
             processor=cls.__name__,
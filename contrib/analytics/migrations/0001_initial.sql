@@ -0,0 +1,272 @@
+-- Начальная схема аналитики
+-- Таблицы update, bot_send_analytics и dialog_analytics совпадают со схемой, которая раньше создавалась
+-- при запуске через CREATE TABLE IF NOT EXISTS, и для существующих таблиц ничего не меняется.
+-- Кроме того, миграция создаёт новые таблицы limiter_statistics и analytics_sampling_statistics
+-- и добавляет в существующие таблицы статистики локального сервера колонки производных метрик.
+-- Все запросы используют IF NOT EXISTS, поэтому миграция применяется при запуске бота без остановки других процессов
+
+-- update'ы telegram
+
+CREATE TABLE IF NOT EXISTS update
+(
+    `date`                      DateTime64,
+    `execution_time`            Float64,
+    `event_type`                String,
+    `content_type`              Nullable(String),
+
+    `bot_id`                    Int64,
+    `user_id`                   Nullable(Int64),
+    `chat_id`                   Nullable(Int64),
+    `thread_id`                 Nullable(Int64),
+    `business_connection_id`    Nullable(Int64),
+    `update_id`                 Int64,
+    `event`                     String
+)
+    ENGINE = MergeTree()
+        ORDER BY (date);
+
+-- Запросы бота к bot api
+CREATE TABLE IF NOT EXISTS bot_send_analytics
+(
+    `update_id`                 Nullable(Int64),
+    `bot_id`                    Int64,
+    `date`                      DateTime64,
+    `method`                    String,
+    `method_data`               String,
+    `request_timeout`           Nullable(Int64),
+    `execution_time`            Float64,
+    `answer`                    String,
+)
+    ENGINE = MergeTree()
+        ORDER BY (date);
+
+-- Взаимодействия с диалогами aiogram-dialog
+CREATE TABLE IF NOT EXISTS dialog_analytics
+(
+    `date`                                      DateTime64,
+    `update_id`                                 Int64,
+    `callback_query`                            Nullable(String),
+    `message`                                   Nullable(String),
+    `processor`                                 String,
+    `processed`                                 Boolean,
+    `process_time`                              Nullable(Float32),
+    `not_processed_reason`                      Nullable(String),
+    `command_prefix`                            Nullable(String),
+    `command_command`                           Nullable(String),
+    `command_mention`                           Nullable(String),
+    `command_args`                              Nullable(String),
+
+    -- User info
+    `telegram_user_id`                          Nullable(Int64),
+    `telegram_chat_id`                          Nullable(Int64),
+    `telegram_thread_id`                        Nullable(Int64),
+    `telegram_business_connection_id`           Nullable(String),
+    `user_id`                                   Nullable(Int64),
+
+    -- Widget info
+    -- Если отправить сообщение, когда в текущем состоянии диалога нет виджета ввода,
+    -- тогда отправляется в виртуальный MessageInput с widget_id = None
+    `widget_id`                                 Nullable(String),
+    `widget_type`                               String,
+    `widget_text`                               Nullable(String),
+    -- Additional widget info
+    `calendar_user_config_firstweekday`         Nullable(Int8),
+    `calendar_user_config_timezone_name`        LowCardinality(Nullable(String)),
+    `calendar_user_config_timezone_offset`      Nullable(Int32),
+
+    -- FSM state
+    `state`                                     Nullable(String),
+    `state_new`                                 Nullable(String),
+
+    `aiogd_original_callback_data`              Nullable(String),
+
+    -- aiogram_dialog.api.entities.Context
+    `aiogd_context_intent_id`                   Nullable(String),
+    `aiogd_context_stack_id`                    Nullable(String),
+    `aiogd_context_state`                       Nullable(String),
+    `aiogd_context_state_group_name`            Nullable(String),
+    `aiogd_context_start_data`                  Nullable(String),
+    `aiogd_context_dialog_data`                 Nullable(String),
+    `aiogd_context_widget_data`                 Nullable(String),
+
+    -- aiogram_dialog.api.entities.Stack
+    -- Контекста может не быть, когда взаимодействие происходит вне aiogram-dialog
+    `aiogd_stack_id`                            Nullable(String),
+    `aiogd_stack_intents`                       Array(String),
+    `aiogd_stack_last_message_id`               Nullable(Int64),
+    `aiogd_stack_last_reply_keyboard`           Nullable(Boolean),
+    `aiogd_stack_last_media_id`                 Nullable(String),
+    `aiogd_stack_last_media_unique_id`          Nullable(String),
+    `aiogd_stack_last_income_media_group_id`    Nullable(String),
+
+    -- После выполнения кода обработчика
+    -- aiogram_dialog.api.entities.Context
+    -- Нового контекста может не быть, например когда пользователь кликнул кнопку завершить
+    `aiogd_context_intent_id_new`                   Nullable(String),
+    `aiogd_context_stack_id_new`                    Nullable(String),
+    `aiogd_context_state_new`                       Nullable(String),
+    `aiogd_context_state_group_name_new`            Nullable(String),
+    `aiogd_context_start_data_new`                  Nullable(String),
+    `aiogd_context_dialog_data_new`                 Nullable(String),
+    `aiogd_context_widget_data_new`                 Nullable(String),
+
+    -- aiogram_dialog.api.entities.Stack
+    `aiogd_stack_id_new`                            Nullable(String),
+    `aiogd_stack_intents_new`                       Array(String),
+    `aiogd_stack_last_message_id_new`               Nullable(Int64),
+    `aiogd_stack_last_reply_keyboard_new`           Nullable(Boolean),
+    `aiogd_stack_last_media_id_new`                 Nullable(String),
+    `aiogd_stack_last_media_unique_id_new`          Nullable(String),
+    `aiogd_stack_last_income_media_group_id_new`    Nullable(String)
+)
+    ENGINE = MergeTree()
+        ORDER BY (date);
+
+-- Статистика лимитера запросов к bot api
+-- Одна строка на каждый вид лимитов (global, chat, group) за период сбора
+CREATE TABLE IF NOT EXISTS limiter_statistics
+(
+    `date`                  DateTime64,
+    `bot_id`                Int64,
+    `period`                Float64,
+    `kind`                  String,
+
+-- Общие для лимитера значения, одинаковые во всех строках за период
+    `calls`                 UInt64,
+    `tokens`                UInt64,
+    `throughput`            Float64,
+    `in_flight`             Int64,
+    `queued`                Int64,
+    `global_queue_depth`    Int64,
+
+-- Значения для вида лимитов за период
+    `wait_count`            UInt64,
+    `wait_sum`              Float64,
+    `wait_p50`              Float64,
+    `wait_p90`              Float64,
+    `wait_p99`              Float64,
+    `wait_buckets`          Array(Float64),
+    `wait_counts`           Array(UInt64),
+    `retry_after_events`    UInt64,
+    `parked_requests`       UInt64,
+    `parked_seconds`        Float64,
+    `rate`                  Nullable(Float64)
+)
+    ENGINE = MergeTree()
+        ORDER BY (date);
+
+-- Статистика локального сервера bot api
+CREATE TABLE IF NOT EXISTS local_server_general_statistics
+(
+    `date`                          DateTime64,
+    `collection_time`               Float64,
+    `duration`                      Int32,
+
+-- Взято из https://github.com/tdlib/telegram-bot-api/blob/master/telegram-bot-api/ClientManager.cpp#L223
+    `uptime`                        Float64,
+    `bot_count`                     UInt64,
+    `active_bot_count`              Int32,
+
+    `rss`                           UInt64,
+    `vm`                            UInt64,
+    `rss_peak`                      UInt64,
+    `vm_peak`                       UInt64,
+
+    `buffer_memory`                 UInt64,
+    `active_webhook_connections`    Int64,
+    `active_requests`               UInt64,
+    `active_network_queries`        UInt64,
+
+-- Взято из  https://github.com/tdlib/telegram-bot-api/blob/master/telegram-bot-api/Stats.cpp#L52
+    `total_cpu`                     Float64 DEFAULT Nan,
+    `user_cpu`                      Float64 DEFAULT Nan,
+    `system_cpu`                    Float64 DEFAULT Nan,
+
+    `request_count`                 Float64 DEFAULT 0,
+    `request_bytes`                 Float64 DEFAULT 0,
+    `request_file_count`            Float64 DEFAULT 0,
+    `request_files_bytes`           Float64 DEFAULT 0,
+    `request_max_bytes`             Int64 DEFAULT 0,
+    `response_count`                Float64 DEFAULT 0,
+    `response_count_ok`             Float64 DEFAULT 0,
+    `response_count_error`          Float64 DEFAULT 0,
+    `response_bytes`                Float64 DEFAULT 0,
+    `update_count`                  Float64 DEFAULT 0,
+
+-- Производные метрики, считаются относительно прошлого сбора
+    `request_count_delta`           Float64 DEFAULT Nan,
+    `response_count_delta`          Float64 DEFAULT Nan,
+    `rss_growth`                    Float64 DEFAULT Nan,
+    `response_error_ratio`          Float64 DEFAULT 0,
+    `active_request_time`           Float64 DEFAULT Nan
+
+)
+    ENGINE = MergeTree()
+        ORDER BY (date);
+
+CREATE TABLE IF NOT EXISTS local_server_bot_statistics
+(
+    `date`                      DateTime64,
+    `collection_time`           Float64,
+    `duration`                      Int32,
+
+-- Взято из https://github.com/tdlib/telegram-bot-api/blob/master/telegram-bot-api/ClientManager.cpp#L261
+    `id`                        UInt64,
+    `uptime`                    Float64,
+-- Не стоит сохранять токен
+--     `token`                     String,
+    `username`                  String,
+    `active_request_count`      Int64 DEFAULT 0,
+    `active_file_upload_bytes`  Int64 DEFAULT 0,
+    `active_file_upload_count`  Int64 DEFAULT 0,
+    `webhook`                   String DEFAULT '',
+    `has_custom_certificate`    Boolean DEFAULT False,
+    `webhook_max_connections`   Int32 DEFAULT 0,
+    `head_update_id`            Int32 DEFAULT 0,
+    `tail_update_id`            Int32 DEFAULT 0,
+    `pending_update_count`      UInt64 DEFAULT 0,
+
+    `update_count_per_sec`      Float64 DEFAULT 0,
+    `request_count_per_sec`     Float64 DEFAULT 0,
+
+-- Производные метрики, считаются относительно прошлого сбора
+    `request_count_per_sec_delta`   Float64 DEFAULT Nan,
+    `update_count_per_sec_delta`    Float64 DEFAULT Nan,
+    `pending_update_count_growth`   Float64 DEFAULT Nan,
+    `active_request_time`           Float64 DEFAULT Nan
+)
+    ENGINE = MergeTree()
+        ORDER BY (date);
+
+-- Колонки производных метрик для таблиц, созданных до их появления
+ALTER TABLE local_server_general_statistics
+    ADD COLUMN IF NOT EXISTS `request_count_delta` Float64 DEFAULT Nan,
+    ADD COLUMN IF NOT EXISTS `response_count_delta` Float64 DEFAULT Nan,
+    ADD COLUMN IF NOT EXISTS `rss_growth` Float64 DEFAULT Nan,
+    ADD COLUMN IF NOT EXISTS `response_error_ratio` Float64 DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS `active_request_time` Float64 DEFAULT Nan;
+
+ALTER TABLE local_server_bot_statistics
+    ADD COLUMN IF NOT EXISTS `request_count_per_sec_delta` Float64 DEFAULT Nan,
+    ADD COLUMN IF NOT EXISTS `update_count_per_sec_delta` Float64 DEFAULT Nan,
+    ADD COLUMN IF NOT EXISTS `pending_update_count_growth` Float64 DEFAULT Nan,
+    ADD COLUMN IF NOT EXISTS `active_request_time` Float64 DEFAULT Nan;
+
+-- Статистика выборки и сброса аналитики
+-- Одна строка на каждую таблицу и ключ (тип события, метод bot api, обработчик) за период
+-- Полное число событий за период: seen, доля сохранённых: written / seen
+CREATE TABLE IF NOT EXISTS analytics_sampling_statistics
+(
+    `date`          DateTime64,
+    `period`        Float64,
+    `table`         String,
+    `key`           String,
+    `rate`          Float64,
+    `seen`          UInt64,
+    `written`       UInt64,
+    `sampled_out`   UInt64,
+    `shed`          UInt64,
+    `dropped`       UInt64
+)
+    ENGINE = MergeTree()
+        ORDER BY (table, key, date);
@@ -0,0 +1,37 @@
+-- Новая схема таблицы update: секции по месяцам, сортировка по (bot_id, event_type, date),
+-- удаление старых событий по TTL и сжатие json события ZSTD.
+-- Ключи секционирования и сортировки нельзя изменить через ALTER, поэтому данные копируются в новую таблицу,
+-- которая затем меняется местами со старой. Для EXCHANGE TABLES нужна база данных на движке Atomic (по умолчанию).
+-- Это офлайн миграция: события, вставленные в старую таблицу во время копирования, теряются,
+-- поэтому перед применением нужно остановить все процессы бота.
+-- Заодно business_connection_id становится строкой, как в bot api.
+
+-- Остаток прерванной попытки миграции
+DROP TABLE IF EXISTS update_migration_0002;
+
+CREATE TABLE update_migration_0002
+(
+    `date`                      DateTime64 CODEC(Delta, ZSTD(1)),
+    `execution_time`            Float64,
+    `event_type`                LowCardinality(String),
+    `content_type`              LowCardinality(Nullable(String)),
+
+    `bot_id`                    Int64,
+    `user_id`                   Nullable(Int64),
+    `chat_id`                   Nullable(Int64),
+    `thread_id`                 Nullable(Int64),
+    `business_connection_id`    Nullable(String),
+    `update_id`                 Int64,
+    `event`                     String CODEC(ZSTD(3))
+)
+    ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(date)
+        ORDER BY (bot_id, event_type, date)
+        TTL toDateTime(date) + INTERVAL ${ANALYTICS_EVENTS_TTL_DAYS} DAY
+        SETTINGS ttl_only_drop_parts = 1;
+
+INSERT INTO update_migration_0002 SELECT * FROM update;
+
+EXCHANGE TABLES update AND update_migration_0002;
+
+DROP TABLE update_migration_0002;
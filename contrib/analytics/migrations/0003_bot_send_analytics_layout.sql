@@ -0,0 +1,28 @@
+-- Новая схема таблицы bot_send_analytics: секции по месяцам, сортировка по (bot_id, method, date),
+-- удаление старых запросов по TTL и сжатие параметров и ответов ZSTD.
+-- Данные копируются в новую таблицу так же, как в 0002_update_layout, это тоже офлайн миграция.
+
+DROP TABLE IF EXISTS bot_send_analytics_migration_0003;
+
+CREATE TABLE bot_send_analytics_migration_0003
+(
+    `update_id`                 Nullable(Int64),
+    `bot_id`                    Int64,
+    `date`                      DateTime64 CODEC(Delta, ZSTD(1)),
+    `method`                    LowCardinality(String),
+    `method_data`               String CODEC(ZSTD(3)),
+    `request_timeout`           Nullable(Int64),
+    `execution_time`            Float64,
+    `answer`                    String CODEC(ZSTD(3))
+)
+    ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(date)
+        ORDER BY (bot_id, method, date)
+        TTL toDateTime(date) + INTERVAL ${ANALYTICS_EVENTS_TTL_DAYS} DAY
+        SETTINGS ttl_only_drop_parts = 1;
+
+INSERT INTO bot_send_analytics_migration_0003 SELECT * FROM bot_send_analytics;
+
+EXCHANGE TABLES bot_send_analytics AND bot_send_analytics_migration_0003;
+
+DROP TABLE bot_send_analytics_migration_0003;
@@ -1,12 +1,16 @@
--- Скрипт создания таблиц для сбора статистики update'ов telegram
+-- Новая схема таблицы dialog_analytics: секции по месяцам, сортировка по (processor, date),
+-- удаление старых событий по TTL и сжатие json сообщений и данных диалогов ZSTD.
+-- Данные копируются в новую таблицу так же, как в 0002_update_layout, это тоже офлайн миграция.
 
-CREATE TABLE IF NOT EXISTS dialog_analytics
+DROP TABLE IF EXISTS dialog_analytics_migration_0004;
+
+CREATE TABLE dialog_analytics_migration_0004
 (
-    `date`                                      DateTime64,
+    `date`                                      DateTime64 CODEC(Delta, ZSTD(1)),
     `update_id`                                 Int64,
-    `callback_query`                            Nullable(String),
-    `message`                                   Nullable(String),
-    `processor`                                 String,
+    `callback_query`                            Nullable(String) CODEC(ZSTD(3)),
+    `message`                                   Nullable(String) CODEC(ZSTD(3)),
+    `processor`                                 LowCardinality(String),
     `processed`                                 Boolean,
     `process_time`                              Nullable(Float32),
     `not_processed_reason`                      Nullable(String),
@@ -26,7 +30,7 @@ CREATE TABLE IF NOT EXISTS dialog_analytics
     -- Если отправить сообщение, когда в текущем состоянии диалога нет виджета ввода,
     -- тогда отправляется в виртуальный MessageInput с widget_id = None
     `widget_id`                                 Nullable(String),
-    `widget_type`                               String,
+    `widget_type`                               LowCardinality(String),
     `widget_text`                               Nullable(String),
     -- Additional widget info
     `calendar_user_config_firstweekday`         Nullable(Int8),
@@ -44,9 +48,9 @@ CREATE TABLE IF NOT EXISTS dialog_analytics
     `aiogd_context_stack_id`                    Nullable(String),
     `aiogd_context_state`                       Nullable(String),
     `aiogd_context_state_group_name`            Nullable(String),
-    `aiogd_context_start_data`                  Nullable(String),
-    `aiogd_context_dialog_data`                 Nullable(String),
-    `aiogd_context_widget_data`                 Nullable(String),
+    `aiogd_context_start_data`                  Nullable(String) CODEC(ZSTD(3)),
+    `aiogd_context_dialog_data`                 Nullable(String) CODEC(ZSTD(3)),
+    `aiogd_context_widget_data`                 Nullable(String) CODEC(ZSTD(3)),
 
     -- aiogram_dialog.api.entities.Stack
     -- Контекста может не быть, когда взаимодействие происходит вне aiogram-dialog
@@ -65,9 +69,9 @@ CREATE TABLE IF NOT EXISTS dialog_analytics
     `aiogd_context_stack_id_new`                    Nullable(String),
     `aiogd_context_state_new`                       Nullable(String),
     `aiogd_context_state_group_name_new`            Nullable(String),
-    `aiogd_context_start_data_new`                  Nullable(String),
-    `aiogd_context_dialog_data_new`                 Nullable(String),
-    `aiogd_context_widget_data_new`                 Nullable(String),
+    `aiogd_context_start_data_new`                  Nullable(String) CODEC(ZSTD(3)),
+    `aiogd_context_dialog_data_new`                 Nullable(String) CODEC(ZSTD(3)),
+    `aiogd_context_widget_data_new`                 Nullable(String) CODEC(ZSTD(3)),
 
     -- aiogram_dialog.api.entities.Stack
     `aiogd_stack_id_new`                            Nullable(String),
@@ -79,4 +83,13 @@ CREATE TABLE IF NOT EXISTS dialog_analytics
     `aiogd_stack_last_income_media_group_id_new`    Nullable(String)
 )
     ENGINE = MergeTree()
-        ORDER BY (date);
+        PARTITION BY toYYYYMM(date)
+        ORDER BY (processor, date)
+        TTL toDateTime(date) + INTERVAL ${ANALYTICS_EVENTS_TTL_DAYS} DAY
+        SETTINGS ttl_only_drop_parts = 1;
+
+INSERT INTO dialog_analytics_migration_0004 SELECT * FROM dialog_analytics;
+
+EXCHANGE TABLES dialog_analytics AND dialog_analytics_migration_0004;
+
+DROP TABLE dialog_analytics_migration_0004;
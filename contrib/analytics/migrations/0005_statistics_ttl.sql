@@ -0,0 +1,14 @@
+-- Удаление старой статистики по TTL
+-- Эти таблицы небольшие, поэтому ключи сортировки не меняются
+
+ALTER TABLE limiter_statistics
+    MODIFY TTL toDateTime(date) + INTERVAL ${ANALYTICS_STATISTICS_TTL_DAYS} DAY;
+
+ALTER TABLE local_server_general_statistics
+    MODIFY TTL toDateTime(date) + INTERVAL ${ANALYTICS_STATISTICS_TTL_DAYS} DAY;
+
+ALTER TABLE local_server_bot_statistics
+    MODIFY TTL toDateTime(date) + INTERVAL ${ANALYTICS_STATISTICS_TTL_DAYS} DAY;
+
+ALTER TABLE analytics_sampling_statistics
+    MODIFY TTL toDateTime(date) + INTERVAL ${ANALYTICS_STATISTICS_TTL_DAYS} DAY;
@@ -0,0 +1,26 @@
+-- Дедупликация вставок для не реплицируемых таблиц
+-- Журнал аналитики повторяет пакеты с insert_deduplication_token, но MergeTree без репликации
+-- учитывает его только при ненулевой non_replicated_deduplication_window.
+-- Clickhouse хранит хеши последних ${ANALYTICS_DEDUPLICATION_WINDOW} вставок в каждую таблицу,
+-- поэтому повтор пакета после оборванной или неоднозначной вставки не создаёт дублей.
+
+ALTER TABLE update
+    MODIFY SETTING non_replicated_deduplication_window = ${ANALYTICS_DEDUPLICATION_WINDOW};
+
+ALTER TABLE bot_send_analytics
+    MODIFY SETTING non_replicated_deduplication_window = ${ANALYTICS_DEDUPLICATION_WINDOW};
+
+ALTER TABLE dialog_analytics
+    MODIFY SETTING non_replicated_deduplication_window = ${ANALYTICS_DEDUPLICATION_WINDOW};
+
+ALTER TABLE limiter_statistics
+    MODIFY SETTING non_replicated_deduplication_window = ${ANALYTICS_DEDUPLICATION_WINDOW};
+
+ALTER TABLE local_server_general_statistics
+    MODIFY SETTING non_replicated_deduplication_window = ${ANALYTICS_DEDUPLICATION_WINDOW};
+
+ALTER TABLE local_server_bot_statistics
+    MODIFY SETTING non_replicated_deduplication_window = ${ANALYTICS_DEDUPLICATION_WINDOW};
+
+ALTER TABLE analytics_sampling_statistics
+    MODIFY SETTING non_replicated_deduplication_window = ${ANALYTICS_DEDUPLICATION_WINDOW};
@@ -1,7 +1,3 @@
 from pathlib import Path
 
-SQL_SCRIPTS_DIR = Path(__file__).resolve().parent / "sql"
-DIALOG_ANALYTICS_DDL_SQL = SQL_SCRIPTS_DIR / "dialog_analytics.sql"
-BOT_SEND_ANALYTICS_DDL_SQL = SQL_SCRIPTS_DIR / "bot_send_analytics.sql"
-UPDATE_DDL_SQL = SQL_SCRIPTS_DIR / "update.sql"
-LOCAL_SERVER_ANALYTICS_DDL_SQL = SQL_SCRIPTS_DIR / "local_server_analytics.sql"
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
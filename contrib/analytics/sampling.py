@@ -0,0 +1,142 @@
+"""
+Выборочное сохранение аналитики и сброс нагрузки
+
+Доля сохраняемых строк задаётся для таблицы и отдельно для ключа строки:
+типа события для update, метода bot api для bot_send_analytics и обработчика для dialog_analytics.
+Решение принимается до построения строки, поэтому пропущенные события почти ничего не стоят.
+
+Когда очередь записи заполняется выше ANALYTICS_SHEDDING_HIGH_WATER_MARK, строки менее важных таблиц
+отбрасываются: сначала с наибольшим номером приоритета, затем, по мере заполнения, следующие.
+Таблицы с приоритетом 0 не сбрасываются.
+
+Число увиденных, пропущенных и отброшенных строк сохраняется в ANALYTICS_SAMPLING_STATS_TABLE,
+по нему можно пересчитать полные значения.
+"""
+
+import random
+from dataclasses import dataclass, field
+from typing import Any
+
+from djgram.configs import (
+    ANALYTICS_SAMPLING_KEY_RATES,
+    ANALYTICS_SAMPLING_RATES,
+    ANALYTICS_SHEDDING_HIGH_WATER_MARK,
+    ANALYTICS_SHEDDING_PRIORITIES,
+)
+
+
+@dataclass
+class SamplingCounters:
+    """
+    Счётчики строк одной таблицы и ключа за период
+
+    Attributes:
+        seen: сколько строк пришло
+        written: сколько строк поставлено в очередь записи
+        sampled_out: сколько строк пропущено выборкой
+        shed: сколько строк отброшено при заполнении очереди выше high water mark
+        dropped: сколько строк отброшено из-за полной очереди
+    """
+
+    seen: int = 0
+    written: int = 0
+    sampled_out: int = 0
+    shed: int = 0
+    dropped: int = 0
+
+
+@dataclass
+class SamplingPolicy:
+    """
+    Правила выборки и сброса строк аналитики
+
+    Attributes:
+        rates: доля сохраняемых строк для таблицы, по умолчанию 1
+        key_rates: доля сохраняемых строк для ключа в таблице, важнее rates
+        priorities: приоритет таблицы, 0 - самые важные, никогда не сбрасываются
+        high_water_mark: заполнение очереди от 0 до 1, с которого начинается сброс
+    """
+
+    rates: dict[str, float] = field(default_factory=dict)
+    key_rates: dict[str, dict[str, float]] = field(default_factory=dict)
+    priorities: dict[str, int] = field(default_factory=dict)
+    high_water_mark: float = 1
+
+    def __post_init__(self):
+        if not 0 <= self.high_water_mark <= 1:
+            raise ValueError("high_water_mark should be in [0, 1]")
+
+        for rate in (*self.rates.values(), *(rate for rates in self.key_rates.values() for rate in rates.values())):
+            if not 0 <= rate <= 1:
+                raise ValueError("Sampling rates should be in [0, 1]")
+
+    def get_rate(self, table_name: str, key: str | None = None) -> float:
+        """
+        Возвращает долю сохраняемых строк таблицы с ключом key
+        """
+        key_rates = self.key_rates.get(table_name)
+        if key_rates is not None and key is not None:
+            rate = key_rates.get(key)
+            if rate is not None:
+                return rate
+
+        return self.rates.get(table_name, 1)
+
+    def sample(self, table_name: str, key: str | None = None) -> bool:
+        """
+        Решает, нужно ли сохранять строку
+        """
+        rate = self.get_rate(table_name, key)
+        return rate >= 1 or random.random() < rate  # noqa: S311
+
+    def get_shedding_threshold(self, table_name: str) -> float:
+        """
+        Возвращает заполнение очереди, с которого строки таблицы отбрасываются
+
+        Пороги равномерно распределены между high_water_mark для наименее важных таблиц и 1.
+        """
+        priority = self.priorities.get(table_name, 0)
+        if priority <= 0:
+            return float("inf")
+
+        max_priority = max(self.priorities.values())
+        return self.high_water_mark + (1 - self.high_water_mark) * (max_priority - priority) / max_priority
+
+    def shed(self, table_name: str, fill: float) -> bool:
+        """
+        Решает, нужно ли отбросить строку при заполнении очереди fill от 0 до 1
+        """
+        return fill >= self.get_shedding_threshold(table_name)
+
+
+def get_default_sampling_policy() -> SamplingPolicy:
+    """
+    Возвращает правила выборки из настроек
+    """
+    return SamplingPolicy(
+        rates=ANALYTICS_SAMPLING_RATES,
+        key_rates=ANALYTICS_SAMPLING_KEY_RATES,
+        priorities=ANALYTICS_SHEDDING_PRIORITIES,
+        high_water_mark=ANALYTICS_SHEDDING_HIGH_WATER_MARK,
+    )
+
+
+def get_counters_row(
+    table_name: str,
+    key: str | None,
+    counters: SamplingCounters,
+    policy: SamplingPolicy,
+) -> dict[str, Any]:
+    """
+    Возвращает строку статистики выборки для записи в clickhouse
+    """
+    return {
+        "table": table_name,
+        "key": key or "",
+        "rate": policy.get_rate(table_name, key),
+        "seen": counters.seen,
+        "written": counters.written,
+        "sampled_out": counters.sampled_out,
+        "shed": counters.shed,
+        "dropped": counters.dropped,
+    }
@@ -0,0 +1,90 @@
+"""
+Схема таблиц аналитики в clickhouse
+
+Таблицы создаются и изменяются миграциями из папки migrations, см. djgram.db.clickhouse_migrations.
+"""
+
+import asyncio
+import logging
+
+from djgram.configs import CLICKHOUSE_MIGRATE_ON_STARTUP
+from djgram.db import clickhouse
+from djgram.db.clickhouse_migrations import ClickHouseMigrator, Migration, MigrationLockedError
+
+from .misc import MIGRATIONS_DIR
+
+logger = logging.getLogger(__name__)
+
+#: Начальная миграция, её запросы можно безопасно выполнять на работающих ботах
+INITIAL_MIGRATION_VERSION = 1
+
+_lock = asyncio.Lock()
+_ensured = False
+
+
+def get_analytics_migrator() -> ClickHouseMigrator:
+    return ClickHouseMigrator(MIGRATIONS_DIR)
+
+
+async def migrate_analytics_schema(target: int | None = None) -> list[Migration]:
+    """
+    Применяет миграции схемы аналитики
+
+    Args:
+        target: последняя версия, которую нужно применить, по умолчанию все
+
+    Returns:
+        Применённые миграции
+    """
+    return await get_analytics_migrator().migrate(target)
+
+
+async def ensure_analytics_schema() -> None:
+    """
+    Проверяет схему аналитики один раз за время работы процесса
+
+    Если миграции ещё ни разу не применялись, применяет начальную миграцию: она только создаёт таблицы
+    и добавляет колонки, которых нет, поэтому аналитика сразу начинает сохраняться.
+    Об остальных не применённых миграциях по умолчанию только предупреждает, их нужно применить командой
+    python -m djgram migrate-clickhouse при остановленных ботах. Если включено CLICKHOUSE_MIGRATE_ON_STARTUP,
+    применяет их сам, а если миграции уже применяет другой процесс, только пишет об этом в лог.
+    Ошибки пишутся в лог и не мешают запуску бота,
+    аналитика при этом сохраняется в журнал на диске, пока clickhouse не станет доступен.
+    """
+    global _ensured  # noqa: PLW0603
+
+    async with _lock:
+        if _ensured:
+            return
+
+        try:
+            if CLICKHOUSE_MIGRATE_ON_STARTUP:
+                await migrate_analytics_schema()
+            else:
+                migrator = get_analytics_migrator()
+                async with clickhouse.connection() as client:
+                    pending = await migrator.get_pending(client)
+                if pending and pending[0].version == INITIAL_MIGRATION_VERSION:
+                    await migrator.migrate(target=INITIAL_MIGRATION_VERSION)
+                    pending = pending[1:]
+                if pending:
+                    logger.warning(
+                        "Clickhouse analytics schema is outdated, not applied migrations: %s. "
+                        "Stop bots and run python -m djgram migrate-clickhouse",
+                        ", ".join(migration.path.name for migration in pending),
+                    )
+
+        except MigrationLockedError as exc:
+            logger.warning("Clickhouse analytics schema is not checked: %s", exc)
+            return
+
+        except Exception as exc:
+            logger.exception(
+                "Clickhouse analytics schema migration error: %s: %s",
+                exc.__class__.__name__,
+                exc,  # noqa: TRY401
+                exc_info=exc,
+            )
+            return
+
+        _ensured = True
@@ -0,0 +1,247 @@
+"""
+Приёмники аналитики
+
+Все источники аналитики пишут в AnalyticsWriter, который копит строки и передаёт их пакетами приёмнику.
+Приёмник выбирается настройкой ANALYTICS_SINK - путём до класса:
+
+* ClickHouseSink - колоночные вставки в clickhouse, используется по умолчанию
+* FileSink - сжатые файлы ndjson на диске без обращений к сети, например для стенда,
+  нагрузочных тестов и небольших установок, файлы потом можно загрузить в clickhouse
+* MemorySink - кольцевой буфер в памяти для тестов
+"""
+
+import abc
+import asyncio
+import gzip
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import IO, Any
+
+import orjson
+from djgram.configs import (
+    ANALYTICS_FILE_SINK_DIR,
+    ANALYTICS_FILE_SINK_MAX_FILE_AGE,
+    ANALYTICS_FILE_SINK_MAX_FILE_SIZE,
+    ANALYTICS_SINK,
+)
+from djgram.db import clickhouse
+from djgram.utils.misc import resolve_pyobj
+
+from .schema import ensure_analytics_schema
+
+logger = logging.getLogger(__name__)
+
+#: Суффикс файла, в который ещё идёт запись
+PART_SUFFIX = ".part"
+
+
+class AnalyticsSink(abc.ABC):
+    """
+    Приёмник пакетов строк аналитики
+    """
+
+    async def prepare(self) -> None:  # noqa: B027
+        """
+        Готовит приёмник к записи, вызывается при запуске бота
+        """
+
+    @abc.abstractmethod
+    async def write(self, table_name: str, columns: dict[str, list[Any]], token: str | None = None) -> None:
+        """
+        Записывает пакет строк одной таблицы
+
+        Args:
+            table_name: таблица
+            columns: значения по колонкам, все списки одной длины
+            token: ключ пакета при повторной записи из журнала, по нему можно отбросить дубли
+        """
+
+    async def close(self) -> None:  # noqa: B027
+        """
+        Дописывает данные и освобождает ресурсы, вызывается после записи последнего пакета
+        """
+
+
+class ClickHouseSink(AnalyticsSink):
+    """
+    Записывает пакеты в clickhouse одним колоночным INSERT
+
+    Повторные пакеты из журнала вставляются с insert_deduplication_token
+    """
+
+    async def prepare(self) -> None:
+        await ensure_analytics_schema()
+
+    async def write(self, table_name: str, columns: dict[str, list[Any]], token: str | None = None) -> None:
+        settings = {"insert_deduplication_token": token} if token is not None else None
+        async with clickhouse.connection() as clickhouse_connection:
+            await clickhouse.insert_columns(clickhouse_connection, table_name, columns, settings=settings)
+
+
+def _json_default(value: Any) -> Any:
+    # Колонки String, например event в update, приходят в виде bytes из orjson.dumps
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+
+    raise TypeError(f"Type {value.__class__.__name__} is not JSON serializable")
+
+
+def dump_ndjson(columns: dict[str, list[Any]]) -> bytes:
+    """
+    Превращает пакет из колонок в строки ndjson, подходящие для формата JSONEachRow в clickhouse
+    """
+    names = tuple(columns)
+    return b"".join(
+        orjson.dumps(dict(zip(names, values, strict=True)), default=_json_default, option=orjson.OPT_APPEND_NEWLINE)
+        for values in zip(*columns.values(), strict=True)
+    )
+
+
+class _OpenFile:
+    __slots__ = ("opened_at", "path", "size", "stream")
+
+    def __init__(self, path: Path, stream: IO[bytes]):
+        self.path = path
+        self.stream = stream
+        self.size = 0
+        self.opened_at = time.monotonic()
+
+
+class FileSink(AnalyticsSink):
+    """
+    Дописывает пакеты в файлы ndjson, сжатые gzip, отдельно для каждой таблицы
+
+    Файлы лежат в <directory>/<таблица>/<дата>-<pid>-<номер>.ndjson.gz. Пока в файл идёт запись,
+    у него суффикс .part, после закрытия файл переименовывается и больше не меняется.
+    Новый файл начинается, когда текущий вырастает больше max_file_size байт до сжатия или старше max_file_age секунд.
+
+    Загрузить файл в clickhouse можно так:
+    clickhouse-client --date_time_input_format best_effort --query "INSERT INTO update FORMAT JSONEachRow" < file
+    (для сжатого файла через gzip -dc).
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str] = ANALYTICS_FILE_SINK_DIR,
+        max_file_size: int = ANALYTICS_FILE_SINK_MAX_FILE_SIZE,
+        max_file_age: float = ANALYTICS_FILE_SINK_MAX_FILE_AGE,
+        compresslevel: int | None = 6,
+    ):
+        """
+        Args:
+            directory: папка для файлов, создаётся при необходимости
+            max_file_size: размер файла в байтах до сжатия, после которого начинается новый файл
+            max_file_age: время в секундах, после которого начинается новый файл
+            compresslevel: уровень сжатия gzip от 1 до 9, None - без сжатия
+        """
+        self.directory = Path(directory)
+        self.max_file_size = max_file_size
+        self.max_file_age = max_file_age
+        self.compresslevel = compresslevel
+
+        # Запись выполняется в потоках, чтобы сжатие и диск не блокировали цикл событий
+        self._lock = threading.Lock()
+        self._files: dict[str, _OpenFile] = {}
+        self._number = 0
+
+    @property
+    def suffix(self) -> str:
+        return ".ndjson" if self.compresslevel is None else ".ndjson.gz"
+
+    def _open(self, table_name: str) -> _OpenFile:
+        table_dir = self.directory / table_name
+        table_dir.mkdir(parents=True, exist_ok=True)
+
+        self._number += 1
+        date = datetime.now(tz=UTC).strftime("%Y%m%d-%H%M%S")
+        path = table_dir / f"{date}-{os.getpid()}-{self._number:06d}{self.suffix}{PART_SUFFIX}"
+        if self.compresslevel is None:
+            stream = path.open("ab")
+        else:
+            stream = gzip.open(path, "ab", compresslevel=self.compresslevel)  # noqa: SIM115
+
+        return _OpenFile(path, stream)
+
+    @staticmethod
+    def _seal(file: _OpenFile) -> None:
+        file.stream.close()
+        file.path.rename(file.path.with_name(file.path.name.removesuffix(PART_SUFFIX)))
+
+    def write_sync(self, table_name: str, columns: dict[str, list[Any]]) -> None:
+        """
+        Дописывает пакет строк в файл таблицы
+        """
+        data = dump_ndjson(columns)
+
+        with self._lock:
+            file = self._files.get(table_name)
+            if file is not None and (
+                file.size >= self.max_file_size or time.monotonic() - file.opened_at >= self.max_file_age
+            ):
+                self._seal(file)
+                file = None
+
+            if file is None:
+                file = self._files[table_name] = self._open(table_name)
+
+            file.stream.write(data)
+            # Пакет сразу становится читаемым, при падении процесса теряется только недописанный пакет
+            file.stream.flush()
+            file.size += len(data)
+
+    async def write(self, table_name: str, columns: dict[str, list[Any]], token: str | None = None) -> None:
+        await asyncio.to_thread(self.write_sync, table_name, columns)
+
+    def close_sync(self) -> None:
+        with self._lock:
+            files, self._files = self._files, {}
+            for file in files.values():
+                self._seal(file)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.close_sync)
+
+
+class MemorySink(AnalyticsSink):
+    """
+    Хранит последние строки в памяти, старые строки вытесняются новыми
+
+    Нужен для тестов и отладки
+    """
+
+    def __init__(self, capacity: int = 10_000):
+        """
+        Args:
+            capacity: сколько последних строк хранить
+        """
+        self.rows: deque[tuple[str, dict[str, Any]]] = deque(maxlen=capacity)
+
+    async def write(self, table_name: str, columns: dict[str, list[Any]], token: str | None = None) -> None:
+        names = tuple(columns)
+        for values in zip(*columns.values(), strict=True):
+            self.rows.append((table_name, dict(zip(names, values, strict=True))))
+
+    def get_rows(self, table_name: str | None = None) -> list[dict[str, Any]]:
+        """
+        Возвращает сохранённые строки таблицы или всех таблиц
+        """
+        return [row for row_table_name, row in self.rows if table_name is None or row_table_name == table_name]
+
+    def clear(self) -> None:
+        self.rows.clear()
+
+
+def get_default_analytics_sink() -> AnalyticsSink:
+    """
+    Создаёт приёмник аналитики из настройки ANALYTICS_SINK
+    """
+    sink_class = resolve_pyobj(ANALYTICS_SINK)
+    if not (isinstance(sink_class, type) and issubclass(sink_class, AnalyticsSink)):
+        raise TypeError(f"ANALYTICS_SINK should be path to AnalyticsSink subclass, got {ANALYTICS_SINK}")
+
+    return sink_class()
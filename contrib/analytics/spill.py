@@ -0,0 +1,342 @@
+"""
+Журнал на диске для аналитики, которую не удалось записать в clickhouse
+
+Пакеты строк дописываются в файлы-сегменты в формате <длина записи: 4 байта big-endian><orjson>.
+Когда текущий сегмент вырастает больше ANALYTICS_SPILL_SEGMENT_SIZE, начинается новый.
+После восстановления связи сегменты воспроизводятся по порядку, позиция сохраняется в файл checkpoint,
+поэтому после перезапуска воспроизведение продолжается с того же места.
+
+Каждый пакет вставляется с insert_deduplication_token, вычисленным по таблице и содержимому пакета,
+поэтому повторное воспроизведение одного пакета не создаёт дублей. Для не реплицируемых таблиц
+дедупликация работает только с настройкой таблицы non_replicated_deduplication_window,
+её включает миграция 0006_deduplication_window (ANALYTICS_DEDUPLICATION_WINDOW).
+
+Сегменты читаются по одной записи, поэтому в памяти не держится весь сегмент.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import struct
+import threading
+from collections.abc import Awaitable, Callable, Iterator
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Final
+
+import orjson
+from djgram.configs import ANALYTICS_SPILL_MAX_SIZE, ANALYTICS_SPILL_SEGMENT_SIZE
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX: Final[str] = ".spill"
+CHECKPOINT_FILE_NAME: Final[str] = "checkpoint"
+
+_HEADER = struct.Struct(">I")
+
+# Типы значений, которые не переживают json без явного преобразования
+_DATETIME = "datetime"
+_BYTES = "bytes"
+
+
+@dataclass
+class SpillRecord:
+    """
+    Пакет строк одной таблицы в колоночном виде
+
+    Attributes:
+        table_name: таблица, в которую нужно вставить строки
+        columns: значения по колонкам
+        token: ключ дедупликации вставки
+    """
+
+    table_name: str
+    columns: dict[str, list[Any]]
+    token: str
+
+    @property
+    def rows(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+
+def _get_column_type(values: list[Any]) -> str | None:
+    for value in values:
+        if value is None:
+            continue
+
+        if isinstance(value, datetime):
+            return _DATETIME
+
+        if isinstance(value, bytes):
+            return _BYTES
+
+        return None
+
+    return None
+
+
+def _encode_column(values: list[Any], column_type: str | None) -> list[Any]:
+    if column_type == _DATETIME:
+        return [None if value is None else value.isoformat() for value in values]
+
+    if column_type == _BYTES:
+        return [None if value is None else base64.b64encode(value).decode() for value in values]
+
+    return values
+
+
+def _decode_column(values: list[Any], column_type: str | None) -> list[Any]:
+    if column_type == _DATETIME:
+        return [None if value is None else datetime.fromisoformat(value) for value in values]
+
+    if column_type == _BYTES:
+        return [None if value is None else base64.b64decode(value) for value in values]
+
+    return values
+
+
+def encode_record(table_name: str, columns: dict[str, list[Any]]) -> bytes:
+    """
+    Сериализует пакет строк в запись журнала вместе с заголовком длины
+    """
+    types = {name: _get_column_type(values) for name, values in columns.items()}
+    body = {
+        "table": table_name,
+        "types": types,
+        "columns": {name: _encode_column(values, types[name]) for name, values in columns.items()},
+    }
+    # Одинаковые пакеты дают одинаковый ключ, по нему clickhouse отбрасывает повторные вставки
+    payload = orjson.dumps(body, option=orjson.OPT_SORT_KEYS)
+    body["token"] = f"spill-{table_name}-{hashlib.sha256(payload).hexdigest()}"
+    data = orjson.dumps(body)
+
+    return _HEADER.pack(len(data)) + data
+
+
+def decode_record(data: bytes) -> SpillRecord:
+    """
+    Восстанавливает пакет строк из записи журнала без заголовка
+    """
+    body = orjson.loads(data)
+    types = body["types"]
+
+    return SpillRecord(
+        table_name=body["table"],
+        columns={name: _decode_column(values, types[name]) for name, values in body["columns"].items()},
+        token=body["token"],
+    )
+
+
+def read_records(path: Path, offset: int = 0) -> Iterator[tuple[SpillRecord, int]]:
+    """
+    Читает записи сегмента по одной, начиная с offset
+
+    Returns:
+        Пары из записи и позиции сразу после неё.
+        Оборванная в конце файла запись (например, после падения процесса) пропускается.
+    """
+    with path.open("rb") as file:
+        file.seek(offset)
+        position = offset
+        while len(header := file.read(_HEADER.size)) == _HEADER.size:
+            (length,) = _HEADER.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                logger.warning("Truncated record at %s:%s skipped", path, position)
+                return
+
+            position += _HEADER.size + length
+            yield decode_record(data), position
+
+
+@dataclass
+class SpillLogStats:
+    """
+    Статистика журнала
+
+    Attributes:
+        spilled_records: сколько пакетов записано в журнал
+        spilled_rows: сколько строк записано в журнал
+        dropped_rows: сколько строк отброшено из-за ограничения размера журнала
+        replayed_records: сколько пакетов воспроизведено
+        replayed_rows: сколько строк воспроизведено
+        disk_usage: сколько байт занимает журнал
+    """
+
+    spilled_records: int = 0
+    spilled_rows: int = 0
+    dropped_rows: int = 0
+    replayed_records: int = 0
+    replayed_rows: int = 0
+    disk_usage: int = 0
+
+
+class SpillLog:
+    """
+    Журнал пакетов аналитики на диске
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str],
+        segment_size: int = ANALYTICS_SPILL_SEGMENT_SIZE,
+        max_size: int = ANALYTICS_SPILL_MAX_SIZE,
+    ):
+        """
+        Args:
+            directory: папка для сегментов журнала, создаётся при необходимости
+            segment_size: размер в байтах, после которого начинается новый сегмент
+            max_size: максимальный размер журнала в байтах, пакеты сверх него отбрасываются
+        """
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.stats = SpillLogStats()
+
+        # Запись и чтение выполняются в потоках, чтобы не блокировать цикл событий
+        self._lock = threading.Lock()
+        self._replay_lock = asyncio.Lock()
+        self._current: Path | None = None
+        self._current_size = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        segments = self.get_segments()
+        self._next_number = int(segments[-1].stem) + 1 if segments else 0
+        self.stats.disk_usage = sum(segment.stat().st_size for segment in segments)
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self.directory / CHECKPOINT_FILE_NAME
+
+    def get_segments(self) -> list[Path]:
+        """
+        Возвращает сегменты журнала от старых к новым
+        """
+        return sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+    @property
+    def pending(self) -> bool:
+        """
+        Есть ли в журнале пакеты, ожидающие воспроизведения
+        """
+        return self.stats.disk_usage > 0
+
+    def _new_segment(self) -> Path:
+        path = self.directory / f"{self._next_number:012d}{SEGMENT_SUFFIX}"
+        self._next_number += 1
+        self._current_size = 0
+        return path
+
+    def _seal(self) -> list[Path]:
+        """
+        Закрывает текущий сегмент, чтобы новые записи шли в следующий, и возвращает закрытые сегменты
+        """
+        with self._lock:
+            self._current = None
+            return self.get_segments()
+
+    def append_sync(self, table_name: str, columns: dict[str, list[Any]]) -> bool:
+        """
+        Дописывает пакет строк в журнал
+
+        Returns:
+            False, если пакет отброшен из-за ограничения размера журнала
+        """
+        record = encode_record(table_name, columns)
+        rows = len(next(iter(columns.values()), ()))
+
+        with self._lock:
+            if self.stats.disk_usage + len(record) > self.max_size:
+                self.stats.dropped_rows += rows
+                logger.warning(
+                    "Analytics spill log is full (%s bytes), %s rows of %s dropped",
+                    self.stats.disk_usage,
+                    rows,
+                    table_name,
+                )
+                return False
+
+            if self._current is None or self._current_size >= self.segment_size:
+                self._current = self._new_segment()
+
+            with self._current.open("ab") as file:
+                file.write(record)
+                file.flush()
+                os.fsync(file.fileno())
+
+            self._current_size += len(record)
+            self.stats.disk_usage += len(record)
+            self.stats.spilled_records += 1
+            self.stats.spilled_rows += rows
+
+        return True
+
+    async def append(self, table_name: str, columns: dict[str, list[Any]]) -> bool:
+        """
+        Дописывает пакет строк в журнал, не блокируя цикл событий
+
+        Returns:
+            False, если пакет отброшен из-за ограничения размера журнала
+        """
+        return await asyncio.to_thread(self.append_sync, table_name, columns)
+
+    def _load_checkpoint(self, segment: Path) -> int:
+        try:
+            checkpoint = orjson.loads(self.checkpoint_path.read_bytes())
+        except FileNotFoundError:
+            return 0
+
+        if checkpoint["segment"] != segment.name:
+            return 0
+
+        return checkpoint["offset"]
+
+    def _save_checkpoint(self, segment: Path, offset: int) -> None:
+        # Запись через временный файл, чтобы не оставить повреждённую позицию при падении
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        tmp_path.write_bytes(orjson.dumps({"segment": segment.name, "offset": offset}))
+        tmp_path.replace(self.checkpoint_path)
+
+    def _remove_segment(self, segment: Path) -> None:
+        with self._lock:
+            self.stats.disk_usage -= segment.stat().st_size
+            segment.unlink()
+            self.checkpoint_path.unlink(missing_ok=True)
+
+    async def replay(self, insert: Callable[[SpillRecord], Awaitable[Any]]) -> int:
+        """
+        Воспроизводит журнал по порядку
+
+        При ошибке вставки воспроизведение прерывается, исключение пробрасывается,
+        а следующий вызов продолжит с той же записи.
+
+        Args:
+            insert: функция вставки пакета в clickhouse
+
+        Returns:
+            Сколько строк воспроизведено
+        """
+        replayed_rows = 0
+        async with self._replay_lock:
+            for segment in await asyncio.to_thread(self._seal):
+                offset = await asyncio.to_thread(self._load_checkpoint, segment)
+                records = read_records(segment, offset)
+                try:
+                    # Чтение с диска и разбор записи тоже выполняются в потоке
+                    while (item := await asyncio.to_thread(next, records, None)) is not None:
+                        record, end = item
+                        await insert(record)
+                        await asyncio.to_thread(self._save_checkpoint, segment, end)
+                        self.stats.replayed_records += 1
+                        self.stats.replayed_rows += record.rows
+                        replayed_rows += record.rows
+                finally:
+                    records.close()
+
+                await asyncio.to_thread(self._remove_segment, segment)
+                logger.info("Analytics spill segment %s replayed", segment.name)
+
+        return replayed_rows
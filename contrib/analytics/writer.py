@@ -0,0 +1,504 @@
+"""
+Пакетная запись аналитики
+
+Строки копятся в памяти отдельно для каждой таблицы и передаются приёмнику (см. sinks.py) одним пакетом,
+когда набирается ANALYTICS_WRITER_BATCH_SIZE строк или проходит ANALYTICS_WRITER_FLUSH_INTERVAL секунд.
+Clickhouse плохо переносит множество вставок по одной строке: появляется много мелких кусков данных.
+
+Если запись не удалась, пакет сохраняется в журнал на диске (см. spill.py)
+и воспроизводится после первой успешной записи.
+
+Перед построением строки источники вызывают admit_analytics, который применяет правила выборки
+и сброса нагрузки (см. sampling.py).
+
+Построение строк (model_dump, orjson) можно вынести из цикла событий в пул потоков через write_analytics_deferred:
+на цикле событий сохраняются только ссылки на неизменяемые объекты, строка строится в потоке.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable, Hashable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from typing import Any
+
+from djgram.configs import (
+    ANALYTICS_SAMPLING_STATS_PERIOD,
+    ANALYTICS_SAMPLING_STATS_TABLE,
+    ANALYTICS_SERIALIZATION_WORKERS,
+    ANALYTICS_SPILL_DIR,
+    ANALYTICS_WRITER_BATCH_SIZE,
+    ANALYTICS_WRITER_FLUSH_INTERVAL,
+    ANALYTICS_WRITER_MAX_QUEUE_SIZE,
+)
+
+from .sampling import SamplingCounters, SamplingPolicy, get_counters_row, get_default_sampling_policy
+from .sinks import AnalyticsSink, ClickHouseSink, get_default_analytics_sink
+from .spill import SpillLog, SpillRecord
+
+logger = logging.getLogger(__name__)
+
+RowBuilder = Callable[[], dict[str, Any]]
+
+
+def _run_builders(
+    builders: list[tuple[str, str | None, RowBuilder]],
+) -> list[tuple[str, str | None, dict[str, Any] | Exception]]:
+    results = []
+    for table_name, key, build in builders:
+        try:
+            results.append((table_name, key, build()))
+        except Exception as exc:  # noqa: BLE001
+            results.append((table_name, key, exc))
+
+    return results
+
+
+@dataclass
+class AnalyticsWriterStats:
+    """
+    Статистика записи аналитики
+
+    Attributes:
+        queued_rows: сколько строк ждут записи
+        max_queued_rows: максимальное число строк, ожидавших записи одновременно
+        dropped_rows: сколько строк отброшено из-за переполнения очереди
+        flushed_rows: сколько строк записано
+        failed_rows: сколько строк не удалось записать ни в clickhouse, ни в журнал
+        flushes: сколько было вставок
+        failed_flushes: сколько вставок завершились ошибкой
+        flush_time: суммарное время вставок в секундах
+    """
+
+    queued_rows: int = 0
+    max_queued_rows: int = 0
+    dropped_rows: int = 0
+    flushed_rows: int = 0
+    failed_rows: int = 0
+    flushes: int = 0
+    failed_flushes: int = 0
+    flush_time: float = 0
+
+
+class _TableBuffer:
+    __slots__ = ("columns", "handle", "rows", "table_name")
+
+    def __init__(self, table_name: str, column_names: tuple[str, ...]):
+        self.table_name = table_name
+        self.columns: dict[str, list[Any]] = {name: [] for name in column_names}
+        self.rows = 0
+        self.handle: asyncio.TimerHandle | None = None
+
+
+class AnalyticsWriter:
+    """
+    Общий для всех источников аналитики буфер записи
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        batch_size: int = ANALYTICS_WRITER_BATCH_SIZE,
+        flush_interval: float = ANALYTICS_WRITER_FLUSH_INTERVAL,
+        max_queue_size: int = ANALYTICS_WRITER_MAX_QUEUE_SIZE,
+        spill: SpillLog | None = None,
+        policy: SamplingPolicy | None = None,
+        stats_period: float = ANALYTICS_SAMPLING_STATS_PERIOD,
+        serialization_workers: int = 0,
+        sink: AnalyticsSink | None = None,
+    ):
+        """
+        Args:
+            batch_size: сколько строк одной таблицы записывать за раз
+            flush_interval: сколько секунд строка может ждать записи
+            max_queue_size: сколько строк всего может ждать записи, остальные отбрасываются
+            spill: журнал для пакетов, которые не удалось записать, None - такие пакеты теряются
+            policy: правила выборки и сброса строк, по умолчанию все строки сохраняются
+            stats_period: период записи статистики выборки в секундах
+            serialization_workers: число потоков для построения строк в write_deferred,
+                0 - строки строятся в цикле событий
+            sink: приёмник пакетов, по умолчанию clickhouse
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.spill = spill
+        self.sink = sink if sink is not None else ClickHouseSink()
+        self.policy = policy if policy is not None else SamplingPolicy()
+        self.stats_period = stats_period
+        self.stats = AnalyticsWriterStats()
+        self._replay_task: asyncio.Task | None = None
+
+        self._counters: dict[tuple[str, str | None], SamplingCounters] = {}
+        self._counters_start = time.time()
+        self._counters_handle: asyncio.TimerHandle | None = None
+
+        self._executor = (
+            ThreadPoolExecutor(serialization_workers, thread_name_prefix="analytics")
+            if serialization_workers > 0
+            else None
+        )
+        self._builders: list[tuple[str, str | None, RowBuilder]] = []
+        self._pending_builds = set[asyncio.Future]()
+
+        self._buffers: dict[Hashable, _TableBuffer] = {}
+        self._pending_tasks = set[asyncio.Task]()
+        self._closed = False
+
+    def _get_counters(self, table_name: str, key: str | None) -> SamplingCounters:
+        counters = self._counters.get((table_name, key))
+        if counters is None:
+            counters = self._counters[(table_name, key)] = SamplingCounters()
+            if self._counters_handle is None:
+                self._counters_handle = asyncio.get_running_loop().call_later(
+                    self.stats_period,
+                    self._write_counters,
+                )
+
+        return counters
+
+    def admit(self, table_name: str, key: str | None = None) -> bool:
+        """
+        Решает, нужно ли строить и записывать строку, по правилам выборки и заполнению очереди
+
+        Args:
+            table_name: таблица, в которую пойдёт строка
+            key: тип события, метод bot api или другой ключ, для которого задаётся доля выборки
+        """
+        counters = self._get_counters(table_name, key)
+        counters.seen += 1
+
+        if not self.policy.sample(table_name, key):
+            counters.sampled_out += 1
+            return False
+
+        if self.policy.shed(table_name, self.stats.queued_rows / self.max_queue_size):
+            counters.shed += 1
+            if counters.shed == 1:
+                logger.warning("Analytics queue is over high water mark, shedding %s rows", table_name)
+            return False
+
+        return True
+
+    def write(
+        self,
+        table_name: str,
+        row: dict[str, Any],
+        key: str | None = None,
+        *,
+        admitted: bool = False,
+    ) -> bool:
+        """
+        Добавляет строку в очередь на запись
+
+        Args:
+            table_name: таблица
+            row: строка
+            key: ключ строки для статистики выборки, тот же, что передавался в admit
+            admitted: строка уже прошла admit, иначе он вызывается здесь
+
+        Returns:
+            False, если строка отброшена выборкой, из-за переполнения очереди или остановки записи
+        """
+        if not admitted and not self.admit(table_name, key):
+            return False
+
+        counters = self._get_counters(table_name, key)
+        if self._enqueue(table_name, row):
+            counters.written += 1
+            return True
+
+        counters.dropped += 1
+        return False
+
+    def write_deferred(
+        self,
+        table_name: str,
+        build: RowBuilder,
+        key: str | None = None,
+        *,
+        admitted: bool = False,
+    ) -> bool:
+        """
+        Строит строку в пуле потоков и добавляет её в очередь на запись
+
+        build выполняется в другом потоке, поэтому должен обращаться только к неизменяемым данным,
+        например к объектам aiogram.types, а изменяемые значения (время, contextvars) получать заранее.
+
+        Args:
+            table_name: таблица
+            build: функция построения строки
+            key: ключ строки для статистики выборки, тот же, что передавался в admit
+            admitted: строка уже прошла admit, иначе он вызывается здесь
+
+        Returns:
+            False, если строка отброшена выборкой или остановкой записи
+        """
+        if self._executor is None:
+            if not admitted and not self.admit(table_name, key):
+                return False
+
+            return self.write(table_name, build(), key, admitted=True)
+
+        if self._closed or (not admitted and not self.admit(table_name, key)):
+            return False
+
+        # Все строки, поставленные за одну итерацию цикла событий, строятся одной задачей пула
+        if not self._builders:
+            asyncio.get_running_loop().call_soon(self._submit_builders)
+        self._builders.append((table_name, key, build))
+        # Строящиеся строки тоже занимают очередь, чтобы сброс нагрузки учитывал их
+        self.stats.queued_rows += 1
+
+        return True
+
+    def _submit_builders(self) -> None:
+        if not self._builders:
+            return
+
+        builders, self._builders = self._builders, []
+        future = asyncio.get_running_loop().run_in_executor(self._executor, _run_builders, builders)
+        self._pending_builds.add(future)
+        future.add_done_callback(self._on_built)
+
+    def _on_built(self, future: asyncio.Future) -> None:
+        self._pending_builds.discard(future)
+        if future.cancelled():
+            return
+
+        results = future.result()
+        self.stats.queued_rows -= len(results)
+        for table_name, key, row in results:
+            if isinstance(row, Exception):
+                logger.error(
+                    "Building analytics row for %s error: %s: %s",
+                    table_name,
+                    row.__class__.__name__,
+                    row,
+                    exc_info=row,
+                )
+                continue
+
+            self.write(table_name, row, key, admitted=True)
+
+    async def _wait_builds(self) -> None:
+        self._submit_builders()
+        if self._pending_builds:
+            await asyncio.gather(*self._pending_builds, return_exceptions=True)
+
+    def _write_counters(self) -> None:
+        self._counters_handle = None
+        now = time.time()
+        period = now - self._counters_start
+        counters, self._counters = self._counters, {}
+        self._counters_start = now
+
+        date = datetime.fromtimestamp(now, tz=UTC)
+        for (table_name, key), table_counters in counters.items():
+            row = get_counters_row(table_name, key, table_counters, self.policy)
+            # Без статистики нельзя пересчитать полные значения, поэтому она записывается даже при полной очереди
+            self._enqueue(ANALYTICS_SAMPLING_STATS_TABLE, {"date": date, "period": period, **row}, force=True)
+
+    def _enqueue(self, table_name: str, row: dict[str, Any], *, force: bool = False) -> bool:
+        stats = self.stats
+        if self._closed or (stats.queued_rows >= self.max_queue_size and not force):
+            stats.dropped_rows += 1
+            if stats.dropped_rows == 1 or stats.dropped_rows % 1000 == 0:
+                logger.warning("Analytics queue is full, %s rows dropped", stats.dropped_rows)
+            return False
+
+        # Строки с разным набором колонок нельзя вставить одним запросом
+        column_names = tuple(row)
+        key = (table_name, column_names)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = _TableBuffer(table_name, column_names)
+            buffer.handle = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_buffer, key)
+
+        for name, column in buffer.columns.items():
+            column.append(row[name])
+        buffer.rows += 1
+
+        stats.queued_rows += 1
+        stats.max_queued_rows = max(stats.max_queued_rows, stats.queued_rows)
+
+        if buffer.rows >= self.batch_size:
+            self._flush_buffer(key)
+
+        return True
+
+    def _flush_buffer(self, key: Hashable) -> None:
+        buffer = self._buffers.pop(key, None)
+        if buffer is None:
+            return
+
+        if buffer.handle is not None:
+            buffer.handle.cancel()
+
+        task = asyncio.create_task(self._insert(buffer))
+        # Храним ссылку на задачу, чтобы она не уничтожилась в процессе выполнения
+        self._pending_tasks.add(task)
+        task.add_done_callback(self._pending_tasks.discard)
+
+    async def _insert(self, buffer: _TableBuffer) -> None:
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            await self.sink.write(buffer.table_name, buffer.columns)
+
+        except Exception as exc:
+            stats.failed_flushes += 1
+            logger.exception(
+                "Writing %s rows of analytics table %s error: %s: %s",
+                buffer.rows,
+                buffer.table_name,
+                exc.__class__.__name__,
+                exc,  # noqa: TRY401
+                exc_info=exc,
+            )
+            if not await self._spill(buffer):
+                stats.failed_rows += buffer.rows
+
+        else:
+            stats.flushes += 1
+            stats.flushed_rows += buffer.rows
+            if self.spill is not None and self.spill.pending and not self._closed:
+                self._start_replay()
+
+        finally:
+            stats.queued_rows -= buffer.rows
+            stats.flush_time += time.perf_counter() - start
+
+    async def _spill(self, buffer: _TableBuffer) -> bool:
+        if self.spill is None:
+            return False
+
+        try:
+            return await self.spill.append(buffer.table_name, buffer.columns)
+        except Exception as exc:
+            logger.exception("Spilling analytics to disk error: %s", exc, exc_info=exc)  # noqa: TRY401
+            return False
+
+    def _start_replay(self) -> None:
+        if self._replay_task is not None and not self._replay_task.done():
+            return
+
+        self._replay_task = asyncio.create_task(self.replay())
+
+    async def _insert_record(self, record: SpillRecord) -> None:
+        await self.sink.write(record.table_name, record.columns, token=record.token)
+
+    async def replay(self) -> None:
+        """
+        Воспроизводит журнал пакетов, которые не удалось записать раньше
+        """
+        if self.spill is None:
+            return
+
+        try:
+            rows = await self.spill.replay(self._insert_record)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Replaying analytics spill log error: %s: %s", exc.__class__.__name__, exc)
+        else:
+            if rows:
+                logger.info("Replayed %s analytics rows from spill log", rows)
+
+    async def flush(self) -> None:
+        """
+        Записывает все накопленные строки и ждёт окончания записи
+        """
+        await self._wait_builds()
+        for key in list(self._buffers):
+            self._flush_buffer(key)
+
+        if self._pending_tasks:
+            await asyncio.gather(*self._pending_tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        """
+        Записывает все накопленные строки, новые строки после этого отбрасываются
+        """
+        await self._wait_builds()
+        if self._counters_handle is not None:
+            self._counters_handle.cancel()
+            self._write_counters()
+
+        self._closed = True
+        await self.flush()
+        if self._replay_task is not None:
+            await asyncio.gather(self._replay_task, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        await self.sink.close()
+        logger.info("Analytics writer closed: %s", self.stats)
+
+
+_writer: AnalyticsWriter | None = None
+
+
+def get_analytics_writer() -> AnalyticsWriter:
+    """
+    Возвращает общий буфер записи аналитики, создавая его при первом обращении
+    """
+    global _writer  # noqa: PLW0603
+    if _writer is None:
+        spill = SpillLog(ANALYTICS_SPILL_DIR) if ANALYTICS_SPILL_DIR is not None else None
+        _writer = AnalyticsWriter(
+            spill=spill,
+            policy=get_default_sampling_policy(),
+            serialization_workers=ANALYTICS_SERIALIZATION_WORKERS,
+            sink=get_default_analytics_sink(),
+        )
+
+    return _writer
+
+
+def admit_analytics(table_name: str, key: str | None = None) -> bool:
+    """
+    Решает, нужно ли строить и записывать строку аналитики, см. AnalyticsWriter.admit
+    """
+    return get_analytics_writer().admit(table_name, key)
+
+
+def write_analytics(table_name: str, row: dict[str, Any], key: str | None = None, *, admitted: bool = False) -> bool:
+    """
+    Добавляет строку аналитики в очередь на запись в общий буфер, см. AnalyticsWriter.write
+    """
+    return get_analytics_writer().write(table_name, row, key, admitted=admitted)
+
+
+def write_analytics_deferred(
+    table_name: str,
+    build: RowBuilder,
+    key: str | None = None,
+    *,
+    admitted: bool = False,
+) -> bool:
+    """
+    Строит строку аналитики в пуле потоков и добавляет её в очередь на запись, см. AnalyticsWriter.write_deferred
+    """
+    return get_analytics_writer().write_deferred(table_name, build, key, admitted=admitted)
+
+
+async def prepare_analytics_writer() -> None:
+    """
+    Готовит приёмник общего буфера к записи, например применяет миграции clickhouse
+
+    Можно зарегистрировать на запуск бота: dp.startup.register(prepare_analytics_writer)
+    """
+    await get_analytics_writer().sink.prepare()
+
+
+async def close_analytics_writer() -> None:
+    """
+    Записывает накопленную аналитику и останавливает общий буфер
+
+    Можно зарегистрировать на остановку бота: dp.shutdown.register(close_analytics_writer)
+    """
+    global _writer
+    if _writer is None:
+        return
+
+    writer, _writer = _writer, None
+    await writer.close()
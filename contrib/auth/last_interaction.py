@@ -0,0 +1,118 @@
+"""
+Отложенная запись времени последнего взаимодействия пользователей
+
+Время последнего взаимодействия нужно с точностью до дней, например для ACTIVE_USER_TIMEOUT в рассылках,
+а запись при каждом update'е превращает чтение пользователя в UPDATE. LastInteractionWriter копит
+время в памяти и раз в AUTH_LAST_INTERACTION_FLUSH_INTERVAL секунд записывает его одним UPDATE для всех пользователей.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any
+
+from djgram.configs import AUTH_LAST_INTERACTION_FLUSH_INTERVAL
+from djgram.db.base import get_autocommit_session
+from djgram.utils.async_tools import PeriodicTask
+from sqlalchemy import case, update
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+#: Сколько пользователей обновлять одним запросом
+LAST_INTERACTION_FLUSH_CHUNK_SIZE = 1000
+
+
+class LastInteractionWriter:
+    """
+    Копит время последнего взаимодействия пользователей и периодически записывает его в базу
+    """
+
+    def __init__(self, flush_interval: float = AUTH_LAST_INTERACTION_FLUSH_INTERVAL):
+        """
+        Args:
+            flush_interval: раз в сколько секунд записывать накопленное время
+        """
+        self.flush_interval = flush_interval
+
+        #: Сколько раз время пользователя записано в базу
+        self.written = 0
+        #: Сколько отметок заменено более новыми до записи
+        self.coalesced = 0
+
+        self._pending: dict[Any, datetime] = {}
+        self._task: PeriodicTask | None = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def touch(self, user_id: Any, when: datetime) -> None:
+        """
+        Запоминает время взаимодействия пользователя, в базу оно попадёт при следующей записи
+        """
+        if user_id in self._pending:
+            self.coalesced += 1
+        self._pending[user_id] = when
+
+        if self._task is None:
+            self._task = PeriodicTask(self.flush, self.flush_interval)
+            self._task.start()
+
+    async def flush(self) -> None:
+        """
+        Записывает накопленное время
+
+        UPDATE user SET last_interaction = CASE id WHEN ... THEN ... END
+        WHERE id IN (...) AND last_interaction < CASE id WHEN ... THEN ... END
+
+        Условие не даёт затереть более позднее время, записанное другим процессом
+        """
+        pending, self._pending = self._pending, {}
+        items = list(pending.items())
+
+        for start in range(0, len(items), LAST_INTERACTION_FLUSH_CHUNK_SIZE):
+            chunk = dict(items[start : start + LAST_INTERACTION_FLUSH_CHUNK_SIZE])
+            last_interaction = case(chunk, value=User.id)
+            stmt = (
+                update(User)
+                .where(User.id.in_(chunk.keys()), User.last_interaction < last_interaction)
+                .values(last_interaction=last_interaction)
+                .execution_options(synchronize_session=False)
+            )
+
+            try:
+                async with get_autocommit_session() as db_session:
+                    await db_session.execute(stmt)
+            except Exception as exc:
+                logger.exception(
+                    "Failed to save last interaction of %d users: %s",
+                    len(chunk),
+                    exc,  # noqa: TRY401
+                    exc_info=exc,
+                )
+                # Вернём время в очередь, если за это время не пришло более новое
+                for user_id, when in chunk.items():
+                    self._pending.setdefault(user_id, when)
+                continue
+
+            self.written += len(chunk)
+
+        if pending:
+            logger.debug("Saved last interaction of %d users", len(pending))
+
+    async def close(self) -> None:
+        """
+        Останавливает периодическую запись и записывает оставшееся время
+        """
+        if self._task is not None:
+            await self._task.stop()
+            self._task = None
+
+        await self.flush()
+
+
+last_interaction_writer = LastInteractionWriter()
+
+
+async def close_last_interaction_writer() -> None:
+    await last_interaction_writer.close()
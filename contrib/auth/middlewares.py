@@ -4,13 +4,15 @@
 
 import logging
 from collections.abc import Awaitable, Callable
-from datetime import UTC, datetime
+from datetime import UTC, datetime, timedelta
 from typing import Any
 
 from aiogram import BaseMiddleware, Bot
 from aiogram.enums import ChatType
 from aiogram.types import Update
 from djgram.configs import (
+    AUTH_LAST_INTERACTION_FLUSH_INTERVAL,
+    AUTH_LAST_INTERACTION_UPDATE_INTERVAL,
     BAN_MESSAGE,
     ENABLE_ACCESS_FOR_BANNED_ADMINS,
     ENABLE_BAN_MESSAGE,
@@ -24,7 +26,9 @@ from djgram.system_configs import (
     MIDDLEWARE_TELEGRAM_USER_KEY,
 )
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
+from .last_interaction import LastInteractionWriter, last_interaction_writer
 from .models import User
 from .user_model_base import AbstractUser
 
@@ -40,6 +44,54 @@ class AuthMiddleware(BaseMiddleware):
     Для работы требует TelegramMiddleware и DbSessionMiddleware
     """
 
+    def __init__(
+        self,
+        *,
+        last_interaction_update_interval: float = AUTH_LAST_INTERACTION_UPDATE_INTERVAL,
+        last_interaction_writer: LastInteractionWriter | None = (
+            last_interaction_writer if AUTH_LAST_INTERACTION_FLUSH_INTERVAL > 0 else None
+        ),
+    ):
+        """
+        Args:
+            last_interaction_update_interval: не чаще чем раз в сколько секунд записывать
+                время последнего взаимодействия пользователя, 0 - при каждом update'е
+            last_interaction_writer: записывать время последнего взаимодействия в фоне через него,
+                None - записывать в сессии update'а
+        """
+        self.last_interaction_update_interval = timedelta(seconds=last_interaction_update_interval)
+        self.last_interaction_writer = last_interaction_writer
+
+    def update_last_interaction(self, user: AbstractUser, *, user_created: bool) -> None:
+        """
+        Обновляет время последнего взаимодействия пользователя
+
+        Без интервала и фоновой записи время пишется при каждом update'е, как изменение пользователя в сессии.
+        Иначе время пишется, только если записанное устарело больше чем на интервал,
+        и при фоновой записи пользователь не помечается изменённым, поэтому update не вызывает UPDATE
+        """
+        now = datetime.now(tz=UTC)
+
+        if not self.last_interaction_update_interval and self.last_interaction_writer is None:
+            user.last_interaction = now
+            return
+
+        # У только что созданного пользователя время проставила база, его не нужно записывать
+        if user_created:
+            set_committed_value(user, "last_interaction", now)
+            return
+
+        if now - user.last_interaction.astimezone(tz=UTC) < self.last_interaction_update_interval:
+            return
+
+        if self.last_interaction_writer is None:
+            user.last_interaction = now
+            return
+
+        self.last_interaction_writer.touch(user.id, now)
+        # Обработчик видит новое время, но пользователь не считается изменённым
+        set_committed_value(user, "last_interaction", now)
+
     async def on_user_created(self, user: AbstractUser, db_session: AsyncSession) -> None:
         pass
 
@@ -60,7 +112,7 @@ class AuthMiddleware(BaseMiddleware):
             logger.info("New user [%s]", user.id)
             await self.on_user_created(user, db_session)
 
-        user.last_interaction = datetime.now(tz=UTC)
+        self.update_last_interaction(user, user_created=user_created)
 
         return user
 
@@ -15,6 +15,7 @@ from djgram.configs import (
     TELEGRAM_BROADCAST_TIMEOUT,
 )
 from djgram.contrib.auth.models import User
+from djgram.contrib.limits.priority import Priority, limiter_priority
 from djgram.contrib.telegram.models import TelegramChat
 from djgram.utils.formating import get_default_word_builder, seconds_to_human_readable
 from sqlalchemy import Select, func, select
@@ -84,7 +85,9 @@ async def broadcast(  # noqa: C901, PLR0912, PLR0913, PLR0915
         )
 
         try:
-            status = await send_method(chat_id=chat_id, **chat_kwargs, **kwargs)
+            # Рассылка не должна задерживать ответы пользователям
+            with limiter_priority(Priority.BULK):
+                status = await send_method(chat_id=chat_id, **chat_kwargs, **kwargs)
         except RecursionError as exc:
             logger.exception("Too many attempts to send message", exc_info=exc)
             errors += 1
@@ -1,8 +1,7 @@
-import copy
 import time
 from abc import ABC, abstractmethod
 from collections.abc import Callable, Hashable, Sequence
-from typing import TYPE_CHECKING, Any, cast
+from typing import Any, cast
 
 import phonenumbers
 from aiogram.enums import ContentType
@@ -22,9 +21,6 @@ from .validators import (
     PhoneNumberValidator,
 )
 
-if TYPE_CHECKING:
-    from aiogram_dialog.api.entities import Context, Stack
-
 
 class FormInput(MessageInput, ABC):
     """
@@ -95,7 +91,7 @@ class FormInput(MessageInput, ABC):
                         input_=self,
                         message=message,
                         middleware_data=manager.middleware_data,
-                        state_before=await manager.middleware_data["state"].get_state(),
+                        state_before=manager.middleware_data.get("raw_state"),
                         aiogd_context_before=manager.middleware_data[CONTEXT_KEY],
                         aiogd_stack_before=manager.middleware_data[STACK_KEY],
                     )
@@ -118,7 +114,7 @@ class FormInput(MessageInput, ABC):
                         input_=self,
                         message=message,
                         middleware_data=manager.middleware_data,
-                        state_before=await manager.middleware_data["state"].get_state(),
+                        state_before=manager.middleware_data.get("raw_state"),
                         aiogd_context_before=manager.middleware_data[CONTEXT_KEY],
                         aiogd_stack_before=manager.middleware_data[STACK_KEY],
                     )
@@ -127,16 +123,21 @@ class FormInput(MessageInput, ABC):
 
         self.set_validated_data(data, message)
 
-        aiogd_context_before: Context = copy.deepcopy(manager.middleware_data[CONTEXT_KEY])
-        aiogd_stack_before: Stack = copy.deepcopy(manager.middleware_data[STACK_KEY])
-        state_before: str | None = await manager.middleware_data["state"].get_state()
+        # Состояние до обработки нужно только для аналитики
+        analytics_enabled = dialog_analytics.DIALOG_ANALYTICS_ENABLED
+        aiogd_context_before = aiogd_stack_before = state_before = None
+        if analytics_enabled:
+            aiogd_context_before = dialog_analytics.ContextSnapshot.from_context(manager.middleware_data[CONTEXT_KEY])
+            aiogd_stack_before = dialog_analytics.StackSnapshot.from_stack(manager.middleware_data[STACK_KEY])
+            state_before = manager.middleware_data.get("raw_state")
+
         start = time.perf_counter()
         await self.func.process_event(message, self, manager)
         if self.on_validation_success is not None:
             await self.on_validation_success(message, self, manager)
         end = time.perf_counter()
 
-        if dialog_analytics.DIALOG_ANALYTICS_ENABLED:
+        if analytics_enabled:
             await dialog_analytics.save_input_statistics(
                 processor="form_input_process_message",
                 processed=True,
@@ -0,0 +1,318 @@
+"""
+Подстройка скорости запросов под реальные ограничения telegram
+
+Скорость каждого вида лимитов (общий, чаты, группы) управляется по AIMD:
+пока запросы упираются в лимитер и проходят, она растёт на фиксированную величину,
+а при TelegramRetryAfter уменьшается в несколько раз.
+Запросы, которые не ждали в лимитере, ничего не говорят о допустимой скорости и не учитываются.
+Изученные скорости можно сохранять в файл, чтобы они переживали перезапуск.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections.abc import Hashable, Mapping
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Final, Protocol
+
+from .backoff import CHAT_SCOPE_KIND, GLOBAL_SCOPE_KIND, GROUP_SCOPE_KIND
+from .constants import MAX_MESSAGES_PER_GROUP_PER_SECOND, MAX_MESSAGES_PER_SECOND, MAX_MESSAGES_PER_USER_PER_SECOND
+
+logger = logging.getLogger("limiter")
+
+#: Во сколько раз скорости по умолчанию могут превышать лимиты из документации telegram
+DEFAULT_CEILING_FACTOR: Final[float] = 2
+
+
+class RateTarget(Protocol):
+    """
+    Лимитер, скорость которого можно менять на лету
+    """
+
+    rate: float
+
+
+@dataclass
+class AIMDController:
+    """
+    Управление одной скоростью по AIMD (additive increase, multiplicative decrease)
+
+    Attributes:
+        rate: текущая скорость в запросах в секунду
+        floor: минимальная скорость
+        ceiling: максимальная скорость
+        increase: на сколько увеличивать скорость за каждый период без ошибок
+        decrease_factor: во сколько раз уменьшать скорость при ошибке, число от 0 до 1
+        increase_period: период увеличения скорости в секундах
+        decrease_cooldown: сколько секунд после уменьшения скорости игнорировать следующие ошибки,
+            так как они вызваны запросами, отправленными ещё со старой скоростью
+        saturation: какую долю интервала между запросами запрос должен прождать в лимитере,
+            чтобы считаться упёршимся в текущую скорость
+        min_keys: из скольких разных чатов должны прийти упёршиеся в скорость запросы за период,
+            чтобы её увеличить. Скорость вида лимитов общая для всех чатов,
+            поэтому она не должна расти из-за одного активного чата
+        increases: сколько раз скорость была увеличена
+        decreases: сколько раз скорость была уменьшена
+    """
+
+    rate: float
+    floor: float
+    ceiling: float
+    increase: float
+    decrease_factor: float = 0.5
+    increase_period: float = 1
+    decrease_cooldown: float = 1
+    saturation: float = 0.5
+    min_keys: int = 1
+    increases: int = 0
+    decreases: int = 0
+    _next_increase: float = field(default=0, repr=False)
+    _last_decrease: float = field(default=float("-inf"), repr=False)
+    _keys: set[Hashable] = field(default_factory=set, repr=False)
+    _keys_expire: float = field(default=0, repr=False)
+
+    def __post_init__(self):
+        if not 0 < self.floor <= self.ceiling:
+            raise ValueError("floor should be greater than 0 and less or equal ceiling")
+        if not 0 < self.decrease_factor < 1:
+            raise ValueError("decrease_factor should be between 0 and 1")
+        if self.min_keys < 1:
+            raise ValueError("min_keys should be greater or equal 1")
+
+        self.rate = min(max(self.rate, self.floor), self.ceiling)
+
+    def on_success(self, now: float, wait: float, key: Hashable = None) -> bool:
+        """
+        Учитывает успешный запрос
+
+        Args:
+            now: текущее время
+            wait: сколько секунд запрос ждал в лимитере
+            key: чат, в который был запрос
+
+        Returns:
+            Изменилась ли скорость
+        """
+        # Запрос прошёл без ожидания, значит скорость не ограничивает нагрузку и расти ей незачем
+        if wait * self.rate < self.saturation:
+            return False
+
+        if now >= self._keys_expire:
+            self._keys.clear()
+        if not self._keys:
+            self._keys_expire = now + self.increase_period
+        if len(self._keys) < self.min_keys:
+            self._keys.add(key)
+
+        if now < self._next_increase or len(self._keys) < self.min_keys:
+            return False
+
+        self._keys.clear()
+        self._next_increase = now + self.increase_period
+        if self.rate >= self.ceiling:
+            return False
+
+        self.rate = min(self.rate + self.increase, self.ceiling)
+        self.increases += 1
+        return True
+
+    def on_retry_after(self, now: float) -> bool:
+        """
+        Учитывает ошибку TelegramRetryAfter
+
+        Returns:
+            Изменилась ли скорость
+        """
+        # После уменьшения скорость должна успеть поработать целый период, прежде чем расти снова
+        self._next_increase = now + self.increase_period
+        self._keys.clear()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return False
+
+        self._last_decrease = now
+        if self.rate <= self.floor:
+            return False
+
+        self.rate = max(self.rate * self.decrease_factor, self.floor)
+        self.decreases += 1
+        return True
+
+
+def get_default_controllers() -> dict[str, AIMDController]:
+    """
+    Возвращает контроллеры, которые начинают со скоростей из документации telegram,
+    могут повышать их до DEFAULT_CEILING_FACTOR раз и не опускаются ниже них
+    """
+    return {
+        GLOBAL_SCOPE_KIND: AIMDController(
+            rate=MAX_MESSAGES_PER_SECOND,
+            floor=MAX_MESSAGES_PER_SECOND,
+            ceiling=MAX_MESSAGES_PER_SECOND * DEFAULT_CEILING_FACTOR,
+            increase=1,
+        ),
+        CHAT_SCOPE_KIND: AIMDController(
+            rate=MAX_MESSAGES_PER_USER_PER_SECOND,
+            floor=MAX_MESSAGES_PER_USER_PER_SECOND,
+            ceiling=MAX_MESSAGES_PER_USER_PER_SECOND * DEFAULT_CEILING_FACTOR,
+            increase=0.1,
+            min_keys=10,
+        ),
+        GROUP_SCOPE_KIND: AIMDController(
+            rate=MAX_MESSAGES_PER_GROUP_PER_SECOND,
+            floor=MAX_MESSAGES_PER_GROUP_PER_SECOND,
+            ceiling=MAX_MESSAGES_PER_GROUP_PER_SECOND * DEFAULT_CEILING_FACTOR,
+            increase=MAX_MESSAGES_PER_GROUP_PER_SECOND / 20,
+            min_keys=5,
+            increase_period=60,
+            decrease_cooldown=60,
+        ),
+    }
+
+
+class AdaptiveRateControl:
+    """
+    Подстраивает скорости лимитеров LimitCaller под ответы telegram
+
+    limit_caller = LimitCaller(adaptive=AdaptiveRateControl(state_path="limiter_rates.json"))
+    """
+
+    __slots__ = ("_next_save", "_save_lock", "_save_tasks", "_targets", "controllers", "save_period", "state_path")
+
+    def __init__(
+        self,
+        controllers: Mapping[str, AIMDController] | None = None,
+        state_path: str | Path | None = None,
+        save_period: float = 60,
+    ):
+        """
+        Args:
+            controllers: контроллеры для каждого вида лимитов: global, chat и group.
+                По умолчанию используются get_default_controllers()
+            state_path: путь к json файлу, в котором сохраняются изученные скорости.
+                Если файл существует, скорости загружаются из него.
+            save_period: как часто в секундах сохранять изменившиеся скорости
+        """
+        self.controllers = dict(get_default_controllers() if controllers is None else controllers)
+        self.state_path = Path(state_path) if state_path is not None else None
+        self.save_period = save_period
+
+        self._targets: dict[str, RateTarget] = {}
+        self._next_save = 0.0
+        self._save_lock = threading.Lock()
+        self._save_tasks = set[asyncio.Task]()
+
+        if self.state_path is not None and self.state_path.exists():
+            self.load()
+
+    @property
+    def rates(self) -> dict[str, float]:
+        """
+        Текущие скорости для каждого вида лимитов
+        """
+        return {kind: controller.rate for kind, controller in self.controllers.items()}
+
+    def bind(self, kind: str, target: RateTarget) -> None:
+        """
+        Связывает вид лимитов с лимитером, скорость которого будет меняться
+        """
+        controller = self.controllers.get(kind)
+        if controller is None:
+            return
+
+        self._targets[kind] = target
+        target.rate = controller.rate
+
+    def _apply(self, kind: str, now: float) -> None:
+        target = self._targets.get(kind)
+        if target is not None:
+            target.rate = self.controllers[kind].rate
+
+        if self.state_path is not None and now >= self._next_save:
+            self.save()
+
+    def on_success(self, kind: str, wait: float, key: Hashable = None) -> None:
+        """
+        Учитывает успешный запрос для вида лимитов
+
+        Args:
+            kind: вид лимитов
+            wait: сколько секунд запрос ждал в лимитере этого вида
+            key: чат, в который был запрос
+        """
+        controller = self.controllers.get(kind)
+        if controller is None:
+            return
+
+        now = time.monotonic()
+        if controller.on_success(now, wait, key):
+            self._apply(kind, now)
+
+    def on_retry_after(self, kind: str) -> None:
+        """
+        Учитывает ошибку TelegramRetryAfter для вида лимитов
+        """
+        controller = self.controllers.get(kind)
+        if controller is None:
+            return
+
+        now = time.monotonic()
+        if controller.on_retry_after(now):
+            logger.info("Decreased %s rate limit to %.3f requests per second", kind, controller.rate)
+            self._apply(kind, now)
+
+    def save(self) -> None:
+        """
+        Сохраняет изученные скорости в state_path
+
+        Внутри event loop файл записывается в отдельном потоке
+        """
+        if self.state_path is None:
+            return
+
+        self._next_save = time.monotonic() + self.save_period
+        data = json.dumps(self.rates, indent=2)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self.state_path, data)
+            return
+
+        task = loop.create_task(asyncio.to_thread(self._write, self.state_path, data))
+        self._save_tasks.add(task)
+        task.add_done_callback(self._save_tasks.discard)
+
+    def _write(self, path: Path, data: str) -> None:
+        # Запись через временный файл, чтобы не оставить повреждённый файл при падении
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        try:
+            with self._save_lock:
+                tmp_path.write_text(data)
+                tmp_path.replace(path)
+        except OSError as exc:
+            logger.warning("Failed to save limiter rates to %s: %s", path, exc)
+
+    def load(self) -> None:
+        """
+        Загружает скорости из state_path, ограничивая их рамками контроллеров
+        """
+        if self.state_path is None:
+            return
+
+        try:
+            rates = json.loads(self.state_path.read_text())
+        except (OSError, ValueError) as exc:
+            logger.warning("Failed to load limiter rates from %s: %s", self.state_path, exc)
+            return
+
+        for kind, rate in rates.items():
+            controller = self.controllers.get(kind)
+            if controller is None or not isinstance(rate, int | float):
+                continue
+
+            controller.rate = min(max(rate, controller.floor), controller.ceiling)
+            target = self._targets.get(kind)
+            if target is not None:
+                target.rate = controller.rate
@@ -0,0 +1,177 @@
+"""
+Ожидание после TelegramRetryAfter в рамках области, в которой оно возникло
+
+Флуд в одном чате не должен останавливать отправку сообщений во все остальные чаты,
+поэтому ожидание ведётся отдельно для каждого чата и группы,
+а глобально только если ошибки приходят сразу из нескольких чатов.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Hashable
+from dataclasses import dataclass
+from typing import Final, TypeAlias
+
+from .methods import ChatIdType
+
+logger = logging.getLogger("limiter")
+
+Scope: TypeAlias = tuple[str, Hashable]
+
+GLOBAL_SCOPE_KIND: Final[str] = "global"
+CHAT_SCOPE_KIND: Final[str] = "chat"
+GROUP_SCOPE_KIND: Final[str] = "group"
+#: Области, заданные пользовательской функцией, например в limit_retry_call
+KEY_SCOPE_KIND: Final[str] = "key"
+
+GLOBAL_SCOPE: Final[Scope] = (GLOBAL_SCOPE_KIND, None)
+
+# Когда записей становится больше, удаляем все устаревшие
+_SWEEP_THRESHOLD = 1024
+
+
+def get_chat_scope(chat_id: ChatIdType | None) -> Scope:
+    """
+    Возвращает область ожидания для чата
+
+    Методы, не привязанные к чату, ожидают глобально
+    """
+    if chat_id is None:
+        return GLOBAL_SCOPE
+
+    if isinstance(chat_id, str) or chat_id < 0:
+        return GROUP_SCOPE_KIND, chat_id
+
+    return CHAT_SCOPE_KIND, chat_id
+
+
+@dataclass
+class BackoffStats:
+    """
+    Статистика ожиданий для одного вида областей
+
+    Attributes:
+        retry_after_events: сколько раз пришла ошибка с retry_after
+        parked_requests: сколько запросов было приостановлено
+        parked_seconds: суммарное время ожидания приостановленных запросов
+    """
+
+    retry_after_events: int = 0
+    parked_requests: int = 0
+    parked_seconds: float = 0
+
+
+class RetryAfterBackoff:
+    """
+    Хранит время, до которого запросы в каждой области должны ждать
+    """
+
+    __slots__ = (
+        "_deadlines",
+        "_recent_scopes",
+        "global_escalation_threshold",
+        "global_escalation_window",
+        "sleep_gap",
+        "stats",
+    )
+
+    def __init__(
+        self,
+        sleep_gap: float = 0.1,
+        global_escalation_threshold: int = 3,
+        global_escalation_window: float = 1,
+    ):
+        """
+        Args:
+            sleep_gap: дополнительное время ожидания сверх retry_after в секундах
+            global_escalation_threshold: сколько разных областей должны получить ошибку,
+                чтобы ожидание стало глобальным. 0 - никогда не переходить к глобальному ожиданию.
+            global_escalation_window: за какое время в секундах считаются ошибки для перехода к глобальному ожиданию
+        """
+        self.sleep_gap = sleep_gap
+        self.global_escalation_threshold = global_escalation_threshold
+        self.global_escalation_window = global_escalation_window
+
+        self._deadlines: dict[Scope, float] = {}
+        self._recent_scopes: dict[Scope, float] = {}
+        self.stats: dict[str, BackoffStats] = {}
+
+    def _get_stats(self, scope: Scope) -> BackoffStats:
+        stats = self.stats.get(scope[0])
+        if stats is None:
+            stats = self.stats[scope[0]] = BackoffStats()
+
+        return stats
+
+    def _get_deadline(self, scope: Scope) -> tuple[Scope, float]:
+        """
+        Возвращает область, которая задерживает запрос дольше всего, и время окончания ожидания
+        """
+        global_deadline = self._deadlines.get(GLOBAL_SCOPE, 0)
+        deadline = self._deadlines.get(scope, 0)
+
+        if global_deadline >= deadline:
+            return GLOBAL_SCOPE, global_deadline
+
+        return scope, deadline
+
+    def _should_escalate(self, scope: Scope, now: float) -> bool:
+        if self.global_escalation_threshold <= 0 or scope == GLOBAL_SCOPE:
+            return False
+
+        self._recent_scopes[scope] = now
+        min_time = now - self.global_escalation_window
+        self._recent_scopes = {key: value for key, value in self._recent_scopes.items() if value >= min_time}
+
+        return len(self._recent_scopes) >= self.global_escalation_threshold
+
+    def _sweep(self, now: float) -> None:
+        self._deadlines = {key: value for key, value in self._deadlines.items() if value > now}
+
+    def park(self, scope: Scope, retry_after: float) -> Scope:
+        """
+        Приостанавливает запросы в области на retry_after секунд
+
+        Returns:
+            Область, в которой фактически приостановлены запросы
+        """
+        now = time.monotonic()
+        self._get_stats(scope).retry_after_events += 1
+
+        if self._should_escalate(scope, now):
+            logger.warning(
+                "Flood control exceeded in %s different scopes within %s sec, waiting globally",
+                len(self._recent_scopes),
+                self.global_escalation_window,
+            )
+            scope = GLOBAL_SCOPE
+
+        deadline = now + retry_after + self.sleep_gap
+        if deadline > self._deadlines.get(scope, 0):
+            self._deadlines[scope] = deadline
+
+        if len(self._deadlines) > _SWEEP_THRESHOLD:
+            self._sweep(now)
+
+        return scope
+
+    async def wait(self, scope: Scope) -> None:
+        """
+        Ждёт окончания ожидания в области и в глобальной области
+        """
+        blocking_scope, deadline = self._get_deadline(scope)
+        delay = deadline - time.monotonic()
+        if delay <= 0:
+            return
+
+        stats = self._get_stats(blocking_scope)
+        stats.parked_requests += 1
+        start = time.monotonic()
+        try:
+            while delay > 0:
+                await asyncio.sleep(delay)
+                _, deadline = self._get_deadline(scope)
+                delay = deadline - time.monotonic()
+        finally:
+            stats.parked_seconds += time.monotonic() - start
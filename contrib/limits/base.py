@@ -0,0 +1,38 @@
+"""
+Общие для лимитеров типы и функции
+"""
+
+from typing import Protocol, TypeAlias
+
+from limiter import Limiter
+
+
+class TokenLimiter(Protocol):
+    """
+    Лимитер, из которого можно забрать произвольное число токенов
+
+    Например, djgram.contrib.limits.redis_limiter.RedisLimiter
+    """
+
+    async def acquire(self, tokens: int = 1) -> None: ...
+
+
+AnyLimiter: TypeAlias = Limiter | TokenLimiter
+
+
+async def acquire_tokens(limiter: AnyLimiter, tokens: int) -> None:
+    """
+    Забирает из лимитера заданное число токенов
+
+    Limiter никогда не пропустит запрос дороже своей ёмкости,
+    поэтому дорогие запросы оплачиваются частями
+    """
+    if not isinstance(limiter, Limiter):
+        await limiter.acquire(tokens)
+        return
+
+    capacity = max(int(limiter.capacity), 1)
+    while tokens > 0:
+        chunk = min(tokens, capacity)
+        async with limiter(chunk):
+            tokens -= chunk
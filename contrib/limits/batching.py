@@ -0,0 +1,356 @@
+"""
+Объединение удалений и копирований сообщений в пакетные методы bot api
+
+Вызовы deleteMessage и copyMessage в один чат, пришедшие в течение нескольких миллисекунд,
+отправляются одним вызовом deleteMessages или copyMessages, до 100 сообщений за раз.
+Каждый вызывающий получает свой результат или исключение.
+
+deleteMessages пропускает сообщения, которые не удалось найти, поэтому для них
+вызывающий получает True вместо ошибки "message to delete not found".
+
+copyMessages копирует сообщения только по возрастанию id, поэтому пакет копирований делится
+на возрастающие серии в порядке вызовов, и серии отправляются друг за другом.
+Копии появляются в том же порядке, в котором были вызовы.
+Если copyMessages пропустил часть сообщений, нельзя понять, какие именно,
+поэтому созданные копии удаляются и сообщения копируются по одному.
+
+Если telegram отклонил пакет (TelegramBadRequest), вызовы отправляются по одному,
+чтобы каждый вызывающий получил свою ошибку. Другие ошибки, например сетевые, получают все вызывающие:
+пакет мог успеть выполниться, и повторная отправка скопировала бы сообщения дважды.
+
+Пакет отправляется с наибольшим request_timeout среди объединённых вызовов.
+
+forwardMessage не объединяется: он возвращает пересланное сообщение целиком,
+а forwardMessages только id сообщений.
+"""
+
+import asyncio
+import logging
+import math
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, Final, NamedTuple, TypeAlias, TypeVar
+
+from aiogram import Bot
+from aiogram.client.default import Default
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import CopyMessage, CopyMessages, DeleteMessage, DeleteMessages, TelegramMethod
+from aiogram.types import MessageId
+
+T = TypeVar("T")
+
+BotCallMethod: TypeAlias = Callable[[Bot, TelegramMethod[T], int | None], Awaitable[T]]
+
+logger = logging.getLogger("limiter")
+
+#: Максимальное число сообщений в одном пакетном методе
+MAX_BATCH_SIZE: Final[int] = 100
+
+# Параметры copyMessage, которых нет в copyMessages. Копирование с ними не объединяется.
+_COPY_ONLY_FIELDS = (
+    "video_start_timestamp",
+    "caption",
+    "caption_entities",
+    "show_caption_above_media",
+    "allow_paid_broadcast",
+    "reply_parameters",
+    "reply_markup",
+    "allow_sending_without_reply",
+    "reply_to_message_id",
+)
+
+
+class BatchResultMismatchError(Exception):
+    """
+    Пакетный метод вернул не столько результатов, сколько было сообщений,
+    а уже созданные копии не удалось удалить, чтобы повторить копирование по одному
+    """
+
+
+class _BatchItem(NamedTuple):
+    method: TelegramMethod[Any]
+    future: asyncio.Future[Any]
+    request_timeout: int | None
+
+
+def _resolve(bot: Bot, value: Any) -> Any:
+    if isinstance(value, Default):
+        return bot.default[value.name]
+
+    return value
+
+
+def get_batch_key(bot: Bot, method: TelegramMethod[Any]) -> Hashable | None:
+    """
+    Возвращает ключ пакета, в который можно добавить вызов, или None, если вызов нельзя объединять
+    """
+    if isinstance(method, DeleteMessage):
+        return bot.id, DeleteMessage, method.chat_id
+
+    if isinstance(method, CopyMessage):
+        if any(_resolve(bot, getattr(method, field)) for field in _COPY_ONLY_FIELDS):
+            return None
+
+        return (
+            bot.id,
+            CopyMessage,
+            method.chat_id,
+            method.from_chat_id,
+            method.message_thread_id,
+            _resolve(bot, method.disable_notification),
+            _resolve(bot, method.protect_content),
+        )
+
+    return None
+
+
+def build_batch_method(
+    bot: Bot,
+    method: TelegramMethod[Any],
+    message_ids: list[int],
+) -> DeleteMessages | CopyMessages:
+    """
+    Создаёт пакетный метод с параметрами метода method для сообщений message_ids
+    """
+    if isinstance(method, DeleteMessage):
+        return DeleteMessages(chat_id=method.chat_id, message_ids=message_ids)
+
+    if isinstance(method, CopyMessage):
+        return CopyMessages(
+            chat_id=method.chat_id,
+            from_chat_id=method.from_chat_id,
+            message_ids=message_ids,
+            message_thread_id=method.message_thread_id,
+            disable_notification=_resolve(bot, method.disable_notification),
+            protect_content=_resolve(bot, method.protect_content),
+        )
+
+    raise TypeError(f"Method {method.__class__.__name__} can not be batched")
+
+
+def get_request_timeout(bot: Bot, timeouts: list[int | None]) -> int | None:
+    """
+    Возвращает наибольший таймаут, None означает таймаут сессии бота
+    """
+    if all(timeout is None for timeout in timeouts):
+        return None
+
+    return math.ceil(max(bot.session.timeout if timeout is None else timeout for timeout in timeouts))
+
+
+def split_ascending(message_ids: list[int]) -> list[list[int]]:
+    """
+    Делит id сообщений на наибольшие возрастающие серии, не меняя порядок
+    """
+    runs: list[list[int]] = []
+    for message_id in message_ids:
+        if runs and runs[-1][-1] < message_id:
+            runs[-1].append(message_id)
+        else:
+            runs.append([message_id])
+
+    return runs
+
+
+class _Batch:
+    __slots__ = ("handle", "items")
+
+    def __init__(self):
+        # Словарь сохраняет порядок вызовов
+        self.items: dict[int, _BatchItem] = {}
+        self.handle: asyncio.TimerHandle | None = None
+
+
+class MethodBatcher:
+    """
+    Собирает вызовы в пакеты и отправляет их пакетными методами
+    """
+
+    __slots__ = ("_batches", "_tasks", "batched_calls", "delay", "original_call", "sent_batches")
+
+    def __init__(self, original_call: BotCallMethod, delay: float = 0.005):
+        """
+        Args:
+            original_call: исходный метод Bot.__call__
+            delay: сколько секунд ждать другие вызовы в тот же пакет
+        """
+        self.original_call = original_call
+        self.delay = delay
+        #: Сколько вызовов было отправлено в составе пакетов
+        self.batched_calls = 0
+        #: Сколько пакетных методов было отправлено
+        self.sent_batches = 0
+
+        self._batches: dict[Hashable, _Batch] = {}
+        self._tasks = set[asyncio.Task]()
+
+    def _flush(self, bot: Bot, key: Hashable) -> None:
+        batch = self._batches.pop(key)
+        if batch.handle is not None:
+            batch.handle.cancel()
+
+        task = asyncio.create_task(self._send(bot, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_one(self, bot: Bot, item: _BatchItem) -> None:
+        try:
+            result = await self.original_call(bot, item.method, item.request_timeout)
+        except Exception as exc:  # noqa: BLE001
+            item.future.set_exception(exc)
+        else:
+            item.future.set_result(result)
+
+    async def _send_each(self, bot: Bot, items: list[_BatchItem]) -> None:
+        await asyncio.gather(*(self._send_one(bot, item) for item in items))
+
+    async def _send(self, bot: Bot, batch: _Batch) -> None:
+        message_ids = list(batch.items)
+        first_method = batch.items[message_ids[0]].method
+
+        # Порядок удалений не важен
+        if isinstance(first_method, DeleteMessage):
+            await self._send_batch(bot, batch, sorted(message_ids))
+            return
+
+        for run in split_ascending(message_ids):
+            await self._send_batch(bot, batch, run)
+
+    async def _send_batch(self, bot: Bot, batch: _Batch, message_ids: list[int]) -> None:
+        items = [batch.items[message_id] for message_id in message_ids]
+        if len(items) == 1:
+            await self._send_each(bot, items)
+            return
+
+        batch_method = build_batch_method(bot, items[0].method, message_ids)
+        request_timeout = get_request_timeout(bot, [item.request_timeout for item in items])
+
+        try:
+            result = await self.original_call(bot, batch_method, request_timeout)
+        except TelegramBadRequest as exc:
+            # Telegram отклонил пакет целиком, отправляем по одному, чтобы каждый получил свою ошибку
+            logger.debug("%s failed, sending calls one by one: %s", batch_method.__class__.__name__, exc)
+            await self._send_each(bot, items)
+            return
+        except Exception as exc:  # noqa: BLE001
+            # После сетевой ошибки или таймаута неизвестно, выполнил ли telegram пакет,
+            # и повторная отправка может скопировать сообщения дважды
+            for item in items:
+                item.future.set_exception(exc)
+            return
+
+        await self._set_results(bot, batch_method, result, items, request_timeout)
+
+    async def _set_results(
+        self,
+        bot: Bot,
+        batch_method: DeleteMessages | CopyMessages,
+        result: Any,
+        items: list[_BatchItem],
+        request_timeout: int | None,
+    ) -> None:
+        """
+        Раздаёт результат пакетного метода вызывающим
+        """
+        if isinstance(batch_method, DeleteMessages):
+            self._count_batch(len(items))
+            for item in items:
+                item.future.set_result(result)
+            return
+
+        if len(result) != len(items):
+            await self._recopy_one_by_one(bot, batch_method, result, items, request_timeout)
+            return
+
+        self._count_batch(len(items))
+        for item, item_result in zip(items, result, strict=True):
+            item.future.set_result(item_result)
+
+    def _count_batch(self, calls: int) -> None:
+        self.sent_batches += 1
+        self.batched_calls += calls
+
+    async def _recopy_one_by_one(
+        self,
+        bot: Bot,
+        batch_method: CopyMessages,
+        result: list[MessageId],
+        items: list[_BatchItem],
+        request_timeout: int | None,
+    ) -> None:
+        """
+        Удаляет копии, созданные copyMessages с пропусками, и копирует сообщения по одному
+
+        Так каждый вызывающий получает свою копию или ошибку, а сообщения не дублируются
+        """
+        logger.debug(
+            "%s returned %s results for %s messages, copying one by one",
+            batch_method.__class__.__name__,
+            len(result),
+            len(items),
+        )
+        if result:
+            try:
+                await self.original_call(
+                    bot,
+                    DeleteMessages(
+                        chat_id=batch_method.chat_id,
+                        message_ids=[message_id.message_id for message_id in result],
+                    ),
+                    request_timeout,
+                )
+            except Exception as exc:  # noqa: BLE001
+                error = BatchResultMismatchError(
+                    f"{batch_method.__class__.__name__} returned {len(result)} results for {len(items)} messages",
+                )
+                error.__cause__ = exc
+                for item in items:
+                    item.future.set_exception(error)
+                return
+
+        await self._send_each(bot, items)
+
+    async def call(self, bot: Bot, method: TelegramMethod[T], request_timeout: int | None = None) -> T:
+        key = get_batch_key(bot, method)
+        if key is None:
+            return await self.original_call(bot, method, request_timeout)
+
+        message_id: int = method.message_id  # pyright: ignore [reportAttributeAccessIssue]
+        batch = self._batches.get(key)
+        # Одно и то же сообщение дважды в пакет не добавляется
+        if batch is not None and message_id in batch.items:
+            self._flush(bot, key)
+            batch = None
+
+        if batch is None:
+            batch = self._batches[key] = _Batch()
+            batch.handle = asyncio.get_running_loop().call_later(self.delay, self._flush, bot, key)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.items[message_id] = _BatchItem(method, future, request_timeout)
+        if len(batch.items) >= MAX_BATCH_SIZE:
+            self._flush(bot, key)
+
+        # Отмена одного вызывающего не должна отменять пакет для остальных
+        return await asyncio.shield(future)
+
+
+def method_batching_wrapper(original_call: BotCallMethod, delay: float = 0.005) -> BotCallMethod:
+    """
+    Объединяет удаления и копирования сообщений в пакетные методы
+    """
+    batcher = MethodBatcher(original_call, delay)
+
+    async def __call__(self: Bot, method: TelegramMethod[T], request_timeout: int | None = None) -> T:  # noqa: N807
+        return await batcher.call(self, method, request_timeout)
+
+    __call__.batcher = batcher  # pyright: ignore [reportFunctionMemberAccess]
+
+    return __call__
+
+
+def setup_method_batching(delay: float = 0.005) -> None:
+    """
+    Включает объединение удалений и копирований сообщений для всех ботов, изменения не обратимы
+    """
+    # noinspection PyTypeChecker
+    Bot.__call__ = method_batching_wrapper(Bot.__call__, delay)  # pyright: ignore [reportAttributeAccessIssue]
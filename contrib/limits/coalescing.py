@@ -0,0 +1,159 @@
+"""
+Объединение частых изменений одного сообщения
+
+Пока изменение сообщения ждёт в лимитере или выполняется, следующие изменения того же сообщения
+копятся, и отправляется только последнее из них. Каждый вызывающий получает результат
+фактически отправленного изменения. Ошибка "message is not modified" не пробрасывается.
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, TypeAlias, TypeVar
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import (
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    TelegramMethod,
+)
+
+T = TypeVar("T")
+
+BotCallMethod: TypeAlias = Callable[[Bot, TelegramMethod[T], int | None], Awaitable[T]]
+
+logger = logging.getLogger("limiter")
+
+#: Методы изменения сообщения, которые можно объединять
+COALESCED_EDIT_METHODS: tuple[type[TelegramMethod[Any]], ...] = (
+    EditMessageText,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+    EditMessageMedia,
+)
+
+
+def get_edit_key(bot: Bot, method: TelegramMethod[Any]) -> Hashable | None:
+    """
+    Возвращает ключ изменяемого сообщения или None, если вызов нельзя объединять
+    """
+    if not isinstance(method, COALESCED_EDIT_METHODS):
+        return None
+
+    if method.inline_message_id is not None:
+        return bot.id, method.inline_message_id
+
+    if method.chat_id is None or method.message_id is None:
+        return None
+
+    return bot.id, method.chat_id, method.message_id
+
+
+class _PendingEdit:
+    __slots__ = ("future", "method", "request_timeout")
+
+    def __init__(self, method: TelegramMethod[Any], request_timeout: int | None):
+        self.method = method
+        self.request_timeout = request_timeout
+        self.future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+
+
+class EditCoalescer:
+    """
+    Очереди изменений для каждого сообщения
+
+    Подряд идущие изменения одного вида заменяют друг друга, изменения разных видов
+    отправляются по порядку, так как, например, изменение текста без клавиатуры удаляет клавиатуру.
+    """
+
+    __slots__ = ("_queues", "_workers", "coalesced", "min_interval", "original_call")
+
+    def __init__(self, original_call: BotCallMethod, min_interval: float = 0):
+        """
+        Args:
+            original_call: исходный метод Bot.__call__
+            min_interval: минимальное время между изменениями одного сообщения в секундах
+        """
+        self.original_call = original_call
+        self.min_interval = min_interval
+        #: Сколько изменений не было отправлено, так как их заменили более новые
+        self.coalesced = 0
+
+        self._queues: dict[Hashable, list[_PendingEdit]] = {}
+        self._workers = set[asyncio.Task]()
+
+    async def _send(self, bot: Bot, edit: _PendingEdit) -> None:
+        try:
+            result = await self.original_call(bot, edit.method, edit.request_timeout)
+        except TelegramBadRequest as exc:
+            if "message is not modified" in exc.message:
+                logger.debug("Skipped edit without changes: %s", exc.message)
+                edit.future.set_result(True)
+            else:
+                edit.future.set_exception(exc)
+        except Exception as exc:  # noqa: BLE001
+            edit.future.set_exception(exc)
+        else:
+            edit.future.set_result(result)
+
+    async def _work(self, bot: Bot, key: Hashable) -> None:
+        queue = self._queues[key]
+        try:
+            while queue:
+                await self._send(bot, queue.pop(0))
+                if self.min_interval > 0:
+                    await asyncio.sleep(self.min_interval)
+        finally:
+            del self._queues[key]
+            # Если обработчик прервали, ожидающие не должны зависнуть
+            for edit in queue:
+                edit.future.cancel()
+
+    async def call(self, bot: Bot, method: TelegramMethod[T], request_timeout: int | None = None) -> T:
+        key = get_edit_key(bot, method)
+        if key is None:
+            return await self.original_call(bot, method, request_timeout)
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = []
+            worker = asyncio.create_task(self._work(bot, key))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+
+        if queue and type(queue[-1].method) is type(method):
+            edit = queue[-1]
+            edit.method = method
+            edit.request_timeout = request_timeout
+            self.coalesced += 1
+        else:
+            edit = _PendingEdit(method, request_timeout)
+            queue.append(edit)
+
+        # Отмена одного вызывающего не должна отменять изменение для остальных
+        return await asyncio.shield(edit.future)
+
+
+def edit_coalescing_wrapper(original_call: BotCallMethod, min_interval: float = 0) -> BotCallMethod:
+    """
+    Объединяет изменения одного сообщения, отправляя только последнее
+    """
+    coalescer = EditCoalescer(original_call, min_interval)
+
+    async def __call__(self: Bot, method: TelegramMethod[T], request_timeout: int | None = None) -> T:  # noqa: N807
+        return await coalescer.call(self, method, request_timeout)
+
+    __call__.coalescer = coalescer  # pyright: ignore [reportFunctionMemberAccess]
+
+    return __call__
+
+
+def setup_edit_coalescing(min_interval: float = 0) -> None:
+    """
+    Включает объединение изменений сообщений для всех ботов, изменения не обратимы
+    """
+    # noinspection PyTypeChecker
+    Bot.__call__ = edit_coalescing_wrapper(Bot.__call__, min_interval)  # pyright: ignore [reportAttributeAccessIssue]
@@ -0,0 +1,170 @@
+"""
+Компактное хранилище лимитеров для множества чатов
+
+Вместо отдельного объекта лимитера на каждый чат хранится одно число:
+теоретическое время прибытия следующего запроса (TAT) по алгоритму GCRA.
+Устаревшие записи эквивалентны отсутствующим и удаляются периодически при обращении к хранилищу.
+"""
+
+import asyncio
+import time
+from collections.abc import Hashable
+
+from djgram.system_configs import LIMIT_CALLER_LIMITER_SWEEP_PERIOD_SECONDS
+
+
+class GCRAStore:
+    """
+    Лимитеры с одинаковыми параметрами для произвольного числа ключей
+    """
+
+    __slots__ = (
+        "_interval",
+        "_next_sweep",
+        "_rate",
+        "_tats",
+        "burst",
+        "sweep_period",
+    )
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        sweep_period: float = LIMIT_CALLER_LIMITER_SWEEP_PERIOD_SECONDS,
+    ):
+        """
+        Args:
+            rate: максимальное число запросов в секунду для каждого ключа
+            burst: сколько запросов можно сделать разом
+            sweep_period: период удаления устаревших записей в секундах
+        """
+        if burst < 1:
+            raise ValueError("burst should be greater or equal 1")
+
+        self.rate = rate
+        self.burst = burst
+        self.sweep_period = sweep_period
+
+        self._tats: dict[Hashable, float] = {}
+        self._next_sweep = time.monotonic() + sweep_period
+
+    @property
+    def rate(self) -> float:
+        """
+        Максимальное число запросов в секунду для каждого ключа
+        """
+        return self._rate
+
+    @rate.setter
+    def rate(self, value: float) -> None:
+        if value <= 0:
+            raise ValueError("rate should be greater than 0")
+
+        self._rate = value
+        self._interval = 1 / value
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._tats.get(key, 0) > time.monotonic()
+
+    def sweep(self) -> None:
+        """
+        Удаляет записи, которые больше не ограничивают запросы
+        """
+        now = time.monotonic()
+        # Пересоздание словаря освобождает память, в отличие от удаления ключей по одному
+        self._tats = {key: tat for key, tat in self._tats.items() if tat > now}
+        self._next_sweep = now + self.sweep_period
+
+    def reserve(self, key: Hashable, cost: int = 1) -> float:
+        """
+        Резервирует cost запросов для ключа
+
+        Резерв не отменяется, поэтому после вызова запрос нужно выполнить
+
+        Returns:
+            Через сколько секунд можно выполнить запрос
+        """
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.sweep()
+
+        tat = self._tats.get(key, now)
+        tat = max(tat, now) + cost * self._interval
+        self._tats[key] = tat
+
+        return max(tat - self.burst * self._interval - now, 0)
+
+    async def acquire(self, key: Hashable, cost: int = 1) -> None:
+        """
+        Ждёт, пока для ключа можно будет выполнить cost запросов
+        """
+        delay = self.reserve(key, cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class GCRALimiter:
+    """
+    Лимитер для одного ключа, например для общего лимита всех запросов
+    """
+
+    __slots__ = ("_interval", "_rate", "_tat", "burst")
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Args:
+            rate: максимальное число запросов в секунду
+            burst: сколько запросов можно сделать разом
+        """
+        if burst < 1:
+            raise ValueError("burst should be greater or equal 1")
+
+        self.rate = rate
+        self.burst = burst
+        self._tat = 0.0
+
+    @property
+    def rate(self) -> float:
+        """
+        Максимальное число запросов в секунду
+        """
+        return self._rate
+
+    @rate.setter
+    def rate(self, value: float) -> None:
+        if value <= 0:
+            raise ValueError("rate should be greater than 0")
+
+        self._rate = value
+        self._interval = 1 / value
+
+    def reserve(self, tokens: int = 1) -> float:
+        """
+        Резервирует tokens запросов
+
+        Returns:
+            Через сколько секунд можно выполнить запрос
+        """
+        now = time.monotonic()
+        self._tat = max(self._tat, now) + tokens * self._interval
+
+        return max(self._tat - self.burst * self._interval - now, 0)
+
+    async def acquire(self, tokens: int = 1) -> None:
+        """
+        Ждёт, пока можно будет выполнить tokens запросов
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def __aenter__(self) -> "GCRALimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
@@ -5,50 +5,58 @@
 и https://github.com/python-telegram-bot/python-telegram-bot/blob/master/telegram/ext/_aioratelimiter.py
 """
 
-import asyncio
 import logging
-from collections.abc import Awaitable
-from typing import Any, TypeAlias
+import time
+from collections.abc import Awaitable, Mapping
+from types import MethodType
+from typing import Any
 
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
 from aiogram.client.session.base import BaseSession
 from aiogram.exceptions import TelegramRetryAfter
-from aiogram.methods import SendMessage, TelegramMethod
+from aiogram.methods import TelegramMethod
 from aiogram.methods.base import TelegramType
-from cachetools import TTLCache
-from djgram.system_configs import (
-    LIMIT_CALLER_CHAT_LIMITER_CACHE_MAX_SIZE,
-    LIMIT_CALLER_CHAT_LIMITER_CACHE_TTL_SECONDS,
-    LIMIT_CALLER_GROUP_LIMITER_CACHE_MAX_SIZE,
-    LIMIT_CALLER_GROUP_LIMITER_CACHE_TTL_SECONDS,
-)
-from limiter import Limiter
 
+from .adaptive import AdaptiveRateControl
+from .backoff import CHAT_SCOPE_KIND, GLOBAL_SCOPE_KIND, GROUP_SCOPE_KIND, RetryAfterBackoff, get_chat_scope
+from .base import AnyLimiter
 from .constants import MAX_MESSAGES_PER_GROUP_PER_SECOND, MAX_MESSAGES_PER_SECOND, MAX_MESSAGES_PER_USER_PER_SECOND
-
-ChatIdType: TypeAlias = int | str
+from .gcra import GCRALimiter, GCRAStore
+from .methods import ChatIdType, get_method_chat_id, get_method_cost
+from .metrics import LimiterMetrics, LimiterMetricsSnapshot
+from .policy import RatePolicy
+from .priority import LIMITER_PRIORITY, Priority, WeightedFairQueue
 
 logger = logging.getLogger("limiter")
 
 
 class LimitCaller:  # noqa: D101
     __slots__ = (
-        "_group_max_rate",
         "_overall_max_rate",
-        "_user_max_rate",
+        "adaptive",
+        "backoff",
         "chats_limiter",
+        "global_queue",
         "groups_limiter",
         "main_limiter",
         "max_retries",
+        "metrics",
+        "policy",
     )
 
-    def __init__(
+    def __init__(  # noqa: PLR0913
         self,
         overall_max_rate: float = MAX_MESSAGES_PER_SECOND,
         user_max_rate: float = MAX_MESSAGES_PER_USER_PER_SECOND,
         group_max_rate: float = MAX_MESSAGES_PER_GROUP_PER_SECOND,
         max_retries: int = 0,
+        main_limiter: AnyLimiter | None = None,
+        backoff: RetryAfterBackoff | None = None,
+        priority_weights: Mapping[Priority, float] | None = None,
+        adaptive: AdaptiveRateControl | None = None,
+        policy: RatePolicy | None = None,
+        max_concurrency: int | None = None,
     ) -> None:
         """
         A class that controls the speed of sending requests.
@@ -57,61 +65,156 @@ class LimitCaller:  # noqa: D101
         :param user_max_rate: maximum messages per seconds for each user
         :param group_max_rate: maximum messages per seconds for each group
         :param max_retries: maximum retires on TelegramRetryAfter exception
+        :param main_limiter: limiter for all chats in total, for example RedisLimiter shared between processes.
+            If None, local limiter with overall_max_rate is used.
+        :param backoff: storage of TelegramRetryAfter waits for each chat
+        :param priority_weights: shares of overall limit for each priority class
+        :param adaptive: if set, rates are adjusted by responses from telegram instead of being constant.
+            main_limiter should have mutable rate attribute, like default one or RedisLimiter.
+        :param policy: additional rate and concurrency policy applied after chat and global limits with chat id as key.
+            Can be shared with other code, for example with functions decorated by limit_retry_call.
+        :param max_concurrency: maximum number of requests running at the same time, ignored if policy is set
         """
 
         self._overall_max_rate = overall_max_rate
-        self._user_max_rate = user_max_rate
-        self._group_max_rate = group_max_rate
 
         if max_retries < 0:
             raise ValueError("max_retries should be greater or equal 0")
         self.max_retries = max_retries
+        self.backoff = backoff if backoff is not None else RetryAfterBackoff()
 
-        self.main_limiter = Limiter(self._overall_max_rate)
-        # 2**63 = no limit for cache size
-        self.groups_limiter = TTLCache[ChatIdType, Limiter](
-            maxsize=LIMIT_CALLER_GROUP_LIMITER_CACHE_MAX_SIZE,
-            ttl=LIMIT_CALLER_GROUP_LIMITER_CACHE_TTL_SECONDS,
-        )
-        self.chats_limiter = TTLCache[ChatIdType, Limiter](
-            maxsize=LIMIT_CALLER_CHAT_LIMITER_CACHE_MAX_SIZE,
-            ttl=LIMIT_CALLER_CHAT_LIMITER_CACHE_TTL_SECONDS,
+        self.main_limiter = main_limiter if main_limiter is not None else GCRALimiter(self._overall_max_rate, 3)
+        # Общий лимит раздаётся в порядке приоритета запросов
+        self.global_queue = WeightedFairQueue(self.main_limiter, priority_weights)
+        self.groups_limiter = GCRAStore(group_max_rate, 20)
+        self.chats_limiter = GCRAStore(user_max_rate, 3)
+
+        self.adaptive = adaptive
+        if adaptive is not None:
+            if hasattr(self.main_limiter, "rate"):
+                adaptive.bind(GLOBAL_SCOPE_KIND, self.main_limiter)  # pyright: ignore [reportArgumentType]
+            adaptive.bind(CHAT_SCOPE_KIND, self.chats_limiter)
+            adaptive.bind(GROUP_SCOPE_KIND, self.groups_limiter)
+
+        self.metrics = LimiterMetrics()
+
+        if policy is None and max_concurrency is not None:
+            policy = RatePolicy(max_concurrency=max_concurrency)
+        self.policy = policy
+
+    def get_metrics(self) -> LimiterMetricsSnapshot:
+        """
+        Returns current state of limiter metrics
+        """
+        calls, tokens, throughput, in_flight, queued, wait_time = self.metrics.snapshot()
+        backoff_stats = self.backoff.stats
+
+        return LimiterMetricsSnapshot(
+            date=time.time(),
+            calls=calls,
+            tokens=tokens,
+            throughput=throughput,
+            in_flight=in_flight,
+            queued=queued,
+            global_queue_depth=len(self.global_queue),
+            wait_time=wait_time,
+            retry_after_events={kind: stats.retry_after_events for kind, stats in backoff_stats.items()},
+            parked_requests={kind: stats.parked_requests for kind, stats in backoff_stats.items()},
+            parked_seconds={kind: stats.parked_seconds for kind, stats in backoff_stats.items()},
+            rates=self.adaptive.rates if self.adaptive is not None else {},
         )
 
-    async def _call_with_limit(
+    async def _call_with_limit(  # noqa: PLR0913
         self,
-        chat_id: ChatIdType,
+        chat_id: ChatIdType | None,
         coro: Awaitable[TelegramType],
-        storage: TTLCache[ChatIdType, Limiter],
-        rate: float,
-        burst: int,
+        storage: GCRAStore | None,
+        kind: str,
+        cost: int,
+        priority: Priority,
     ) -> TelegramType:
         """
         Calls the api method
 
         :param chat_id: telegram chat id
         :param coro: method
-        :param storage: chat or group storage
-        :param rate: call rate for limiters
-        :param burst: burst for limiters
+        :param storage: chat or group storage, if None only global limit is applied
+        :param kind: kind of chat limit for metrics
+        :param cost: number of tokens to consume
+        :param priority: priority of request in global queue
+        """
+        metrics = self.metrics
+
+        metrics.queued += 1
+        try:
+            start = time.perf_counter()
+            # Сначала ждём лимит чата, чтобы запросы в перегруженный чат не занимали место в общей очереди
+            if storage is not None:
+                await storage.acquire(chat_id, cost)
+            chat_acquired = time.perf_counter()
+            await self.global_queue.acquire(cost, priority)
+            global_acquired = time.perf_counter()
+        finally:
+            metrics.queued -= 1
+
+        chat_wait = chat_acquired - start
+        global_wait = global_acquired - chat_acquired
+        if storage is not None:
+            metrics.observe_wait(kind, chat_wait)
+        metrics.observe_wait(GLOBAL_SCOPE_KIND, global_wait)
+
+        if self.policy is None:
+            result = await self._run(coro, cost)
+        else:
+            async with self.policy.limit(chat_id, cost):
+                result = await self._run(coro, cost)
+
+        # Скорость растёт только от запросов, которые упирались в лимитер
+        if self.adaptive is not None:
+            if storage is not None:
+                self.adaptive.on_success(kind, chat_wait, chat_id)
+            self.adaptive.on_success(GLOBAL_SCOPE_KIND, global_wait)
+
+        return result
+
+    async def _run(self, coro: Awaitable[TelegramType], cost: int) -> TelegramType:
+        metrics = self.metrics
+
+        metrics.in_flight += 1
+        try:
+            return await coro
+        finally:
+            metrics.in_flight -= 1
+            metrics.record_call(cost)
+
+    async def call(
+        self,
+        chat_id: ChatIdType | None,
+        coro: Awaitable[TelegramType],
+        cost: int = 1,
+        priority: Priority | None = None,
+    ) -> TelegramType:
+        """
+        Calls the api method with respect to global and chat limits
+
+        :param chat_id: telegram chat id, if None only global limit is applied
+        :param coro: method
+        :param cost: number of tokens to consume, for example number of messages in media group
+        :param priority: priority of request, if None priority from LIMITER_PRIORITY context variable is used
         """
+        if cost <= 0:
+            return await coro
 
-        async with self.main_limiter:
-            limiter = storage.get(chat_id)
-            if not limiter:
-                limiter = Limiter(rate, burst)
-                storage[chat_id] = limiter
-                async with limiter:
-                    return await coro
-            else:
-                async with limiter:
-                    return await coro
+        if priority is None:
+            priority = LIMITER_PRIORITY.get()
+
+        if chat_id is None:
+            return await self._call_with_limit(chat_id, coro, None, GLOBAL_SCOPE_KIND, cost, priority)
 
-    async def call(self, chat_id: ChatIdType, coro: Awaitable[TelegramType]) -> TelegramType:
         if isinstance(chat_id, str) or chat_id < 0:
-            return await self._call_with_limit(chat_id, coro, self.groups_limiter, self._group_max_rate, 20)
+            return await self._call_with_limit(chat_id, coro, self.groups_limiter, GROUP_SCOPE_KIND, cost, priority)
 
-        return await self._call_with_limit(chat_id, coro, self.chats_limiter, self._user_max_rate, 3)
+        return await self._call_with_limit(chat_id, coro, self.chats_limiter, CHAT_SCOPE_KIND, cost, priority)
 
 
 class LimitedBot(Bot):
@@ -142,7 +245,9 @@ class LimitedBot(Bot):
         super().__init__(token=token, session=session, default=default, **kwargs)
 
         self.caller = limiter
-        self.__original__call__ = Bot.__call__
+        # Привязываем к экземпляру, иначе при вызове не передаётся self
+        # После patch_bot_with_limiter Bot.__call__ указывает на LimitedBot.__call__, поэтому берём исходный метод
+        self.__original__call__ = MethodType(Bot.__dict__.get("__original__call__", Bot.__call__), self)
 
     async def _call(
         self,
@@ -153,24 +258,29 @@ class LimitedBot(Bot):
         Just to not modify __init__ method
         """
 
+        chat_id = get_method_chat_id(method)
+        scope = get_chat_scope(chat_id)
+        cost = get_method_cost(method)
+
         # initial call and max_retries
         for attempt in range(self.caller.max_retries + 1):  # noqa: RET503
             try:
-                # In case a retry_after was hit, we wait with processing the request
-                await self._retry_after_event.wait()
+                # In case a retry_after was hit in this chat or globally, we wait with processing the request
+                await self.caller.backoff.wait(scope)
 
                 # run request
                 coro = self.__original__call__(  # pyright: ignore [reportCallIssue]
                     method=method,
                     request_timeout=request_timeout,
                 )
-                # if hasattr(method, "chat_id") and not isinstance(method, GetChat):
-                if isinstance(method, SendMessage):
-                    return await self.caller.call(method.chat_id, coro)  # pyright: ignore [reportReturnType]
-
-                return await coro  # pyright: ignore [reportReturnType]
+                result = await self.caller.call(chat_id, coro, cost)
 
             except TelegramRetryAfter as exc:
+                # Make sure we don't allow other requests to this chat to be processed
+                parked_scope = self.caller.backoff.park(scope, exc.retry_after)
+                if self.caller.adaptive is not None:
+                    self.caller.adaptive.on_retry_after(parked_scope[0])
+
                 if attempt == self.caller.max_retries:
                     logger.exception(
                         "Rate limit hit after maximum of %d retries",
@@ -180,12 +290,9 @@ class LimitedBot(Bot):
                     raise
 
                 logger.info(exc)
-                # Make sure we don't allow other requests to be processed
-                self._retry_after_event.clear()
-                await asyncio.sleep(exc.retry_after + 0.1)  # additional 0.1 sec gap
-            finally:
-                # Allow other requests to be processed
-                self._retry_after_event.set()
+
+            else:
+                return result  # pyright: ignore [reportReturnType]
 
     async def __call__(self, method: TelegramMethod[TelegramType], request_timeout: int | None = None) -> TelegramType:
         caller = getattr(self, "caller", None)
@@ -194,11 +301,6 @@ class LimitedBot(Bot):
 
         self.__call__ = LimitedBot._call  # pyright: ignore [reportAttributeAccessIssue]
 
-        if not getattr(self, "_retry_after_event", None):
-            # lock on TelegramRetryAfter exception
-            self._retry_after_event = asyncio.Event()
-            self._retry_after_event.set()
-
         return await LimitedBot._call(self, method, request_timeout)
 
 
@@ -0,0 +1,85 @@
+"""
+Реестр методов bot api, которые проходят через лимитер
+
+Для каждого метода определяется стоимость в токенах.
+Методы со стоимостью 0 выполняются без ограничений.
+"""
+
+from collections.abc import Callable
+from typing import Any, TypeAlias
+
+from aiogram.methods import (
+    CopyMessages,
+    ForwardMessages,
+    GetChat,
+    GetChatAdministrators,
+    GetChatMember,
+    GetChatMemberCount,
+    GetChatMenuButton,
+    GetGameHighScores,
+    GetUserChatBoosts,
+    SendMediaGroup,
+    TelegramMethod,
+)
+
+ChatIdType: TypeAlias = int | str
+MethodCost: TypeAlias = int | Callable[[TelegramMethod[Any]], int]
+
+#: Стоимость метода, у которого есть chat_id, но который не зарегистрирован явно
+DEFAULT_METHOD_COST = 1
+
+_method_costs: dict[type[TelegramMethod[Any]], MethodCost] = {
+    # Получение информации не отправляет сообщений в чат
+    GetChat: 0,
+    GetChatAdministrators: 0,
+    GetChatMember: 0,
+    GetChatMemberCount: 0,
+    GetChatMenuButton: 0,
+    GetGameHighScores: 0,
+    GetUserChatBoosts: 0,
+    # Каждое сообщение группы telegram учитывает как отдельное
+    SendMediaGroup: lambda method: len(method.media),  # pyright: ignore [reportAttributeAccessIssue]
+    ForwardMessages: lambda method: len(method.message_ids),  # pyright: ignore [reportAttributeAccessIssue]
+    CopyMessages: lambda method: len(method.message_ids),  # pyright: ignore [reportAttributeAccessIssue]
+}
+
+
+def register_method_cost(method_type: type[TelegramMethod[Any]], cost: MethodCost) -> None:
+    """
+    Устанавливает стоимость метода в токенах лимитера
+
+    Args:
+        method_type: класс метода bot api, например SendMessage
+        cost: число токенов или функция, вычисляющая его по экземпляру метода.
+            0 - метод не ограничивается.
+    """
+    if isinstance(cost, int) and cost < 0:
+        raise ValueError("cost should be greater or equal 0")
+
+    _method_costs[method_type] = cost
+
+
+def get_method_chat_id(method: TelegramMethod[Any]) -> ChatIdType | None:
+    """
+    Возвращает id чата, в который направлен метод, или None, если метод не привязан к чату
+    """
+    return getattr(method, "chat_id", None)
+
+
+def get_method_cost(method: TelegramMethod[Any]) -> int:
+    """
+    Возвращает стоимость вызова метода в токенах лимитера
+
+    Методы без chat_id, которые не зарегистрированы явно, не ограничиваются
+    """
+    cost = _method_costs.get(type(method))
+
+    if cost is None:
+        if "chat_id" not in type(method).model_fields:
+            return 0
+        return DEFAULT_METHOD_COST
+
+    if callable(cost):
+        return max(cost(method), 0)
+
+    return cost
@@ -0,0 +1,187 @@
+"""
+Метрики лимитера
+
+Показывают, сколько запросы ждут в лимитере, сколько их в очереди и в работе,
+как часто telegram отвечает ошибкой flood control и с какой скоростью реально уходят запросы.
+"""
+
+import time
+from bisect import bisect_left
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+
+#: Границы корзин гистограммы времени ожидания в секундах
+DEFAULT_WAIT_TIME_BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Период обновления оценки скорости в секундах и вес новой оценки
+_THROUGHPUT_TICK = 1
+_THROUGHPUT_SMOOTHING = 0.3
+
+
+@dataclass
+class WaitHistogram:
+    """
+    Гистограмма времени ожидания
+
+    Attributes:
+        bounds: верхние границы корзин, последняя корзина не ограничена сверху
+        counts: число наблюдений в каждой корзине, на одну больше, чем границ
+        count: общее число наблюдений
+        total: сумма всех наблюдений в секундах
+    """
+
+    bounds: Sequence[float] = DEFAULT_WAIT_TIME_BUCKETS
+    counts: list[int] = field(default_factory=list)
+    count: int = 0
+    total: float = 0
+
+    def __post_init__(self):
+        if not self.counts:
+            self.counts = [0] * (len(self.bounds) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Оценка квантиля сверху: граница корзины, в которую он попадает
+        """
+        if self.count == 0:
+            return 0
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts, strict=False):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return float("inf")
+
+    def copy(self) -> "WaitHistogram":
+        return WaitHistogram(self.bounds, self.counts.copy(), self.count, self.total)
+
+    def __sub__(self, other: "WaitHistogram") -> "WaitHistogram":
+        return WaitHistogram(
+            self.bounds,
+            [a - b for a, b in zip(self.counts, other.counts, strict=True)],
+            self.count - other.count,
+            self.total - other.total,
+        )
+
+
+@dataclass
+class LimiterMetricsSnapshot:
+    """
+    Состояние метрик лимитера на момент времени
+
+    Счётчики и гистограммы накапливаются с момента создания лимитера.
+
+    Attributes:
+        date: время снимка, time.time()
+        calls: сколько запросов прошло через лимитер
+        tokens: сколько токенов было потрачено
+        throughput: сглаженная скорость запросов в секунду
+        in_flight: сколько запросов выполняется прямо сейчас
+        queued: сколько запросов ждут в лимитере
+        global_queue_depth: сколько запросов ждут в общей очереди
+        wait_time: гистограммы ожидания для каждого вида лимитов
+        retry_after_events: сколько раз пришла ошибка flood control для каждого вида областей
+        parked_requests: сколько запросов было приостановлено после ошибки для каждого вида областей
+        parked_seconds: сколько секунд в сумме ждали приостановленные запросы для каждого вида областей
+        rates: текущие скорости, если включена подстройка скорости
+    """
+
+    date: float
+    calls: int
+    tokens: int
+    throughput: float
+    in_flight: int
+    queued: int
+    global_queue_depth: int
+    wait_time: dict[str, WaitHistogram]
+    retry_after_events: dict[str, int]
+    parked_requests: dict[str, int]
+    parked_seconds: dict[str, float]
+    rates: dict[str, float] = field(default_factory=dict)
+
+
+class LimiterMetrics:
+    """
+    Счётчики лимитера, обновляемые на пути каждого запроса
+    """
+
+    __slots__ = (
+        "_tick_calls",
+        "_tick_start",
+        "calls",
+        "in_flight",
+        "queued",
+        "throughput",
+        "tokens",
+        "wait_time",
+        "wait_time_buckets",
+    )
+
+    def __init__(self, wait_time_buckets: Sequence[float] = DEFAULT_WAIT_TIME_BUCKETS):
+        """
+        Args:
+            wait_time_buckets: границы корзин гистограмм времени ожидания в секундах
+        """
+        self.wait_time_buckets = tuple(sorted(wait_time_buckets))
+        self.wait_time: dict[str, WaitHistogram] = {}
+
+        self.calls = 0
+        self.tokens = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.throughput = 0.0
+
+        self._tick_start = time.monotonic()
+        self._tick_calls = 0
+
+    def observe_wait(self, kind: str, seconds: float) -> None:
+        """
+        Учитывает время ожидания в лимитере вида kind
+        """
+        histogram = self.wait_time.get(kind)
+        if histogram is None:
+            histogram = self.wait_time[kind] = WaitHistogram(self.wait_time_buckets)
+
+        histogram.observe(seconds)
+
+    def _tick(self, now: float) -> None:
+        elapsed = now - self._tick_start
+        if elapsed < _THROUGHPUT_TICK:
+            return
+
+        instant = self._tick_calls / elapsed
+        self.throughput += _THROUGHPUT_SMOOTHING * (instant - self.throughput)
+        self._tick_start = now
+        self._tick_calls = 0
+
+    def record_call(self, cost: int) -> None:
+        """
+        Учитывает выполненный запрос
+        """
+        self.calls += 1
+        self.tokens += cost
+        self._tick_calls += 1
+        self._tick(time.monotonic())
+
+    def snapshot(self) -> tuple[int, int, float, int, int, dict[str, WaitHistogram]]:
+        """
+        Возвращает копию счётчиков: calls, tokens, throughput, in_flight, queued, wait_time
+        """
+        self._tick(time.monotonic())
+
+        return (
+            self.calls,
+            self.tokens,
+            self.throughput,
+            self.in_flight,
+            self.queued,
+            {kind: histogram.copy() for kind, histogram in self.wait_time.items()},
+        )
@@ -0,0 +1,86 @@
+"""
+Ограничение скорости и числа одновременных вызовов
+
+Один объект политики можно разделить между несколькими функциями и LimitCaller,
+чтобы они вместе не превышали ограничения внешнего api.
+"""
+
+import asyncio
+from collections.abc import AsyncIterator, Hashable
+from contextlib import asynccontextmanager
+
+from .base import AnyLimiter, acquire_tokens
+from .gcra import GCRALimiter, GCRAStore
+
+
+class RatePolicy:
+    """
+    Ограничения скорости и параллельности вызовов
+
+    policy = RatePolicy(rate=10, key_rate=1, max_concurrency=5)
+
+    async with policy.limit(key=user_id):
+        await call_external_api(user_id)
+    """
+
+    __slots__ = ("in_flight", "key_limiter", "limiter", "max_concurrency", "semaphore")
+
+    def __init__(  # noqa: PLR0913
+        self,
+        rate: float | None = None,
+        burst: int = 1,
+        key_rate: float | None = None,
+        key_burst: int = 1,
+        max_concurrency: int | None = None,
+        limiter: AnyLimiter | None = None,
+    ):
+        """
+        Args:
+            rate: максимальное число вызовов в секунду в сумме, None - без ограничения
+            burst: сколько вызовов можно сделать разом в сумме
+            key_rate: максимальное число вызовов в секунду для каждого ключа, None - без ограничения
+            key_burst: сколько вызовов можно сделать разом для каждого ключа
+            max_concurrency: максимальное число одновременно выполняемых вызовов, None - без ограничения
+            limiter: готовый лимитер общей скорости, например RedisLimiter. Заменяет rate и burst.
+        """
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency should be greater or equal 1")
+
+        if limiter is None and rate is not None:
+            limiter = GCRALimiter(rate, burst)
+
+        self.limiter = limiter
+        self.key_limiter = GCRAStore(key_rate, key_burst) if key_rate is not None else None
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency is not None else None
+        #: Число выполняемых сейчас вызовов
+        self.in_flight = 0
+
+    @asynccontextmanager
+    async def limit(self, key: Hashable = None, cost: int = 1) -> AsyncIterator[None]:
+        """
+        Ждёт, пока вызов будет разрешён, и занимает место среди одновременных вызовов до выхода из контекста
+
+        Args:
+            key: ключ, для которого действует лимит key_rate. None - лимит по ключу не применяется
+            cost: число токенов, которое тратит вызов
+        """
+        # Лимит ключа ждём без занятого места, чтобы один перегруженный ключ не блокировал остальные
+        if self.key_limiter is not None and key is not None:
+            await self.key_limiter.acquire(key, cost)
+
+        if self.semaphore is not None:
+            await self.semaphore.acquire()
+        try:
+            # Общую скорость берём последней, непосредственно перед вызовом
+            if self.limiter is not None:
+                await acquire_tokens(self.limiter, cost)
+
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            if self.semaphore is not None:
+                self.semaphore.release()
@@ -0,0 +1,141 @@
+"""
+Приоритеты запросов к bot api
+
+Общий лимит запросов распределяется между классами приоритета взвешенной справедливой очередью,
+поэтому во время рассылки ответы пользователям не ждут, пока отправятся тысячи сообщений рассылки.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import logging
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from enum import IntEnum
+
+from .base import AnyLimiter, acquire_tokens
+
+logger = logging.getLogger("limiter")
+
+
+class Priority(IntEnum):
+    """
+    Класс приоритета запроса
+
+    Attributes:
+        INTERACTIVE: ответы, которых пользователь ждёт прямо сейчас
+        NORMAL: обычные запросы
+        BULK: массовые запросы, например рассылки
+    """
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+
+
+#: Доля общего лимита, которую получает каждый класс, когда очередь заполнена запросами всех классов
+DEFAULT_PRIORITY_WEIGHTS: Mapping[Priority, float] = {
+    Priority.INTERACTIVE: 8,
+    Priority.NORMAL: 4,
+    Priority.BULK: 1,
+}
+
+#: Приоритет запросов к bot api в текущем контексте
+LIMITER_PRIORITY: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "LIMITER_PRIORITY",
+    default=Priority.NORMAL,
+)
+
+
+@contextmanager
+def limiter_priority(priority: Priority) -> Iterator[None]:
+    """
+    Устанавливает приоритет всех запросов к bot api внутри контекста
+
+    with limiter_priority(Priority.BULK):
+        await bot.send_message(chat_id, text)
+    """
+    token = LIMITER_PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        LIMITER_PRIORITY.reset(token)
+
+
+class WeightedFairQueue:
+    """
+    Выдаёт токены лимитера в порядке взвешенной справедливой очереди
+
+    Каждому запросу назначается виртуальное время окончания: чем больше вес класса,
+    тем медленнее оно растёт, и тем раньше обслуживаются запросы этого класса.
+    Запросы низкого приоритета не голодают, а получают свою долю лимита.
+    """
+
+    __slots__ = (
+        "_finish_tags",
+        "_heap",
+        "_pump_task",
+        "_sequence",
+        "_virtual_time",
+        "limiter",
+        "weights",
+    )
+
+    def __init__(self, limiter: AnyLimiter, weights: Mapping[Priority, float] | None = None):
+        """
+        Args:
+            limiter: лимитер, токены которого распределяются
+            weights: веса классов приоритета
+        """
+        self.limiter = limiter
+        self.weights = dict(DEFAULT_PRIORITY_WEIGHTS if weights is None else weights)
+        if any(weight <= 0 for weight in self.weights.values()):
+            raise ValueError("weights should be greater than 0")
+
+        self._heap: list[tuple[float, int, int, asyncio.Future[None]]] = []
+        self._finish_tags: dict[Priority, float] = {}
+        self._virtual_time = 0.0
+        self._sequence = 0
+        self._pump_task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    async def acquire(self, tokens: int, priority: Priority) -> None:
+        """
+        Ждёт своей очереди и забирает токены из лимитера
+        """
+        start = max(self._virtual_time, self._finish_tags.get(priority, 0))
+        finish = start + tokens / self.weights.get(priority, 1)
+        self._finish_tags[priority] = finish
+
+        future = asyncio.get_running_loop().create_future()
+        # sequence сохраняет порядок поступления запросов с одинаковым временем окончания
+        self._sequence += 1
+        heapq.heappush(self._heap, (finish, self._sequence, tokens, future))
+
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump())
+
+        await future
+
+    async def _pump(self) -> None:
+        try:
+            while self._heap:
+                finish, _, tokens, future = heapq.heappop(self._heap)
+                # Запрос отменён, пока ждал в очереди
+                if future.done():
+                    continue
+
+                self._virtual_time = finish
+                try:
+                    await acquire_tokens(self.limiter, tokens)
+                except Exception as exc:  # noqa: BLE001
+                    if not future.done():
+                        future.set_exception(exc)
+                    continue
+
+                if not future.done():
+                    future.set_result(None)
+        finally:
+            self._pump_task = None
@@ -0,0 +1,201 @@
+"""
+Общий для нескольких процессов лимитер на основе redis
+
+Реализует GCRA (generic cell rate algorithm) атомарным lua скриптом.
+При burst > 1 токены можно забирать пачками и расходовать локально, чтобы не ходить в redis на каждый запрос.
+Если redis недоступен, используется локальный лимитер.
+
+Требует установки djgram[redis]
+"""
+
+import asyncio
+import logging
+import time
+
+from limiter import Limiter
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from .base import AnyLimiter, acquire_tokens
+from .gcra import GCRALimiter
+
+logger = logging.getLogger("limiter")
+
+# KEYS[1] - ключ с теоретическим временем прибытия (TAT) в миллисекундах
+# ARGV[1] - интервал между запросами в миллисекундах
+# ARGV[2] - допуск на всплеск в миллисекундах (интервал * ёмкость)
+# ARGV[3] - сколько токенов хочется получить
+# Возвращает {сколько токенов выдано, сколько ждать следующего токена в микросекундах}
+GCRA_LUA_SCRIPT = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if tat == nil or tat < now then
+    tat = now
+end
+
+local allowed = math.floor((now + tolerance - tat) / interval)
+if allowed <= 0 then
+    return {0, math.ceil((tat + interval - tolerance - now) * 1000)}
+end
+if allowed > requested then
+    allowed = requested
+end
+
+tat = tat + allowed * interval
+redis.call('SET', KEYS[1], string.format('%.3f', tat), 'PX', math.ceil(tat - now) + 1000)
+
+return {allowed, 0}
+"""
+
+
+class RedisLimiter:
+    """
+    Лимитер с общим для всех процессов бюджетом запросов
+
+    Можно передать в LimitCaller в качестве main_limiter, чтобы общий лимит
+    в 30 сообщений в секунду соблюдался суммарно для всех процессов бота
+    """
+
+    __slots__ = (
+        "_fallback_until",
+        "_local_expire_at",
+        "_local_tokens",
+        "_lock",
+        "_rate",
+        "_script",
+        "burst",
+        "fallback",
+        "fallback_retry_period",
+        "key",
+        "prefetch",
+    )
+
+    def __init__(  # noqa: PLR0913
+        self,
+        redis: Redis,
+        rate: float,
+        burst: int = 1,
+        key: str = "djgram:limiter:global",
+        prefetch: int = 1,
+        fallback: AnyLimiter | None = None,
+        fallback_retry_period: float = 5,
+    ):
+        """
+        Args:
+            redis: клиент redis
+            rate: максимальное число запросов в секунду для всех процессов в сумме
+            burst: ёмкость корзины, сколько запросов можно сделать разом
+            key: ключ в redis, по которому хранится состояние лимитера
+            prefetch: сколько токенов забирать из redis за один запрос, не больше burst.
+                Экономит запросы к redis только при burst > 1, по умолчанию каждый токен запрашивается отдельно.
+            fallback: локальный лимитер на случай недоступности redis.
+                По умолчанию используется лимитер с такими же параметрами.
+                Изменения rate передаются и ему.
+            fallback_retry_period: через сколько секунд после ошибки снова пытаться обратиться к redis
+        """
+        if burst < 1:
+            raise ValueError("burst should be greater or equal 1")
+        if prefetch < 1:
+            raise ValueError("prefetch should be greater or equal 1")
+
+        self.burst = burst
+        self.key = key
+        self.prefetch = min(prefetch, burst)
+        self.fallback = fallback if fallback is not None else GCRALimiter(rate, burst)
+        self.rate = rate
+        self.fallback_retry_period = fallback_retry_period
+
+        self._script = redis.register_script(GCRA_LUA_SCRIPT)
+        self._lock = asyncio.Lock()
+        self._local_tokens = 0
+        self._local_expire_at = 0.0
+        self._fallback_until = 0.0
+
+    @property
+    def rate(self) -> float:
+        """
+        Максимальное число запросов в секунду для всех процессов в сумме
+        """
+        return self._rate
+
+    @rate.setter
+    def rate(self, value: float) -> None:
+        if value <= 0:
+            raise ValueError("rate should be greater than 0")
+
+        self._rate = value
+        # Без redis процесс должен соблюдать ту же скорость, например изученную AdaptiveRateControl
+        if isinstance(self.fallback, Limiter):
+            self.fallback = self.fallback.new(rate=value)
+        elif hasattr(self.fallback, "rate"):
+            self.fallback.rate = value  # pyright: ignore [reportAttributeAccessIssue]
+
+    async def _fetch(self, tokens: int) -> tuple[int, float]:
+        """
+        Забирает токены из redis
+
+        Returns:
+            Число полученных токенов и время ожидания в секундах, если ничего не получено
+        """
+        interval = 1000 / self.rate
+        allowed, wait = await self._script(
+            keys=[self.key],
+            args=[interval, interval * self.burst, tokens],
+        )
+
+        return int(allowed), int(wait) / 1_000_000
+
+    async def acquire(self, tokens: int = 1) -> None:
+        """
+        Ждёт, пока не будет получено заданное число токенов
+        """
+        async with self._lock:
+            while tokens > 0:
+                now = time.monotonic()
+
+                if self._local_tokens > 0 and now < self._local_expire_at:
+                    taken = min(tokens, self._local_tokens)
+                    self._local_tokens -= taken
+                    tokens -= taken
+                    continue
+
+                if now < self._fallback_until:
+                    await acquire_tokens(self.fallback, tokens)
+                    return
+
+                try:
+                    granted, wait = await self._fetch(min(max(tokens, self.prefetch), self.burst))
+                except (RedisError, OSError) as exc:
+                    logger.warning(
+                        "Redis limiter is unavailable, using local limiter for %s sec: %s",
+                        self.fallback_retry_period,
+                        exc,
+                    )
+                    self._fallback_until = time.monotonic() + self.fallback_retry_period
+                    continue
+
+                if granted == 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                # Неиспользованные вовремя токены сгорают, иначе они могли бы создать всплеск,
+                # превышающий ёмкость корзины
+                self._local_tokens = granted
+                self._local_expire_at = time.monotonic() + self.burst / self.rate
+
+    async def __aenter__(self) -> "RedisLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
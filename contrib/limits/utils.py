@@ -1,10 +1,10 @@
-import asyncio
 import logging
-from collections.abc import Awaitable, Callable
+from collections.abc import Awaitable, Callable, Hashable
 from functools import wraps
 from typing import ParamSpec, Protocol, TypeVar
 
-from limiter import Limiter
+from .backoff import GLOBAL_SCOPE, KEY_SCOPE_KIND, RetryAfterBackoff
+from .policy import RatePolicy
 
 T = TypeVar("T")
 P = ParamSpec("P")
@@ -16,13 +16,30 @@ class HasRetryAfterError(Protocol):  # noqa: D101
     retry_after: float | None
 
 
+def _make_policy(
+    max_rate: float | None,
+    burst: int,
+    max_concurrency: int | None,
+    *,
+    per_key: bool,
+) -> RatePolicy:
+    if per_key:
+        return RatePolicy(key_rate=max_rate, key_burst=burst, max_concurrency=max_concurrency)
+
+    return RatePolicy(rate=max_rate, burst=burst, max_concurrency=max_concurrency)
+
+
 def limit_retry_call(  # noqa: ANN201, PLR0913
     retry_exception_class: type[HasRetryAfterError],
-    max_rate: float,
+    max_rate: float | None = None,
     burst: int = 1,
     max_retries: int = 0,
     sleep_gap: float = 0.1,
     default_retry_after_time: float = 5,
+    backoff_key: Callable[..., Hashable] | None = None,
+    key: Callable[..., Hashable] | None = None,
+    max_concurrency: int | None = None,
+    policy: RatePolicy | None = None,
 ):
     """
     A decorator to control the rate of an async function and handle rate-limiting exceptions.
@@ -30,11 +47,10 @@ def limit_retry_call(  # noqa: ANN201, PLR0913
     :param retry_exception_class: Exception class with a `retry_after` attribute (in seconds) indicating
                                   how long to wait before retrying. Should adhere to the `HasRetryAfter` protocol.
 
-    :param max_rate: The maximum number of requests per second.
-                     Corresponds to the token replenishment rate in the Limiter.
+    :param max_rate: The maximum number of requests per second, for each key if `key` is set.
+                     None - no rate limit.
 
     :param burst: The capacity of the token bucket, allowing for brief bursts of requests.
-                  Corresponds to the `capacity` in the Limiter.
 
     :param max_retries: The maximum number of retries if the function hits a rate limit. Raises the exception
                         after this number is exceeded.
@@ -43,23 +59,44 @@ def limit_retry_call(  # noqa: ANN201, PLR0913
 
     :param default_retry_after_time: default sleep time in seconds if exc.retry_after is None
 
+    :param backoff_key: Function of the call arguments returning a key of the waiting scope. After a rate limit
+                        exception only calls with the same key wait. If None, `key` is used, if it is None too,
+                        all calls wait.
+
+    :param key: Function of the call arguments returning a key, `max_rate` is applied to each key separately.
+
+    :param max_concurrency: The maximum number of calls running at the same time. None - no limit.
+
+    :param policy: Rate and concurrency policy, that can be shared between several functions.
+                   If set, `max_rate`, `burst` and `max_concurrency` are ignored.
+
     :return: The decorated async function that will be rate-limited and handle retries.
     """
 
-    def wrapper(func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
-        _limiter = Limiter(max_rate, burst)
+    if backoff_key is None:
+        backoff_key = key
 
-        _retry_after_event = asyncio.Event()
-        _retry_after_event.set()
+    def wrapper(func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+        _policy = policy or _make_policy(max_rate, burst, max_concurrency, per_key=key is not None)
+        _backoff = RetryAfterBackoff(sleep_gap=sleep_gap, global_escalation_threshold=0)
 
         @wraps(func)
         async def inner(*args: P.args, **kwargs: P.kwargs) -> T:  # pyright: ignore [reportReturnType]
+            scope = (KEY_SCOPE_KIND, backoff_key(*args, **kwargs)) if backoff_key is not None else GLOBAL_SCOPE
+            limit_key = key(*args, **kwargs) if key is not None else None
+
             for attempt in range(max_retries + 1):  # noqa: RET503
                 try:
-                    await _retry_after_event.wait()
-                    async with _limiter:
+                    await _backoff.wait(scope)
+                    async with _policy.limit(limit_key):
                         return await func(*args, **kwargs)
                 except retry_exception_class as exc:  # pyright: ignore [reportGeneralTypeIssues]
+                    # Make sure we don't allow other requests in this scope to be processed
+                    if exc.retry_after is not None:
+                        _backoff.park(scope, exc.retry_after)
+                    else:
+                        _backoff.park(scope, default_retry_after_time - sleep_gap)
+
                     if attempt == max_retries:
                         logger.exception(
                             "Rate limit hit after maximum of %d retries",
@@ -69,15 +106,9 @@ def limit_retry_call(  # noqa: ANN201, PLR0913
                         raise
 
                     logger.info(exc)
-                    # Make sure we don't allow other requests to be processed
-                    _retry_after_event.clear()
-                    await asyncio.sleep(
-                        exc.retry_after + sleep_gap if exc.retry_after is not None else default_retry_after_time,
-                    )
-
-                finally:
-                    # Allow other requests to be processed
-                    _retry_after_event.set()
+
+        inner.backoff = _backoff  # pyright: ignore [reportFunctionMemberAccess]
+        inner.policy = _policy  # pyright: ignore [reportFunctionMemberAccess]
 
         return inner
 
@@ -0,0 +1,141 @@
+"""
+Кеш последних сохранённых в базу пользователей, чатов и полной информации о чатах telegram
+
+Для каждой пары (модель, id) хранятся значения полей telegram, записанные в базу последними,
+и все колонки строки. Если пришедший из telegram объект совпадает с ними, запрос к базе не нужен:
+объект модели восстанавливается из кеша и присоединяется к сессии через merge(load=False) без обращения к базе.
+
+Значения колонок общие для всех объектов, восстановленных из одной записи,
+поэтому изменяемые pydantic поля нельзя менять на месте, вместо этого нужно присваивать новое значение.
+
+Записи устаревают через TELEGRAM_OBJECT_CACHE_TTL секунд, после этого объект снова сверяется с базой.
+Это ограничивает время, в течение которого не видны изменения, сделанные другими процессами.
+Изменения через ORM в этом процессе сбрасывают запись автоматически,
+а после массовых UPDATE или изменений из других мест нужно вызвать invalidate_telegram_object.
+"""
+
+import logging
+from typing import Any, TypeVar
+
+from cachetools import TTLCache
+from djgram.configs import TELEGRAM_OBJECT_CACHE_SIZE, TELEGRAM_OBJECT_CACHE_TTL
+from djgram.contrib.telegram.models import TelegramChat, TelegramChatFullInfo, TelegramUser
+from djgram.db.models import BaseModel
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapper, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+T = TypeVar("T", bound=BaseModel)
+
+logger = logging.getLogger(__name__)
+
+
+class _CachedObject:
+    __slots__ = ("fingerprint", "values")
+
+    def __init__(self, fingerprint: tuple[Any, ...], values: dict[str, Any]):
+        self.fingerprint = fingerprint
+        self.values = values
+
+
+class PersistedObjectCache:
+    """
+    LRU кеш значений объектов, последними сохранённых в базу
+    """
+
+    def __init__(self, maxsize: int = TELEGRAM_OBJECT_CACHE_SIZE, ttl: float = TELEGRAM_OBJECT_CACHE_TTL):
+        """
+        Args:
+            maxsize: сколько объектов хранить, 0 - кеш выключен
+            ttl: через сколько секунд объект снова сверяется с базой
+        """
+        self._entries: TTLCache[tuple[type[BaseModel], Any], _CachedObject] | None = (
+            TTLCache(maxsize, ttl) if maxsize > 0 else None
+        )
+        #: Сколько раз объект взят из кеша
+        self.hits = 0
+        #: Сколько раз объекта не было в кеше или он изменился
+        self.misses = 0
+
+    async def get(
+        self,
+        session: AsyncSession,
+        model: type[T],
+        object_id: Any,
+        fingerprint: tuple[Any, ...],
+    ) -> T | None:
+        """
+        Возвращает объект, присоединённый к сессии, если в базе сохранены те же значения, иначе None
+
+        Args:
+            session: сессия, к которой нужно присоединить объект
+            model: модель
+            object_id: первичный ключ
+            fingerprint: значения полей, пришедшие из telegram
+        """
+        if self._entries is None:
+            return None
+
+        entry = self._entries.get((model, object_id))
+        if entry is None or entry.fingerprint != fingerprint:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        # Значения записываются без событий ORM, как при загрузке из базы,
+        # иначе pydantic поля пытаются преобразовать None
+        instance = inspect(model).class_manager.new_instance()
+        for key, value in entry.values.items():
+            set_committed_value(instance, key, value)
+        # Объект считается загруженным из базы, поэтому merge не делает SELECT
+        make_transient_to_detached(instance)
+        return await session.merge(instance, load=False)
+
+    def put(self, instance: BaseModel, fingerprint: tuple[Any, ...]) -> None:
+        """
+        Запоминает объект, сохранённый в базу
+
+        Вызывать нужно только после коммита, иначе в кеш попадут несохранённые значения.
+        Запись с теми же значениями не обновляется, чтобы объект всё равно сверялся с базой раз в ttl секунд.
+        """
+        if self._entries is None:
+            return
+
+        model = type(instance)
+        entry = self._entries.get((model, instance.id))
+        if entry is not None and entry.fingerprint == fingerprint:
+            return
+
+        values = {prop.key: getattr(instance, prop.key) for prop in inspect(model).column_attrs}
+        self._entries[(model, instance.id)] = _CachedObject(fingerprint, values)
+
+    def invalidate(self, model: type[BaseModel], object_id: Any) -> None:
+        """
+        Удаляет объект из кеша, следующее обращение сверит его с базой
+        """
+        if self._entries is not None:
+            self._entries.pop((model, object_id), None)
+
+    def clear(self) -> None:
+        if self._entries is not None:
+            self._entries.clear()
+
+
+telegram_object_cache = PersistedObjectCache()
+
+
+def invalidate_telegram_object(model: type[BaseModel], object_id: Any) -> None:
+    """
+    Сбрасывает закешированного пользователя или чат после изменений в обход ORM, например массовым UPDATE
+    """
+    telegram_object_cache.invalidate(model, object_id)
+
+
+def _invalidate_on_flush(mapper: Mapper, connection: Any, target: BaseModel) -> None:
+    telegram_object_cache.invalidate(type(target), target.id)
+
+
+for _model in (TelegramUser, TelegramChat, TelegramChatFullInfo):
+    event.listen(_model, "after_update", _invalidate_on_flush)
+    event.listen(_model, "after_delete", _invalidate_on_flush)
@@ -0,0 +1,425 @@
+"""
+Фоновое обновление полной информации о чатах
+
+Запрос getChat занимает сотни миллисекунд, поэтому TelegramMiddleware не ждёт его,
+а передаёт обработчику сохранённую в базе информацию и ставит чат в очередь на обновление.
+Сохранённая информация берётся из telegram_object_cache, поэтому база читается не на каждое событие.
+Одновременные запросы одного чата объединяются, getChat выполняется с ограничением
+параллельности и низким приоритетом в лимитере, а результаты сохраняются в базу пакетами.
+
+Чаты, от которых давно не было событий, обновляет периодическая задача StaleChatFullInfoRefresher,
+поэтому на обработку событий приходится лишь малая часть запросов getChat.
+"""
+
+import asyncio
+import logging
+from collections.abc import Coroutine
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import ChatFullInfo
+from djgram.configs import (
+    TELEGRAM_CHAT_FULL_INFO_REFRESH_CONCURRENCY,
+    TELEGRAM_CHAT_FULL_INFO_SAVE_BATCH_SIZE,
+    TELEGRAM_CHAT_FULL_INFO_SAVE_INTERVAL,
+    TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_BATCH_SIZE,
+    TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_INTERVAL,
+    TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_RATE,
+    TELEGRAM_CHAT_FULL_INFO_UPDATE_PERIOD,
+)
+from djgram.contrib.limits.gcra import GCRALimiter
+from djgram.contrib.limits.priority import Priority, limiter_priority
+from djgram.contrib.telegram.cache import telegram_object_cache
+from djgram.contrib.telegram.models import TelegramChatFullInfo
+from djgram.db.base import get_autocommit_session
+from djgram.db.models import BaseModel, CreatedAtMixin, UpdatedAtMixin
+from djgram.db.utils import ReturnState, get_fields_of_declarative_meta, upsert_many
+from djgram.utils.async_tools import PeriodicTask
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+#: Поля полной информации о чате, которые берутся из ответа getChat, кроме id
+CHAT_FULL_INFO_FIELDS: tuple[str, ...] = tuple(
+    sorted(
+        set(TelegramChatFullInfo.__table__.columns.keys())
+        - get_fields_of_declarative_meta(BaseModel)
+        - get_fields_of_declarative_meta(CreatedAtMixin)
+        - get_fields_of_declarative_meta(UpdatedAtMixin),
+    ),
+)
+
+
+def get_chat_full_info_row(chat_full_info: ChatFullInfo) -> dict[str, Any]:
+    """
+    Возвращает значения полей TelegramChatFullInfo из ответа getChat
+    """
+    row = {"id": chat_full_info.id} | {field: getattr(chat_full_info, field) for field in CHAT_FULL_INFO_FIELDS}
+    # Явно приписываем время обновления, чтобы гарантированно сохранить
+    # в базе данных время последнего запроса данных из bot api
+    row["updated_at"] = datetime.now(tz=UTC)
+    return row
+
+
+# Полная информация о чате не приходит в событиях, поэтому сверять закешированную с telegram не с чем,
+# а устаревание определяется по updated_at
+_CACHE_FINGERPRINT: tuple[Any, ...] = ()
+
+
+async def load_chat_full_info(db_session: AsyncSession, chat_id: int) -> TelegramChatFullInfo | None:
+    """
+    Возвращает сохранённую полную информацию о чате, присоединённую к сессии
+
+    Информация берётся из кеша, а при его промахе из базы
+    """
+    instance = await telegram_object_cache.get(db_session, TelegramChatFullInfo, chat_id, _CACHE_FINGERPRINT)
+    if instance is not None:
+        return instance
+
+    instance = await db_session.scalar(select(TelegramChatFullInfo).where(TelegramChatFullInfo.id == chat_id))
+    if instance is not None:
+        telegram_object_cache.put(instance, _CACHE_FINGERPRINT)
+
+    return instance
+
+
+def remember_chat_full_info(instance: TelegramChatFullInfo) -> None:
+    """
+    Запоминает только что сохранённую в базу информацию вместо закешированной
+    """
+    telegram_object_cache.invalidate(TelegramChatFullInfo, instance.id)
+    telegram_object_cache.put(instance, _CACHE_FINGERPRINT)
+
+
+class _PendingRefresh:
+    __slots__ = ("future", "urgent")
+
+    def __init__(self, *, urgent: bool):
+        self.urgent = urgent
+        self.future: asyncio.Future[TelegramChatFullInfo | None] = asyncio.get_running_loop().create_future()
+
+
+class ChatFullInfoRefresher:
+    """
+    Очередь обновления полной информации о чатах
+    """
+
+    def __init__(
+        self,
+        concurrency: int = TELEGRAM_CHAT_FULL_INFO_REFRESH_CONCURRENCY,
+        batch_size: int = TELEGRAM_CHAT_FULL_INFO_SAVE_BATCH_SIZE,
+        save_interval: float = TELEGRAM_CHAT_FULL_INFO_SAVE_INTERVAL,
+    ):
+        """
+        Args:
+            concurrency: сколько запросов getChat выполнять одновременно
+            batch_size: сколько записей сохранять в базу за раз
+            save_interval: сколько секунд полученная запись может ждать сохранения
+        """
+        self.batch_size = batch_size
+        self.save_interval = save_interval
+
+        #: Сколько раз запрашивалось обновление
+        self.requested = 0
+        #: Сколько запросов объединено с уже выполняющимися
+        self.deduplicated = 0
+        #: Сколько обновлений завершилось ошибкой
+        self.failed = 0
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: dict[int, _PendingRefresh] = {}
+        self._buffer: list[tuple[int, dict[str, Any], _PendingRefresh]] = []
+        self._tasks = set[asyncio.Task]()
+        self._save_handle: asyncio.TimerHandle | None = None
+
+    def _start(self, coro: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def request(
+        self,
+        bot: Bot,
+        chat_id: int,
+        *,
+        urgent: bool = False,
+    ) -> asyncio.Future[TelegramChatFullInfo | None]:
+        """
+        Ставит чат в очередь на обновление, если он ещё не в очереди
+
+        Args:
+            bot: бот, через которого запрашивается информация
+            chat_id: идентификатор чата
+            urgent: результат кто-то ждёт, поэтому запрос выполняется с обычным приоритетом
+                и сохраняется в базу без ожидания пакета
+
+        Returns:
+            Future с сохранённой в базе информацией или None, если получить или сохранить её не удалось.
+            Объект не привязан к сессии.
+        """
+        self.requested += 1
+
+        pending = self._pending.get(chat_id)
+        if pending is not None:
+            self.deduplicated += 1
+            if urgent and not pending.urgent:
+                pending.urgent = True
+                # Информация уже получена и ждёт сохранения вместе с пакетом
+                if any(buffered is pending for _, _, buffered in self._buffer):
+                    self._start(self.save())
+            return pending.future
+
+        pending = self._pending[chat_id] = _PendingRefresh(urgent=urgent)
+        self._start(self._fetch(bot, chat_id, pending))
+        return pending.future
+
+    def is_pending(self, chat_id: int) -> bool:
+        """
+        Запрошено ли уже обновление чата
+        """
+        return chat_id in self._pending
+
+    async def refresh(self, bot: Bot, chat_id: int) -> TelegramChatFullInfo | None:
+        """
+        Обновляет полную информацию о чате и ждёт сохранения в базу
+        """
+        # Отмена ожидающего не должна отменять обновление для остальных
+        return await asyncio.shield(self.request(bot, chat_id, urgent=True))
+
+    async def _fetch(self, bot: Bot, chat_id: int, pending: _PendingRefresh) -> None:
+        logger.info("Updating chat full info %s", chat_id)
+
+        try:
+            async with self._semaphore:
+                with limiter_priority(Priority.NORMAL if pending.urgent else Priority.BULK):
+                    chat_full_info = await bot.get_chat(chat_id)
+        except Exception as exc:
+            logger.exception("Failed to get chat full info %s: %s", chat_id, exc, exc_info=exc)  # noqa: TRY401
+            self.failed += 1
+            self._finish(chat_id, pending, None)
+            return
+
+        self._buffer.append((chat_id, get_chat_full_info_row(chat_full_info), pending))
+
+        if pending.urgent or len(self._buffer) >= self.batch_size:
+            await self.save()
+        elif self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(
+                self.save_interval,
+                lambda: self._start(self.save()),
+            )
+
+    def _finish(self, chat_id: int, pending: _PendingRefresh, instance: TelegramChatFullInfo | None) -> None:
+        if self._pending.get(chat_id) is pending:
+            del self._pending[chat_id]
+
+        if not pending.future.done():
+            pending.future.set_result(instance)
+
+    async def save(self) -> None:
+        """
+        Сохраняет полученную информацию одним запросом
+        """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+
+        buffer, self._buffer = self._buffer, []
+        if not buffer:
+            return
+
+        try:
+            async with get_autocommit_session() as db_session:
+                results = await upsert_many(db_session, TelegramChatFullInfo, [row for _, row, _ in buffer], ["id"])
+        except Exception as exc:
+            logger.exception("Failed to save %d chat full infos: %s", len(buffer), exc, exc_info=exc)  # noqa: TRY401
+            self.failed += len(buffer)
+            for chat_id, _, pending in buffer:
+                self._finish(chat_id, pending, None)
+            return
+
+        for (chat_id, _, pending), (instance, return_state) in zip(buffer, results, strict=True):
+            if return_state == ReturnState.CREATED:
+                logger.info("New %s", instance.str_for_logging())
+            elif return_state == ReturnState.UPDATED:
+                logger.info("Updated %s", instance.str_for_logging())
+            remember_chat_full_info(instance)
+            self._finish(chat_id, pending, instance)
+
+    async def close(self) -> None:
+        """
+        Дожидается выполняющихся обновлений и сохраняет их
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        await self.save()
+
+
+chat_full_info_refresher = ChatFullInfoRefresher()
+
+
+async def refresh_chat_full_info(bot: Bot, chat_id: int) -> TelegramChatFullInfo | None:
+    """
+    Запрашивает свежую полную информацию о чате, для обработчиков, которым недостаточно сохранённой
+
+    Returns:
+        Сохранённая информация, не привязанная к сессии, или None, если получить её не удалось
+    """
+    return await chat_full_info_refresher.refresh(bot, chat_id)
+
+
+async def close_chat_full_info_refresher() -> None:
+    await chat_full_info_refresher.close()
+
+
+class StaleChatFullInfoRefresher:
+    """
+    Периодически обновляет полную информацию о чатах, которая старше TELEGRAM_CHAT_FULL_INFO_UPDATE_PERIOD
+
+    Устаревшие чаты выбираются пачками по возрастанию id (keyset пагинация по первичному ключу),
+    запросы getChat выполняются с приоритетом BULK и не чаще отдельного лимита,
+    а результаты каждой пачки записываются одним пакетным UPDATE.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        period: timedelta = TELEGRAM_CHAT_FULL_INFO_UPDATE_PERIOD,
+        rate: float = TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_RATE,
+        batch_size: int = TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_BATCH_SIZE,
+        refresher: ChatFullInfoRefresher = chat_full_info_refresher,
+    ):
+        """
+        Args:
+            bot: бот, через которого запрашивается информация
+            period: через сколько информация считается устаревшей
+            rate: сколько запросов getChat в секунду можно делать
+            batch_size: сколько чатов выбирать и сохранять за раз
+            refresher: очередь обновлений по событиям, уже стоящие в ней чаты пропускаются
+        """
+        self.bot = bot
+        self.period = period
+        self.batch_size = batch_size
+        self.refresher = refresher
+        self.limiter = GCRALimiter(rate)
+
+        #: Сколько чатов обновлено за всё время
+        self.refreshed = 0
+        #: Сколько чатов не удалось обновить
+        self.failed = 0
+
+    async def _fetch(self, chat_id: int) -> dict[str, Any] | None:
+        """
+        Возвращает новые значения полей чата
+
+        Если бот больше не может получить чат, например его удалили из группы, обновляется только время,
+        чтобы чат не запрашивался при каждом проходе
+        """
+        await self.limiter.acquire()
+        try:
+            with limiter_priority(Priority.BULK):
+                chat_full_info = await self.bot.get_chat(chat_id)
+        except (TelegramForbiddenError, TelegramBadRequest) as exc:
+            logger.info("Chat full info %s is not available: %s", chat_id, exc.message)
+            self.failed += 1
+            return {"id": chat_id, "updated_at": datetime.now(tz=UTC)}
+        except Exception as exc:
+            logger.exception("Failed to get chat full info %s: %s", chat_id, exc, exc_info=exc)  # noqa: TRY401
+            self.failed += 1
+            return None
+
+        self.refreshed += 1
+        return get_chat_full_info_row(chat_full_info)
+
+    async def refresh_batch(self, after_id: int | None, stale_before: datetime) -> int | None:
+        """
+        Обновляет следующую пачку устаревших чатов
+
+        Args:
+            after_id: id последнего чата предыдущей пачки
+            stale_before: чаты, обновлённые раньше этого времени, считаются устаревшими
+
+        Returns:
+            id последнего чата пачки или None, если устаревших чатов больше нет
+        """
+        stmt = (
+            select(TelegramChatFullInfo.id)
+            .where(TelegramChatFullInfo.updated_at < stale_before)
+            .order_by(TelegramChatFullInfo.id)
+            .limit(self.batch_size)
+        )
+        if after_id is not None:
+            stmt = stmt.where(TelegramChatFullInfo.id > after_id)
+
+        async with get_autocommit_session() as db_session:
+            chat_ids = list(await db_session.scalars(stmt))
+        if not chat_ids:
+            return None
+
+        rows = await asyncio.gather(
+            *(self._fetch(chat_id) for chat_id in chat_ids if not self.refresher.is_pending(chat_id)),
+        )
+        # Пакетный UPDATE по первичному ключу объединяет подряд идущие строки с одинаковым набором полей,
+        # поэтому недоступные чаты, у которых обновляется только время, идут отдельно
+        rows = sorted((row for row in rows if row is not None), key=len)
+        if rows:
+            async with get_autocommit_session() as db_session:
+                await db_session.execute(update(TelegramChatFullInfo), rows)
+            # Пакетный UPDATE не вызывает событий ORM, поэтому кеш сбрасывается явно
+            for row in rows:
+                telegram_object_cache.invalidate(TelegramChatFullInfo, row["id"])
+
+        return chat_ids[-1]
+
+    async def refresh_stale(self) -> None:
+        """
+        Обновляет все чаты, устаревшие к началу прохода
+        """
+        stale_before = datetime.now(tz=UTC) - self.period
+        refreshed, failed = self.refreshed, self.failed
+
+        try:
+            after_id = await self.refresh_batch(None, stale_before)
+            while after_id is not None:
+                after_id = await self.refresh_batch(after_id, stale_before)
+        except Exception as exc:
+            logger.exception(
+                "Stale chat full info refresh error: %s: %s",
+                exc.__class__.__name__,
+                exc,  # noqa: TRY401
+                exc_info=exc,
+            )
+
+        if self.refreshed != refreshed or self.failed != failed:
+            logger.info(
+                "Stale chat full info refreshed: %d, failed: %d",
+                self.refreshed - refreshed,
+                self.failed - failed,
+            )
+
+
+_pending_tasks = set[PeriodicTask]()
+
+
+async def run_stale_chat_full_info_refresh_in_background(bot: Bot) -> None:
+    """
+    Запускает периодическое обновление устаревшей полной информации о чатах
+    """
+    logger.info(
+        "Start stale chat full info refresh every %s sec",
+        TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_INTERVAL,
+    )
+    stale_refresher = StaleChatFullInfoRefresher(bot)
+    task = PeriodicTask(stale_refresher.refresh_stale, TELEGRAM_CHAT_FULL_INFO_STALE_REFRESH_INTERVAL)
+    _pending_tasks.add(task)  # Сохраняем, чтобы gc не убил
+    task.start()
+
+
+async def stop_stale_chat_full_info_refresh() -> None:
+    for task in _pending_tasks:
+        await task.stop()
+    _pending_tasks.clear()
@@ -3,14 +3,24 @@
 """
 
 import logging
-from collections.abc import Awaitable, Callable
+from collections.abc import Awaitable, Callable, Collection
 from datetime import UTC, datetime
 from typing import Any, TypeVar
 
 from aiogram import BaseMiddleware, Bot
 from aiogram.dispatcher.middlewares.user_context import EVENT_CONTEXT_KEY, EventContext, UserContextMiddleware
 from aiogram.types import Chat, ChatFullInfo, Update, User
-from djgram.configs import TELEGRAM_CHAT_FULL_INFO_UPDATE_ON_EACH_EVENT, TELEGRAM_CHAT_FULL_INFO_UPDATE_PERIOD
+from djgram.configs import (
+    TELEGRAM_CHAT_FULL_INFO_UPDATE_ON_EACH_EVENT,
+    TELEGRAM_CHAT_FULL_INFO_UPDATE_PERIOD,
+    TELEGRAM_CHAT_FULL_INFO_WAIT_FOR_UPDATE,
+)
+from djgram.contrib.telegram.cache import telegram_object_cache
+from djgram.contrib.telegram.chat_full_info import (
+    ChatFullInfoRefresher,
+    chat_full_info_refresher,
+    load_chat_full_info,
+)
 from djgram.contrib.telegram.models import TelegramChat, TelegramChatFullInfo, TelegramUser
 from djgram.db.models import BaseModel, CreatedAtMixin, UpdatedAtMixin
 from djgram.db.utils import ReturnState, get_fields_of_declarative_meta, insert_or_update
@@ -20,7 +30,6 @@ from djgram.system_configs import (
     MIDDLEWARE_TELEGRAM_CHAT_KEY,
     MIDDLEWARE_TELEGRAM_USER_KEY,
 )
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 T = TypeVar("T", bound=BaseModel)
@@ -41,18 +50,47 @@ class TelegramMiddleware(BaseMiddleware):
         | get_fields_of_declarative_meta(CreatedAtMixin)
         | get_fields_of_declarative_meta(UpdatedAtMixin)
     )
-    __telegram_user_fields = set(TelegramUser.__table__.columns.keys()) - __base_model_fields
-    __telegram_chat_fields = set(TelegramChat.__table__.columns.keys()) - __base_model_fields
-    __telegram_chat_full_info_fields = set(TelegramChatFullInfo.__table__.columns.keys()) - __base_model_fields
+    # Отсортированы, чтобы значения полей в одном порядке служили отпечатком объекта для кеша
+    __telegram_user_fields = tuple(sorted(set(TelegramUser.__table__.columns.keys()) - __base_model_fields))
+    __telegram_chat_fields = tuple(sorted(set(TelegramChat.__table__.columns.keys()) - __base_model_fields))
+
+    def __init__(
+        self,
+        *,
+        wait_for_chat_full_info_update: bool = TELEGRAM_CHAT_FULL_INFO_WAIT_FOR_UPDATE,
+        refresher: ChatFullInfoRefresher = chat_full_info_refresher,
+    ):
+        """
+        Args:
+            wait_for_chat_full_info_update: ждать ли обновления полной информации о чате перед обработчиком
+            refresher: очередь обновления полной информации о чатах
+        """
+        self.wait_for_chat_full_info_update = wait_for_chat_full_info_update
+        self.refresher = refresher
 
     @staticmethod
+    def get_fingerprint(obj: User | Chat | ChatFullInfo, fields: Collection[str]) -> tuple[Any, ...]:
+        return tuple(getattr(obj, field) for field in fields)
+
+    @classmethod
     async def save_to_db(
+        cls,
         obj: User | Chat | ChatFullInfo,
         model: type[T],
-        exclude_fields: set[str],
+        exclude_fields: Collection[str],
         db_session: AsyncSession,
         id_field: str,
     ) -> tuple[T, ReturnState]:
+        # Объект не изменился с последнего сохранения, запрос к базе не нужен
+        instance = await telegram_object_cache.get(
+            db_session,
+            model,
+            obj.id,
+            cls.get_fingerprint(obj, exclude_fields),
+        )
+        if instance is not None:
+            return instance, ReturnState.NOT_MODIFIED
+
         return await insert_or_update(
             session=db_session,
             model=model,
@@ -60,6 +98,22 @@ class TelegramMiddleware(BaseMiddleware):
             other_attr={field: getattr(obj, field) for field in exclude_fields},
         )
 
+    def remember_saved(
+        self,
+        user: User | None,
+        telegram_user: TelegramUser | None,
+        chat: Chat | None,
+        telegram_chat: TelegramChat | None,
+    ) -> None:
+        """
+        Запоминает сохранённые в базу пользователя и чат, чтобы не обращаться к базе, пока они не изменятся
+        """
+        if user is not None and telegram_user is not None:
+            telegram_object_cache.put(telegram_user, self.get_fingerprint(user, self.__telegram_user_fields))
+
+        if chat is not None and telegram_chat is not None:
+            telegram_object_cache.put(telegram_chat, self.get_fingerprint(chat, self.__telegram_chat_fields))
+
     @staticmethod
     def log_state(result: tuple[TelegramUser | TelegramChat | TelegramChatFullInfo, ReturnState]) -> None:
         obj, return_state = result
@@ -107,53 +161,68 @@ class TelegramMiddleware(BaseMiddleware):
 
         return result
 
-    async def save_telegram_chat_full_info_to_db(
+    async def update_telegram_chat_full_info(
         self,
-        chat_full_info: ChatFullInfo,
+        data: dict[str, Any],
         db_session: AsyncSession,
-    ) -> tuple[TelegramChatFullInfo, ReturnState]:
-        """
-        Сохраняет полную информацию о чате в базе
+        telegram_chat: Chat,
+        bot: Bot,
+        loaded: TelegramChatFullInfo | None = None,
+    ) -> None:
         """
+        Дожидается обновления полной информации о чате и сохраняет её в данных для обработчика
 
-        update_fields = {field: getattr(chat_full_info, field) for field in self.__telegram_chat_full_info_fields}
-        # Явно приписываем время обновления, чтобы гарантированно сохранить
-        # в базе данных время последнего запроса данных из bot api
-        update_fields["updated_at"] = datetime.now(tz=UTC)
-        result = await insert_or_update(
-            session=db_session,
-            model=TelegramChatFullInfo,
-            keys={"id": chat_full_info.id},
-            other_attr=update_fields,
-        )
-
-        self.log_state(result)
+        Если обновить информацию не удалось, обработчик получает уже загруженную из базы информацию loaded
+        """
+        telegram_chat_full_info = await self.refresher.refresh(bot, telegram_chat.id)
+        if telegram_chat_full_info is None:
+            telegram_chat_full_info = loaded
+        else:
+            # Объект сохранён в другой сессии, поэтому присоединяем его без повторной загрузки
+            telegram_chat_full_info = await db_session.merge(telegram_chat_full_info, load=False)
 
-        return result
+        data[MIDDLEWARE_TELEGRAM_CHAT_FULL_INFO_KEY] = telegram_chat_full_info
 
-    async def update_telegram_chat_full_info(
+    async def load_telegram_chat_full_info(
         self,
         data: dict[str, Any],
         db_session: AsyncSession,
         telegram_chat: Chat,
         bot: Bot,
+        *,
+        chat_changed: bool,
     ) -> None:
         """
-        Сохраняет обновленную полную информацию о чате в базе данных и данных для обработчика
+        Передаёт обработчику сохранённую полную информацию о чате и при необходимости обновляет её
+
+        Если информации нет или включено ожидание обновления, обработчик ждёт запроса getChat,
+        иначе обновление выполняется в фоне, а обработчик получает сохранённую информацию
         """
-        logger.info("Updating chat full info %s", telegram_chat.id)
+        telegram_chat_full_info = await load_chat_full_info(db_session, telegram_chat.id)
+        if telegram_chat_full_info is None:
+            logger.warning("There was no telegram chat full info %s in the database", telegram_chat.id)
+
+        # Чат изменился, значит обновляем и полную информацию
+        # Или включено обновление каждый раз
+        # Или по какой-то причине полной информации о чате не было или информация считалась устаревшей
+        need_update = (
+            chat_changed
+            or TELEGRAM_CHAT_FULL_INFO_UPDATE_ON_EACH_EVENT
+            or telegram_chat_full_info is None
+            or datetime.now(tz=UTC)
+            > telegram_chat_full_info.updated_at.astimezone(tz=UTC) + TELEGRAM_CHAT_FULL_INFO_UPDATE_PERIOD
+        )
 
-        try:
-            telegram_chat_full_info = await bot.get_chat(telegram_chat.id)
-        except Exception as exc:
-            logger.exception("Failed to get chat full info %s: %s", telegram_chat.id, exc, exc_info=exc)  # noqa: TRY401
-        else:
-            (
-                data[MIDDLEWARE_TELEGRAM_CHAT_FULL_INFO_KEY],
-                telegram_chat_full_info_return_state,
-            ) = await self.save_telegram_chat_full_info_to_db(telegram_chat_full_info, db_session)
+        if need_update and (telegram_chat_full_info is None or self.wait_for_chat_full_info_update):
+            await self.update_telegram_chat_full_info(data, db_session, telegram_chat, bot, telegram_chat_full_info)
+            return
+
+        if need_update:
+            self.refresher.request(bot, telegram_chat.id)
 
-    async def __call__(  # noqa: C901 # pyright: ignore [reportIncompatibleMethodOverride]
+        data[MIDDLEWARE_TELEGRAM_CHAT_FULL_INFO_KEY] = telegram_chat_full_info
+
+    async def __call__(  # pyright: ignore [reportIncompatibleMethodOverride]
         self,
         handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
         update: Update,
@@ -186,38 +255,13 @@ class TelegramMiddleware(BaseMiddleware):
             telegram_chat_need_commit = telegram_chat_return_state.need_commit()
             need_commit = need_commit or telegram_chat_need_commit
 
-            # TODO: Возможно стоит вынести задачу получения полной информации в фон,
-            #  так она занимает несколько сотен миллисекунд,
-            #  хотя вызывается достаточно редко
-            # Чат изменился, значит обновляем и полную информацию
-            # Или включено обновление каждый раз
-            if telegram_chat_need_commit or TELEGRAM_CHAT_FULL_INFO_UPDATE_ON_EACH_EVENT:
-                await self.update_telegram_chat_full_info(
-                    data,
-                    db_session,
-                    aiogram_chat,
-                    update.bot,  # pyright: ignore [reportArgumentType]
-                )
-            else:
-                chat_full_info_stmt = select(TelegramChatFullInfo).where(TelegramChatFullInfo.id == aiogram_chat.id)
-                telegram_chat_full_info: TelegramChatFullInfo | None = await db_session.scalar(chat_full_info_stmt)
-                if telegram_chat_full_info is None:
-                    logger.warning("There was no telegram chat full info %s in the database", aiogram_chat.id)
-
-                # Если по какой-то причине полной информации о чате не было или информация считалась устаревшей
-                if (
-                    telegram_chat_full_info is None
-                    or datetime.now(tz=UTC)
-                    > telegram_chat_full_info.updated_at.astimezone(tz=UTC) + TELEGRAM_CHAT_FULL_INFO_UPDATE_PERIOD
-                ):
-                    await self.update_telegram_chat_full_info(
-                        data,
-                        db_session,
-                        aiogram_chat,
-                        update.bot,  # pyright: ignore [reportArgumentType]
-                    )
-                else:
-                    data[MIDDLEWARE_TELEGRAM_CHAT_FULL_INFO_KEY] = telegram_chat_full_info
+            await self.load_telegram_chat_full_info(
+                data,
+                db_session,
+                aiogram_chat,
+                update.bot,  # pyright: ignore [reportArgumentType]
+                chat_changed=telegram_chat_need_commit,
+            )
 
         assert (MIDDLEWARE_TELEGRAM_CHAT_KEY in data) == (MIDDLEWARE_TELEGRAM_CHAT_FULL_INFO_KEY in data)  # noqa: S101
 
@@ -225,4 +269,12 @@ class TelegramMiddleware(BaseMiddleware):
             await db_session.commit()
             await db_session.begin()
 
+        # В кеш попадают только значения, которые уже есть в базе
+        self.remember_saved(
+            event_context.user,
+            data.get(MIDDLEWARE_TELEGRAM_USER_KEY),
+            aiogram_chat,
+            data.get(MIDDLEWARE_TELEGRAM_CHAT_KEY),
+        )
+
         return await handler(update, data)
@@ -1,7 +1,10 @@
 import asyncio
 import logging
+import time
+from collections import deque
 from collections.abc import AsyncGenerator, Iterable
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from typing import Any
 
 import orjson
@@ -31,8 +34,12 @@ def monkey_patch_asynch() -> None:
 monkey_patch_asynch()
 
 
-# TODO: по хорошему надо сделать пул соединений
 async def get_connection() -> Connection:
+    """
+    Создаёт новое соединение с clickhouse
+
+    Для обычной работы стоит использовать пул через connection()
+    """
     logger.debug("Creating connection to ClickHouse")
     return await connect(
         host=configs.CLICKHOUSE_HOST,
@@ -43,12 +50,266 @@ async def get_connection() -> Connection:
     )
 
 
+class ClickHouseUnavailableError(ConnectionError):
+    """
+    Не удалось подключиться к clickhouse, новая попытка будет после паузы
+    """
+
+
+@dataclass
+class ClickHousePoolStats:
+    """
+    Статистика пула соединений
+
+    Attributes:
+        size: сколько соединений открыто
+        idle: сколько открытых соединений не используется
+        in_use: сколько соединений используется
+        waiters: сколько задач ждут свободного соединения
+        connects: сколько соединений было открыто
+        connect_errors: сколько раз не удалось подключиться
+        last_connect_time: время последнего подключения в секундах
+        avg_connect_time: среднее время подключения в секундах
+        max_connect_time: максимальное время подключения в секундах
+    """
+
+    size: int
+    idle: int
+    in_use: int
+    waiters: int
+    connects: int
+    connect_errors: int
+    last_connect_time: float
+    avg_connect_time: float
+    max_connect_time: float
+
+
+class ClickHousePool:
+    """
+    Ограниченный пул долгоживущих соединений с clickhouse
+
+    Соединения, которые долго не использовались, закрываются,
+    а перед повторным использованием проверяются через ping.
+    После ошибки подключения новые попытки делаются с экспоненциально растущей паузой.
+    """
+
+    def __init__(
+        self,
+        max_size: int = configs.CLICKHOUSE_POOL_MAX_SIZE,
+        idle_timeout: float = configs.CLICKHOUSE_POOL_IDLE_TIMEOUT,
+        health_check_interval: float = configs.CLICKHOUSE_POOL_HEALTH_CHECK_INTERVAL,
+        reconnect_backoff_min: float = configs.CLICKHOUSE_RECONNECT_BACKOFF_MIN,
+        reconnect_backoff_max: float = configs.CLICKHOUSE_RECONNECT_BACKOFF_MAX,
+    ):
+        """
+        Args:
+            max_size: максимальное число соединений
+            idle_timeout: через сколько секунд простоя соединение закрывается
+            health_check_interval: через сколько секунд простоя соединение проверяется перед использованием
+            reconnect_backoff_min: пауза после первой ошибки подключения в секундах
+            reconnect_backoff_max: максимальная пауза между попытками подключения в секундах
+        """
+        if max_size < 1:
+            raise ValueError("max_size should be greater or equal 1")
+
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.reconnect_backoff_min = reconnect_backoff_min
+        self.reconnect_backoff_max = reconnect_backoff_max
+
+        self._semaphore = asyncio.Semaphore(max_size)
+        # Свободные соединения и время их последнего использования, последние использованные справа
+        self._idle: deque[tuple[Connection, float]] = deque()
+        self._in_use = 0
+        self._waiters = 0
+        self._closed = False
+
+        self._connects = 0
+        self._connect_errors = 0
+        self._consecutive_errors = 0
+        self._next_connect_attempt = 0.0
+        self._last_connect_time = 0.0
+        self._total_connect_time = 0.0
+        self._max_connect_time = 0.0
+
+    @property
+    def stats(self) -> ClickHousePoolStats:
+        return ClickHousePoolStats(
+            size=len(self._idle) + self._in_use,
+            idle=len(self._idle),
+            in_use=self._in_use,
+            waiters=self._waiters,
+            connects=self._connects,
+            connect_errors=self._connect_errors,
+            last_connect_time=self._last_connect_time,
+            avg_connect_time=self._total_connect_time / self._connects if self._connects else 0,
+            max_connect_time=self._max_connect_time,
+        )
+
+    async def _close_connection(self, conn: Connection) -> None:
+        try:
+            await conn.close()
+        except Exception as exc:  # noqa: BLE001
+            logger.debug("Closing ClickHouse connection error: %s", exc)
+
+    async def _close_expired(self, now: float) -> None:
+        # Самые давно использованные соединения слева
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            await self._close_connection(conn)
+
+    async def _connect(self) -> Connection:
+        now = time.monotonic()
+        if now < self._next_connect_attempt:
+            raise ClickHouseUnavailableError(
+                f"ClickHouse is unavailable, next attempt in {self._next_connect_attempt - now:.1f} sec",
+            )
+
+        start = time.perf_counter()
+        try:
+            conn = await get_connection()
+        except Exception as exc:
+            self._connect_errors += 1
+            self._consecutive_errors += 1
+            backoff = min(
+                self.reconnect_backoff_min * 2 ** (self._consecutive_errors - 1),
+                self.reconnect_backoff_max,
+            )
+            self._next_connect_attempt = time.monotonic() + backoff
+            logger.warning("Connecting to ClickHouse error, retry in %.1f sec: %s", backoff, exc)
+            raise ClickHouseUnavailableError(str(exc)) from exc
+
+        connect_time = time.perf_counter() - start
+        self._connects += 1
+        self._consecutive_errors = 0
+        self._last_connect_time = connect_time
+        self._total_connect_time += connect_time
+        self._max_connect_time = max(self._max_connect_time, connect_time)
+
+        return conn
+
+    async def _get_idle(self) -> Connection | None:
+        now = time.monotonic()
+        await self._close_expired(now)
+
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if now - last_used < self.health_check_interval:
+                return conn
+
+            try:
+                await conn.ping()
+            except Exception as exc:  # noqa: BLE001
+                logger.debug("ClickHouse connection health check failed: %s", exc)
+                await self._close_connection(conn)
+                continue
+
+            return conn
+
+        return None
+
+    async def acquire(self) -> Connection:
+        """
+        Возвращает соединение из пула, его обязательно нужно вернуть через release
+        """
+        if self._closed:
+            raise RuntimeError("ClickHouse pool is closed")
+
+        self._waiters += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiters -= 1
+
+        try:
+            conn = await self._get_idle()
+            if conn is None:
+                conn = await self._connect()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        self._in_use += 1
+        return conn
+
+    async def release(self, conn: Connection, *, broken: bool = False) -> None:
+        """
+        Возвращает соединение в пул
+
+        Args:
+            conn: соединение
+            broken: соединение в неизвестном состоянии после ошибки, его нужно закрыть
+        """
+        self._in_use -= 1
+        try:
+            if broken or self._closed or not conn.opened:
+                await self._close_connection(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncGenerator[Connection, None]:
+        """
+        Берёт соединение из пула на время контекста
+        """
+        conn = await self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            await self.release(conn, broken=True)
+            raise
+        else:
+            await self.release(conn)
+
+    async def close(self) -> None:
+        """
+        Закрывает все соединения, используемые сейчас закроются при возвращении в пул
+        """
+        self._closed = True
+        while self._idle:
+            conn, _ = self._idle.pop()
+            await self._close_connection(conn)
+
+
+_pool: ClickHousePool | None = None
+
+
+def get_pool() -> ClickHousePool:
+    """
+    Возвращает общий пул соединений, создавая его при первом обращении
+    """
+    global _pool  # noqa: PLW0603
+    if _pool is None:
+        _pool = ClickHousePool()
+
+    return _pool
+
+
+async def close_pool() -> None:
+    """
+    Закрывает общий пул соединений, следующее обращение создаст новый пул
+
+    Можно зарегистрировать на остановку бота: dp.shutdown.register(close_pool)
+    """
+    global _pool
+    if _pool is None:
+        return
+
+    pool, _pool = _pool, None
+    await pool.close()
+    logger.info("ClickHouse connection pool closed")
+
+
 @asynccontextmanager
 async def connection() -> AsyncGenerator[Connection, None]:
     """
-    Обертка над get_connection в виде контекстного менеджера
+    Берёт соединение из общего пула на время контекста
     """
-    yield await get_connection()
+    async with get_pool().connection() as conn:
+        yield conn
 
 
 def get_insert_sql(table_name: str, columns: Iterable[str]) -> str:
@@ -86,6 +347,66 @@ async def insert_dict(client: Connection, table_name: str, data: dict[str, Any])
         return await cursor.execute(sql, values)
 
 
+async def insert_columns(
+    client: Connection,
+    table_name: str,
+    columns: dict[str, list[Any]],
+    settings: dict[str, Any] | None = None,
+) -> int:
+    """
+    Вставляет в clickhouse данные по колонкам одним запросом
+
+    Args:
+        client: клиент clickhouse
+        table_name: название таблицы
+        columns: значения для каждой колонки, все списки одной длины
+        settings: настройки запроса clickhouse
+
+    Returns:
+        Число вставленных строк
+    """
+
+    logger.debug("Inserting columns in ClickHouse")
+    sql = get_insert_sql(table_name, columns.keys())
+    # Курсор asynch не умеет передавать данные по колонкам, хотя протокол clickhouse колоночный
+    return await client._connection.execute(  # noqa: SLF001
+        sql,
+        args=list(columns.values()),
+        columnar=True,
+        settings=settings,
+    )
+
+
+async def insert_rows(client: Connection, table_name: str, rows: Iterable[dict[str, Any]]) -> int:
+    """
+    Вставляет в clickhouse строки, по одному колоночному запросу на каждый набор колонок
+
+    Колонки, которых нет в строке, получают значения по умолчанию из схемы таблицы.
+
+    Args:
+        client: клиент clickhouse
+        table_name: название таблицы
+        rows: строки для вставки
+
+    Returns:
+        Число вставленных строк
+    """
+    groups: dict[tuple[str, ...], dict[str, list[Any]]] = {}
+    for row in rows:
+        columns = groups.get(tuple(row))
+        if columns is None:
+            columns = groups[tuple(row)] = {name: [] for name in row}
+
+        for name, value in row.items():
+            columns[name].append(value)
+
+    inserted = 0
+    for columns in groups.values():
+        inserted += await insert_columns(client, table_name, columns)
+
+    return inserted
+
+
 async def safe_insert_dict(table_name: str, data: dict[str, Any]) -> int | None:
     """
     Вставляет словарь в clickhouse без вызова исключения
@@ -105,20 +426,82 @@ async def safe_insert_dict(table_name: str, data: dict[str, Any]) -> int | None:
         return None
 
 
-async def run_sql(sql: str) -> None:
+def _skip_quoted(sql: str, start: int) -> int:
+    """
+    Возвращает позицию сразу после строки или идентификатора в кавычках, начинающихся в start
     """
-    Выполняет sql в clickhouse
+    quote = sql[start]
+    position = start + 1
+    while position < len(sql):
+        char = sql[position]
+        if char == "\\":
+            position += 2
+            continue
+
+        if char == quote:
+            # Удвоенная кавычка внутри строки - экранирование
+            if sql.startswith(quote, position + 1):
+                position += 2
+                continue
+            return position + 1
+
+        position += 1
+
+    return position
+
 
-    Будут проблемы с запросами, содержащими ";" не в качестве окончания запроса
+def split_sql_statements(sql: str) -> list[str]:
+    """
+    Разбивает скрипт на отдельные запросы по ";"
+
+    Точки с запятой внутри строк, идентификаторов в кавычках и комментариев не считаются концом запроса.
+    Запросы, состоящие только из комментариев, пропускаются.
+    """
+    statements = []
+    start = 0
+    position = 0
+    has_code = False
+    while position < len(sql):
+        char = sql[position]
+
+        if char in "'\"`":
+            position = _skip_quoted(sql, position)
+            has_code = True
+
+        elif sql.startswith("--", position):
+            end = sql.find("\n", position)
+            position = len(sql) if end == -1 else end + 1
+
+        elif sql.startswith("/*", position):
+            end = sql.find("*/", position + 2)
+            position = len(sql) if end == -1 else end + 2
+
+        elif char == ";":
+            if has_code:
+                statements.append(sql[start:position].strip())
+            position += 1
+            start = position
+            has_code = False
+
+        else:
+            has_code = has_code or not char.isspace()
+            position += 1
+
+    if has_code:
+        statements.append(sql[start:].strip())
+
+    return statements
+
+
+async def run_sql(sql: str) -> None:
+    """
+    Выполняет скрипт из одного или нескольких запросов в clickhouse
     """
     async with (
         connection() as clickhouse_connection,
         clickhouse_connection.cursor() as cursor,
     ):
-        for statement in sql.split(";"):
-            query = statement.strip()
-            if query == "":
-                continue
+        for query in split_sql_statements(sql):
             await cursor.execute(query)
 
 
@@ -0,0 +1,291 @@
+"""
+Версионные миграции схемы clickhouse
+
+Миграция - файл <версия>_<название>.sql, например 0002_update_layout.sql.
+Миграции применяются по возрастанию версии, каждая один раз,
+применённые версии записываются в таблицу CLICKHOUSE_MIGRATIONS_TABLE.
+
+В тексте миграции можно использовать настройки djgram в виде ${ANALYTICS_EVENTS_TTL_DAYS},
+знак доллара записывается как $$. Значения подставляются при применении,
+поэтому изменение настройки не меняет уже применённые миграции.
+
+В clickhouse нет транзакций для ddl, поэтому миграция, прерванная на середине,
+при следующем запуске выполняется заново целиком, и её запросы должны это допускать.
+
+Одновременно миграции применяет только один процесс: перед применением создаётся таблица-замок
+<CLICKHOUSE_MIGRATIONS_TABLE>_lock. CREATE TABLE без IF NOT EXISTS выполняется атомарно,
+поэтому второй процесс получает ошибку и не трогает таблицы. Если процесс упал, не сняв замок,
+его нужно снять командой python -m djgram migrate-clickhouse --unlock.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import socket
+import string
+import time
+from collections.abc import AsyncIterator, Mapping
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, Final
+
+from asynch.connection import Connection
+from asynch.errors import ErrorCode, ServerException
+from djgram import configs
+from djgram.db import clickhouse
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_FILE_PATTERN: Final[re.Pattern[str]] = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+_MIGRATIONS_TABLE_DDL_SQL = """
+CREATE TABLE IF NOT EXISTS {table_name}
+(
+    `version`       UInt32,
+    `name`          String,
+    `checksum`      String,
+    `applied_at`    DateTime64,
+    `duration`      Float64
+)
+    ENGINE = MergeTree()
+        ORDER BY (version)
+"""
+
+
+_LOCK_TABLE_DDL_SQL = """
+CREATE TABLE {table_name}
+(
+    `owner`         String,
+    `locked_at`     DateTime64
+)
+    ENGINE = MergeTree()
+        ORDER BY tuple()
+"""
+
+
+class MigrationError(Exception):
+    """
+    Ошибка в файлах миграций
+    """
+
+
+class MigrationLockedError(MigrationError):
+    """
+    Миграции уже применяет другой процесс
+    """
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    Файл миграции
+
+    Attributes:
+        version: номер версии, миграции применяются по его возрастанию
+        name: название миграции
+        path: путь до файла
+    """
+
+    version: int
+    name: str
+    path: Path
+
+    def read(self) -> str:
+        return self.path.read_text(encoding="utf-8")
+
+    def get_checksum(self) -> str:
+        """
+        Возвращает хеш файла миграции, по нему видно, что применённую миграцию изменили
+        """
+        return hashlib.sha256(self.path.read_bytes()).hexdigest()
+
+
+def get_migrations(directory: str | os.PathLike[str]) -> list[Migration]:
+    """
+    Возвращает миграции из папки по возрастанию версии
+    """
+    migrations: dict[int, Migration] = {}
+    for path in Path(directory).glob("*.sql"):
+        match = MIGRATION_FILE_PATTERN.match(path.name)
+        if match is None:
+            raise MigrationError(f"Wrong migration file name {path.name}, expected <version>_<name>.sql")
+
+        version = int(match[1])
+        if version in migrations:
+            raise MigrationError(f"Migrations {migrations[version].path.name} and {path.name} have same version")
+
+        migrations[version] = Migration(version=version, name=match[2], path=path)
+
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def get_migration_params() -> dict[str, Any]:
+    """
+    Возвращает настройки djgram, которые можно использовать в миграциях
+    """
+    return {name: value for name, value in vars(configs).items() if name.isupper()}
+
+
+def render_migration(sql: str, params: Mapping[str, Any]) -> str:
+    """
+    Подставляет настройки в текст миграции
+    """
+    try:
+        return string.Template(sql).substitute(params)
+    except KeyError as exc:
+        raise MigrationError(f"Unknown setting {exc} in migration") from exc
+    except ValueError as exc:
+        raise MigrationError(f"Wrong placeholder in migration: {exc}") from exc
+
+
+class ClickHouseMigrator:
+    """
+    Применяет миграции из папки к clickhouse
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str],
+        table_name: str = configs.CLICKHOUSE_MIGRATIONS_TABLE,
+        params: Mapping[str, Any] | None = None,
+    ):
+        """
+        Args:
+            directory: папка с файлами миграций
+            table_name: таблица с применёнными миграциями
+            params: значения для подстановки в миграции, по умолчанию настройки djgram
+        """
+        self.directory = Path(directory)
+        self.table_name = table_name
+        self.params = params if params is not None else get_migration_params()
+
+    @property
+    def lock_table_name(self) -> str:
+        return f"{self.table_name}_lock"
+
+    @asynccontextmanager
+    async def lock(self, client: Connection) -> AsyncIterator[None]:
+        """
+        Не даёт другим процессам применять миграции, пока открыт контекст
+
+        Raises:
+            MigrationLockedError: если миграции уже применяет другой процесс
+        """
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        try:
+            async with client.cursor() as cursor:
+                await cursor.execute(_LOCK_TABLE_DDL_SQL.format(table_name=self.lock_table_name))
+        except ServerException as exc:
+            if exc.code != ErrorCode.TABLE_ALREADY_EXISTS:
+                raise
+
+            async with client.cursor() as cursor:
+                await cursor.execute(f"SELECT owner, locked_at FROM {self.lock_table_name}")  # noqa: S608
+                holders = await cursor.fetchall()
+            holder = ", ".join(f"{holder_owner} since {locked_at}" for holder_owner, locked_at in holders) or "unknown"
+            raise MigrationLockedError(
+                f"Clickhouse migrations are being applied by {holder}. "
+                f"If that process is dead, run python -m djgram migrate-clickhouse --unlock",
+            ) from exc
+
+        try:
+            await clickhouse.insert_rows(
+                client,
+                self.lock_table_name,
+                [{"owner": owner, "locked_at": datetime.now(tz=UTC)}],
+            )
+            yield
+        finally:
+            await self.unlock(client)
+
+    async def unlock(self, client: Connection) -> None:
+        """
+        Снимает замок, в том числе оставленный упавшим процессом
+        """
+        async with client.cursor() as cursor:
+            await cursor.execute(f"DROP TABLE IF EXISTS {self.lock_table_name}")
+
+    async def ensure_table(self, client: Connection) -> None:
+        async with client.cursor() as cursor:
+            await cursor.execute(_MIGRATIONS_TABLE_DDL_SQL.format(table_name=self.table_name))
+
+    async def get_applied(self, client: Connection) -> dict[int, str]:
+        """
+        Возвращает применённые версии и хеши их файлов
+        """
+        async with client.cursor() as cursor:
+            await cursor.execute(f"SELECT version, checksum FROM {self.table_name}")  # noqa: S608
+            return dict(await cursor.fetchall())
+
+    async def get_pending(self, client: Connection) -> list[Migration]:
+        """
+        Возвращает миграции, которые ещё не применены
+
+        Если файл применённой миграции изменили, пишется предупреждение, но миграция не применяется повторно
+        """
+        await self.ensure_table(client)
+        applied = await self.get_applied(client)
+
+        pending = []
+        for migration in get_migrations(self.directory):
+            checksum = applied.get(migration.version)
+            if checksum is None:
+                pending.append(migration)
+            elif checksum != migration.get_checksum():
+                logger.warning("Applied clickhouse migration %s was changed", migration.path.name)
+
+        return pending
+
+    async def apply(self, client: Connection, migration: Migration) -> None:
+        """
+        Применяет миграцию и записывает её в таблицу применённых
+        """
+        logger.info("Applying clickhouse migration %s", migration.path.name)
+        sql = render_migration(migration.read(), self.params)
+
+        start = time.perf_counter()
+        async with client.cursor() as cursor:
+            for query in clickhouse.split_sql_statements(sql):
+                await cursor.execute(query)
+        duration = time.perf_counter() - start
+
+        await clickhouse.insert_rows(
+            client,
+            self.table_name,
+            [
+                {
+                    "version": migration.version,
+                    "name": migration.name,
+                    "checksum": migration.get_checksum(),
+                    "applied_at": datetime.now(tz=UTC),
+                    "duration": duration,
+                },
+            ],
+        )
+        logger.info("Clickhouse migration %s applied in %.2f sec", migration.path.name, duration)
+
+    async def migrate(self, target: int | None = None) -> list[Migration]:
+        """
+        Применяет по порядку все не применённые миграции
+
+        Args:
+            target: последняя версия, которую нужно применить, по умолчанию все
+
+        Returns:
+            Применённые миграции
+
+        Raises:
+            MigrationLockedError: если миграции уже применяет другой процесс
+        """
+        async with clickhouse.connection() as client, self.lock(client):
+            pending = await self.get_pending(client)
+            if target is not None:
+                pending = [migration for migration in pending if migration.version <= target]
+
+            for migration in pending:
+                await self.apply(client, migration)
+
+        return pending
@@ -3,11 +3,26 @@
 """
 
 import logging
+from collections.abc import Collection, Sequence
 from enum import Enum
 from typing import Any, TypeVar, cast
 
-from sqlalchemy import inspect, select, update
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import (
+    Boolean,
+    Column,
+    ColumnElement,
+    Select,
+    Table,
+    false,
+    inspect,
+    literal_column,
+    select,
+    true,
+    tuple_,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import MappedColumn, RelationshipProperty, Synonym
@@ -114,31 +129,107 @@ async def get_or_create(
     return instance, True
 
 
-async def insert_or_update(
+def _get_key_expression(columns: Sequence[ColumnElement[Any]]) -> ColumnElement[Any]:
+    return columns[0] if len(columns) == 1 else tuple_(*columns)
+
+
+def _get_key_value(row: dict[str, Any], key_fields: Sequence[str]) -> Any:
+    return row[key_fields[0]] if len(key_fields) == 1 else tuple(row[field] for field in key_fields)
+
+
+def _get_onupdate_values(table: Table, exclude: Collection[Column[Any]]) -> dict[Column[Any], Any]:
+    """
+    Возвращает значения onupdate колонок, их sqlalchemy не подставляет в ON CONFLICT DO UPDATE сама
+    """
+    values = {}
+    for column in table.columns:
+        if column in exclude or column.onupdate is None:
+            continue
+
+        onupdate = cast(Any, column.onupdate)
+        # Функции без аргументов sqlalchemy оборачивает в функцию от контекста выполнения
+        values[column] = onupdate.arg(None) if onupdate.is_callable else onupdate.arg
+
+    return values
+
+
+def _build_postgresql_upsert(
+    model: type[BaseModel],
+    rows: Sequence[dict[str, Any]],
+    key_fields: Sequence[str],
+) -> Select[Any]:
+    """
+    Собирает запрос, который вставляет или обновляет строки и возвращает все строки за один запрос
+
+    WITH upserted AS (
+        INSERT INTO table (...) VALUES (...), (...)
+        ON CONFLICT (keys) DO UPDATE SET field = excluded.field, ...
+        WHERE (table.field, ...) IS DISTINCT FROM (excluded.field, ...)
+        RETURNING table.*, (xmax = 0) AS inserted, true AS modified
+    )
+    SELECT * FROM upserted
+    UNION ALL
+    SELECT table.*, false, false FROM table WHERE keys IN (...) AND keys NOT IN (SELECT keys FROM upserted)
+
+    Строки, которые не изменились, не обновляются и не попадают в RETURNING,
+    поэтому берутся из таблицы второй частью запроса. Снимок для неё сделан до вставки,
+    поэтому вставленные в этом же запросе строки она не видит.
+    """
+    mapper = inspect(model)
+    table = cast(Table, mapper.local_table)
+    key_columns = [mapper.columns[field] for field in key_fields]
+    update_columns = [mapper.columns[field] for field in rows[0] if field not in key_fields]
+
+    stmt = postgresql.insert(table).values(
+        [{mapper.columns[field].key: value for field, value in row.items()} for row in rows],
+    )
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: stmt.excluded[column.key] for column in update_columns}
+            | _get_onupdate_values(table, update_columns),
+            where=tuple_(*update_columns).is_distinct_from(
+                tuple_(*(stmt.excluded[column.key] for column in update_columns)),
+            ),
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=key_columns)
+
+    upserted = stmt.returning(
+        *table.columns,
+        # xmax новой версии строки равен 0 только у вставленных строк
+        literal_column("xmax = 0", Boolean).label("inserted"),
+        true().label("modified"),
+    ).cte("upserted")
+
+    unchanged = select(*table.columns, false().label("inserted"), false().label("modified")).where(
+        _get_key_expression(key_columns).in_([_get_key_value(row, key_fields) for row in rows]),
+        _get_key_expression(key_columns).not_in(select(*(upserted.c[column.key] for column in key_columns))),
+    )
+
+    compound = union_all(select(upserted), unchanged)
+    return (
+        select(model, literal_column("inserted", Boolean), literal_column("modified", Boolean))
+        .from_statement(compound)
+        .execution_options(populate_existing=True)
+    )
+
+
+async def _insert_or_update_select_first(
     session: AsyncSession,
     model: type[T],
     keys: dict[str, Any],
     other_attr: dict[str, Any],
 ) -> tuple[T, ReturnState]:
     """
-    Создаёт объект, если его не было, обновляет, если требуется, иначе возвращает запись из бд
-
-    Это аналог функции merge из sqlalchemy, но возвращающая статус выполнения
-
-    Args:
-        session(AsyncSession): сессия sqlalchemy
-        model: модель, объект которой ищется
-        keys(dict[str, Any]): ключевые поля, по которым будет производиться поиск элемента в базе
-        other_attr(dict[str, Any]): поля, возможно требующие обновления
-
-    Returns:
-        tuple[Any, ReturnState]: кортеж из элемента модели и состояния (не изменён, создан или обновлен)
+    Ищет объект и создаёт или обновляет его отдельным запросом, нужно для баз без upsert в CTE
     """
     stmt = select(model).with_for_update(read=True).filter_by(**keys)
     instance = await session.scalar(stmt)
 
     # Объект в базе не найден => создаём новый
     if instance is None:
+        insert = sqlite.insert if session.get_bind().dialect.name == "sqlite" else postgresql.insert
         stmt = (
             insert(model)
             .values(**keys, **other_attr)
@@ -160,3 +251,111 @@ async def insert_or_update(
     # Иначе обновляем
     stmt = update(model).filter_by(**keys).values(**for_update).returning(model)
     return cast(T, await session.scalar(stmt)), ReturnState.UPDATED
+
+
+async def _upsert_many_postgresql(
+    session: AsyncSession,
+    model: type[T],
+    rows: Sequence[dict[str, Any]],
+    key_fields: Sequence[str],
+) -> list[tuple[T, ReturnState]]:
+    def get_instance_key(instance: T) -> Any:
+        return _get_key_value({field: getattr(instance, field) for field in key_fields}, key_fields)
+
+    found: dict[Any, tuple[T, ReturnState]] = {}
+    for instance, inserted, modified in await session.execute(_build_postgresql_upsert(model, rows, key_fields)):
+        if inserted:
+            state = ReturnState.CREATED
+        elif modified:
+            state = ReturnState.UPDATED
+        else:
+            state = ReturnState.NOT_MODIFIED
+        found[get_instance_key(instance)] = instance, state
+
+    # Строку, вставленную параллельной транзакцией после начала запроса, не видит вторая часть запроса
+    key_values = [_get_key_value(row, key_fields) for row in rows]
+    missing = [key_value for key_value in key_values if key_value not in found]
+    if missing:
+        key_expression = _get_key_expression([getattr(model, field) for field in key_fields])
+        for instance in await session.scalars(select(model).where(key_expression.in_(missing))):
+            found[get_instance_key(instance)] = instance, ReturnState.NOT_MODIFIED
+
+    return [found[key_value] for key_value in key_values]
+
+
+async def upsert_many(
+    session: AsyncSession,
+    model: type[T],
+    rows: Sequence[dict[str, Any]],
+    key_fields: Sequence[str],
+) -> list[tuple[T, ReturnState]]:
+    """
+    Создаёт или обновляет несколько объектов одной модели и возвращает их вместе с состояниями
+
+    В postgresql выполняется один запрос INSERT ... ON CONFLICT DO UPDATE ... WHERE ... IS DISTINCT FROM,
+    строки без изменений не перезаписываются. Для остальных баз, например sqlite, в которой нет
+    изменяющих запросов внутри WITH, каждый объект ищется и сохраняется отдельно.
+
+    Сравнение выполняется в базе, поэтому у сравниваемых колонок должен быть оператор равенства
+    (например, у json в postgresql его нет, нужно использовать jsonb).
+
+    За один вызов сохраняются строки только одной модели: у разных таблиц разные колонки,
+    поэтому их нельзя объединить в один INSERT. Для нескольких моделей нужно несколько вызовов.
+
+    Args:
+        session: сессия sqlalchemy
+        model: модель
+        rows: значения полей объектов, у всех строк должен быть одинаковый набор полей
+        key_fields: поля уникального ключа, по которым ищутся существующие объекты
+
+    Returns:
+        Объекты и состояния (не изменён, создан или обновлен) в порядке строк
+
+    Raises:
+        ValueError: если у строк разный набор полей или повторяются ключи
+    """
+    if not rows:
+        return []
+
+    fields = rows[0].keys()
+    if any(row.keys() != fields for row in rows):
+        raise ValueError("All rows should have same fields")
+
+    key_values = [_get_key_value(row, key_fields) for row in rows]
+    if len(set(key_values)) != len(key_values):
+        raise ValueError("Rows have duplicate keys")
+
+    if session.get_bind().dialect.name != "postgresql":
+        results = []
+        for row in rows:
+            keys = {field: row[field] for field in key_fields}
+            other_attr = {field: value for field, value in row.items() if field not in keys}
+            results.append(await _insert_or_update_select_first(session, model, keys, other_attr))
+        return results
+
+    return await _upsert_many_postgresql(session, model, rows, key_fields)
+
+
+async def insert_or_update(
+    session: AsyncSession,
+    model: type[T],
+    keys: dict[str, Any],
+    other_attr: dict[str, Any],
+) -> tuple[T, ReturnState]:
+    """
+    Создаёт объект, если его не было, обновляет, если требуется, иначе возвращает запись из бд
+
+    Это аналог функции merge из sqlalchemy, но возвращающая статус выполнения.
+    В postgresql выполняется одним запросом, см. :func:upsert_many
+
+    Args:
+        session(AsyncSession): сессия sqlalchemy
+        model: модель, объект которой ищется
+        keys(dict[str, Any]): ключевые поля, по которым будет производиться поиск элемента в базе
+        other_attr(dict[str, Any]): поля, возможно требующие обновления
+
+    Returns:
+        tuple[Any, ReturnState]: кортеж из элемента модели и состояния (не изменён, создан или обновлен)
+    """
+    [result] = await upsert_many(session, model, [keys | other_attr], list(keys))
+    return result
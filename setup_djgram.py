@@ -14,13 +14,23 @@ from djgram.contrib.analytics.middlewares import (
     DialogAnalyticsInnerMessageMiddleware,
     SaveUpdateToClickHouseMiddleware,
 )
+from djgram.contrib.analytics.writer import close_analytics_writer, prepare_analytics_writer
+from djgram.contrib.auth.last_interaction import close_last_interaction_writer
 from djgram.contrib.auth.middlewares import AuthMiddleware
 from djgram.contrib.communication import router as communication_router
+from djgram.contrib.limits.batching import setup_method_batching
+from djgram.contrib.limits.coalescing import setup_edit_coalescing
 from djgram.contrib.limits.limiter import patch_bot_with_limiter
 from djgram.contrib.logs.middlewares import TraceMiddleware
 from djgram.contrib.misc.handlers import cancel_handler
 from djgram.contrib.misc.middlewares import ErrorHandlingMiddleware
+from djgram.contrib.telegram.chat_full_info import (
+    close_chat_full_info_refresher,
+    run_stale_chat_full_info_refresh_in_background,
+    stop_stale_chat_full_info_refresh,
+)
 from djgram.contrib.telegram.middlewares import TelegramMiddleware
+from djgram.db import clickhouse
 from djgram.db.middlewares import DbSessionMiddleware
 from djgram.system_configs import DEFAULT_ERROR_TEXT_FOR_USER
 
@@ -58,7 +68,10 @@ def setup_djgram(  # noqa: PLR0913
     dp: Dispatcher,
     *,
     add_limiter: bool = True,
+    coalesce_edits: bool = False,
+    batch_methods: bool = False,
     analytics: bool = False,
+    refresh_stale_chat_full_info: bool = False,
     error_text: str = DEFAULT_ERROR_TEXT_FOR_USER,
     skip_exceptions: type[Exception] | tuple[type[Exception], ...] = (),
     dialog_manager_factory: DialogManagerFactory | None = None,
@@ -70,7 +83,13 @@ def setup_djgram(  # noqa: PLR0913
         dp: диспетчер
         add_limiter: включить лимитер со стандартными настройками
             https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+        coalesce_edits: отправлять только последнее из изменений сообщения, накопившихся,
+            пока предыдущее изменение ждёт в лимитере или выполняется
+        batch_methods: объединять удаления и копирования сообщений в один чат
+            в пакетные методы deleteMessages и copyMessages
         analytics: включить сохранение аналитики в ClickHouse
+        refresh_stale_chat_full_info: периодически обновлять устаревшую полную информацию о чатах в фоне,
+            чтобы запросы getChat не выполнялись во время обработки событий
         error_text: текст сообщения, которое будет отправляться пользователями при ошибках в системе
         skip_exceptions: список исключений, который не нужно обрабатывать в ErrorHandlingMiddleware
         dialog_manager_factory: фабрика диалоговых менеджеров для aiogram-dialog
@@ -82,11 +101,33 @@ def setup_djgram(  # noqa: PLR0913
     if add_limiter:
         patch_bot_with_limiter()
 
+    if refresh_stale_chat_full_info:
+        dp.startup.register(run_stale_chat_full_info_refresh_in_background)
+        dp.shutdown.register(stop_stale_chat_full_info_refresh)
+
+    # Полная информация о чатах и время взаимодействия пользователей пишутся в фоне,
+    # перед остановкой сохраняем накопленное
+    dp.shutdown.register(close_chat_full_info_refresher)
+    dp.shutdown.register(close_last_interaction_writer)
+
     if analytics:
+        # Таблицы clickhouse создаются и обновляются миграциями до начала обработки update'ов
+        dp.startup.register(prepare_analytics_writer)
         setup_dialog_analytics()
         setup_bot_answer_analytics()
 
         dp.message.middleware(DialogAnalyticsInnerMessageMiddleware())
         dp.callback_query.middleware(DialogAnalyticsInnerCallbackQueryMiddleware())
 
+        # Сначала записываем накопленную аналитику, потом закрываем соединения
+        dp.shutdown.register(close_analytics_writer)
+        dp.shutdown.register(clickhouse.close_pool)
+
+    # Подключаются последними, чтобы объединённые вызовы не проходили через лимитер и аналитику
+    if coalesce_edits:
+        setup_edit_coalescing()
+
+    if batch_methods:
+        setup_method_batching()
+
     logger.info("djgram setup")
@@ -13,7 +13,4 @@ MIDDLEWARE_TELEGRAM_CHAT_FULL_INFO_KEY = "telegram_chat_full_info"
 MIDDLEWARE_AUTH_USER_KEY = "user"
 
 # Limiter
-LIMIT_CALLER_GROUP_LIMITER_CACHE_MAX_SIZE = 2**63
-LIMIT_CALLER_GROUP_LIMITER_CACHE_TTL_SECONDS = 60
-LIMIT_CALLER_CHAT_LIMITER_CACHE_MAX_SIZE = 2**63
-LIMIT_CALLER_CHAT_LIMITER_CACHE_TTL_SECONDS = 60
+LIMIT_CALLER_LIMITER_SWEEP_PERIOD_SECONDS = 60
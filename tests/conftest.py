@@ -0,0 +1,29 @@
+"""
+Общие настройки тестов
+
+Тесты запускаются из корня репозитория: python -m pytest
+"""
+
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Репозиторий сам является пакетом djgram, но папка клона может называться иначе
+if importlib.util.find_spec("djgram") is None:
+    spec = importlib.util.spec_from_file_location(
+        "djgram",
+        ROOT / "__init__.py",
+        submodule_search_locations=[str(ROOT)],
+    )
+    module = importlib.util.module_from_spec(spec)  # pyright: ignore [reportArgumentType]
+    sys.modules["djgram"] = module
+    spec.loader.exec_module(module)  # pyright: ignore [reportOptionalMemberAccess]
+
+
+def pytest_sessionstart(session: object) -> None:
+    # djgram.configs подключает configs.py из текущей папки, а в корне репозитория лежат настройки по умолчанию
+    # под тем же именем, поэтому тесты работают из папки tests
+    os.chdir(Path(__file__).resolve().parent)
@@ -0,0 +1,83 @@
+"""
+Clickhouse в памяти для тестов: понимает только запросы, которые выполняют миграции и приёмники аналитики
+"""
+
+import re
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Any
+
+from asynch.errors import ErrorCode, ServerException
+
+_CREATE_TABLE = re.compile(r"^\s*CREATE TABLE (IF NOT EXISTS )?(\w+)", re.IGNORECASE)
+_DROP_TABLE = re.compile(r"^\s*DROP TABLE IF EXISTS (\w+)", re.IGNORECASE)
+_SELECT = re.compile(r"^\s*SELECT (.+?) FROM (\w+)", re.IGNORECASE)
+_INSERT = re.compile(r"^\s*INSERT INTO (\w+)\s*\((.+?)\)", re.IGNORECASE)
+_LEADING_COMMENTS = re.compile(r"^(\s*--[^\n]*\n)+")
+
+
+class FakeCursor:
+    def __init__(self, server: "FakeClickHouse"):
+        self.server = server
+        self._result: list[tuple[Any, ...]] = []
+
+    async def execute(self, query: str) -> None:
+        self._result = self.server.execute(query)
+
+    async def fetchall(self) -> list[tuple[Any, ...]]:
+        return self._result
+
+
+class FakeConnection:
+    def __init__(self, server: "FakeClickHouse"):
+        self.server = server
+
+    async def execute(self, query: str, args: list[list[Any]], columnar: bool, settings: Any = None) -> int:  # noqa: FBT001
+        match = _INSERT.match(query)
+        assert match is not None, query
+        names = [name.strip().strip("`") for name in match[2].split(",")]
+        rows = [dict(zip(names, values, strict=True)) for values in zip(*args, strict=True)]
+        self.server.tables[match[1]].extend(rows)
+        self.server.inserts.append((match[1], settings))
+        return len(rows)
+
+
+class FakeClickHouse:
+    """
+    Хранит таблицы как списки строк и запоминает все выполненные запросы
+    """
+
+    def __init__(self):
+        self.tables: dict[str, list[dict[str, Any]]] = {}
+        self.queries: list[str] = []
+        self.inserts: list[tuple[str, Any]] = []
+        self._connection = FakeConnection(self)
+
+    def execute(self, query: str) -> list[tuple[Any, ...]]:
+        self.queries.append(query)
+        query = _LEADING_COMMENTS.sub("", query)
+
+        if match := _CREATE_TABLE.match(query):
+            if match[2] in self.tables:
+                if match[1]:
+                    return []
+                raise ServerException(f"Table {match[2]} already exists", ErrorCode.TABLE_ALREADY_EXISTS)
+            self.tables[match[2]] = []
+        elif match := _DROP_TABLE.match(query):
+            self.tables.pop(match[1], None)
+        elif match := _SELECT.match(query):
+            names = [name.strip() for name in match[1].split(",")]
+            return [tuple(row[name] for name in names) for row in self.tables[match[2]]]
+
+        return []
+
+    @asynccontextmanager
+    async def cursor(self) -> AsyncIterator[FakeCursor]:
+        yield FakeCursor(self)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator["FakeClickHouse"]:
+        """
+        Замена djgram.db.clickhouse.connection
+        """
+        yield self
@@ -0,0 +1,146 @@
+import asyncio
+import importlib
+import math
+import runpy
+import sys
+import types
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+GENERAL_BLOCK = """DURATION\tinf\t5sec\t1min\t1hour
+uptime\t7199.051260
+rss\t{rss}KB
+active_requests\t{active}
+request_count\t{requests}\t1.0\t2.0\t3.0
+response_count\t{requests}\t1.0\t2.0\t3.0
+response_count_error\t{errors}\t0.0\t0.0\t0.0"""
+
+BOT_BLOCK = """id\t1111111111
+uptime\t7198.608074
+token\t1111111111:aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa
+username\tbot1
+pending_update_count\t{pending}
+active_request_count\t2
+request_count/sec\t{requests}\t0.5\t0.25\t0.125
+update_count/sec\t0.0\t0.0\t0.0\t0.0"""
+
+
+def make_stats(*, rss: int, active: int, requests: float, errors: float, pending: int) -> str:
+    general = GENERAL_BLOCK.format(rss=rss, active=active, requests=requests, errors=errors)
+    return f"{general}\n\n{BOT_BLOCK.format(pending=pending, requests=requests)}"
+
+
+@pytest.fixture(scope="module")
+def local_server() -> Iterator[types.ModuleType]:
+    # Модуль берёт адрес статистики из configs проекта
+    with pytest.MonkeyPatch.context() as patch:
+        project_configs = types.ModuleType("configs")
+        project_configs.TELEGRAM_LOCAL_SERVER_STATS_URL = "http://localhost:8082"  # pyright: ignore [reportAttributeAccessIssue]
+        patch.setitem(sys.modules, "configs", project_configs)
+        yield importlib.import_module("djgram.contrib.analytics.local_server")
+
+
+def test_parse_stats_rows_per_window(local_server: types.ModuleType):
+    general, bot = local_server.parse_stats(make_stats(rss=100, active=4, requests=8, errors=2, pending=3), (1, 3))
+
+    # По строке на каждое окно усреднения, значения без окон повторяются в каждой строке
+    assert [(row["duration"], row["request_count"]) for row in general] == [(0, 8), (60, 2.0)]
+    assert {row["rss"] for row in general} == {100 * 1024}
+    assert [(row["duration"], row["request_count_per_sec"]) for row in bot] == [(0, 8), (60, 0.25)]
+    assert all(row["id"] == 1111111111 and "token" not in row for row in bot)
+
+
+def test_parse_value(local_server: types.ModuleType):
+    assert local_server.parse_value("89400B") == 89400
+    assert local_server.parse_value("2MB") == 2 * 1024 * 1024
+    assert local_server.parse_value("1.5%") == 1.5
+    assert local_server.parse_value("UNKNOWN") == 0.0
+    assert local_server.parse_value("bot1") == "bot1"
+
+
+def test_collect_derived_metrics(local_server: types.ModuleType, monkeypatch: pytest.MonkeyPatch):
+    collector = local_server.LocalServerStatsCollector(average_indexes=(1,))
+    responses = iter(
+        [
+            make_stats(rss=100, active=4, requests=8, errors=2, pending=3),
+            make_stats(rss=110, active=4, requests=10, errors=0, pending=13),
+        ],
+    )
+    clock = iter([0.0, 0.5, 10.0, 10.5])
+
+    async def get_stats() -> str:
+        return next(responses)
+
+    monkeypatch.setattr(collector, "get_stats", get_stats)
+    monkeypatch.setattr(local_server.time, "perf_counter", lambda: next(clock))
+
+    ((general,), (bot,)) = asyncio.run(collector.collect())
+
+    # При первом сборе сравнивать не с чем
+    assert math.isnan(general["request_count_delta"])
+    assert math.isnan(general["rss_growth"])
+    assert math.isnan(bot["pending_update_count_growth"])
+    assert general["response_error_ratio"] == 0.25
+    # Закон Литтла: 4 выполняемых запроса при 8 запросах в секунду
+    assert general["active_request_time"] == 0.5
+    assert bot["active_request_time"] == 0.25
+    assert general["collection_time"] == 0.5
+
+    ((general,), (bot,)) = asyncio.run(collector.collect())
+
+    assert general["request_count_delta"] == 2
+    assert general["response_count_delta"] == 2
+    # Память выросла на 10KB за 10 секунд между сборами
+    assert general["rss_growth"] == 1024
+    assert general["response_error_ratio"] == 0
+    assert bot["request_count_per_sec_delta"] == 2
+    assert bot["update_count_per_sec_delta"] == 0
+    assert bot["pending_update_count_growth"] == 1
+
+
+def test_collect_and_save_writes_every_window(local_server: types.ModuleType, monkeypatch: pytest.MonkeyPatch):
+    collector = local_server.LocalServerStatsCollector()
+    written: list[tuple[str, dict[str, Any]]] = []
+
+    async def get_stats() -> str:
+        return make_stats(rss=100, active=4, requests=8, errors=2, pending=3)
+
+    monkeypatch.setattr(collector, "get_stats", get_stats)
+    monkeypatch.setattr(
+        local_server,
+        "write_analytics",
+        lambda table_name, row, **_kwargs: written.append((table_name, row)),
+    )
+
+    asyncio.run(collector.collect_and_save())
+
+    assert [table_name for table_name, _ in written] == [
+        *[local_server.ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_GENERAL_TABLE] * 4,
+        *[local_server.ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_BOT_TABLE] * 4,
+    ]
+    assert [row["duration"] for _, row in written[:4]] == [0, 5, 60, 3600]
+
+
+def load_configs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, project_configs: str) -> dict[str, Any]:
+    (tmp_path / "configs.py").write_text(project_configs, encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "configs", raising=False)
+    return runpy.run_path(str(ROOT / "configs.py"))
+
+
+def test_deprecated_average_index_setting(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    with pytest.warns(FutureWarning, match="ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX is deprecated"):
+        settings = load_configs(tmp_path, monkeypatch, "ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEX = 4\n")
+
+    assert settings["ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES"] == (4,)
+
+
+def test_invalid_average_indexes_setting(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    with pytest.raises(ValueError, match="AVERAGE_INDEXES"):
+        load_configs(tmp_path, monkeypatch, "ANALYTICS_TELEGRAM_LOCAL_SERVER_STATS_AVERAGE_INDEXES = (5,)\n")
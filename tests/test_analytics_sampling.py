@@ -0,0 +1,108 @@
+import asyncio
+import random
+
+import pytest
+from djgram.configs import ANALYTICS_SAMPLING_STATS_TABLE
+from djgram.contrib.analytics.sampling import SamplingPolicy
+from djgram.contrib.analytics.sinks import MemorySink
+from djgram.contrib.analytics.writer import AnalyticsWriter
+
+PRIORITIES = {"dialog": 0, "update": 1, "bot_send": 2}
+
+
+def test_key_rate_overrides_table_rate():
+    policy = SamplingPolicy(rates={"update": 0.5}, key_rates={"update": {"message": 1, "poll": 0}})
+
+    assert policy.get_rate("update") == 0.5
+    assert policy.get_rate("update", "message") == 1
+    assert policy.get_rate("update", "poll") == 0
+    assert policy.get_rate("update", "callback_query") == 0.5
+    assert policy.get_rate("other", "message") == 1
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError, match="high_water_mark"):
+        SamplingPolicy(high_water_mark=2)
+    with pytest.raises(ValueError, match="rates"):
+        SamplingPolicy(key_rates={"update": {"message": 1.5}})
+
+
+def test_sampled_share_matches_rate(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(random, "random", random.Random(42).random)  # noqa: S311
+    policy = SamplingPolicy(rates={"update": 0.1}, key_rates={"update": {"message": 0}})
+
+    sampled = sum(policy.sample("update") for _ in range(10_000))
+
+    assert sampled == pytest.approx(1000, rel=0.1)
+    assert not any(policy.sample("update", "message") for _ in range(1000))
+    assert all(policy.sample("dialog") for _ in range(1000))
+
+
+def test_shedding_thresholds_by_priority():
+    policy = SamplingPolicy(priorities=PRIORITIES, high_water_mark=0.5)
+
+    # Наименее важная таблица сбрасывается первой, следующая позже, таблица с приоритетом 0 никогда
+    assert policy.get_shedding_threshold("bot_send") == 0.5
+    assert policy.get_shedding_threshold("update") == 0.75
+    assert policy.get_shedding_threshold("dialog") == float("inf")
+    assert policy.get_shedding_threshold("unknown") == float("inf")
+
+    assert not policy.shed("bot_send", 0.49)
+    assert policy.shed("bot_send", 0.5)
+    assert not policy.shed("update", 0.7)
+    assert policy.shed("update", 0.8)
+    assert not policy.shed("dialog", 1)
+
+
+def test_writer_sheds_less_important_tables_as_queue_fills():
+    sink = MemorySink()
+    writer = AnalyticsWriter(
+        batch_size=1000,
+        flush_interval=3600,
+        max_queue_size=10,
+        policy=SamplingPolicy(priorities=PRIORITIES, high_water_mark=0.5),
+        stats_period=3600,
+        sink=sink,
+    )
+
+    def write_all() -> dict[str, bool]:
+        return {table_name: writer.write(table_name, {"id": 1}) for table_name in PRIORITIES}
+
+    async def main() -> list[dict[str, bool]]:
+        admitted = [write_all()]
+        # Очередь заполнена на 50%
+        for _ in range(2):
+            writer.write("dialog", {"id": 1})
+        admitted.append(write_all())
+        # Очередь заполнена на 70%
+        admitted.append(write_all())
+        # Очередь заполнена на 80%, строки важной таблицы занимают оставшееся место
+        for _ in range(2):
+            writer.write("dialog", {"id": 1})
+        # Очередь полна, строки важной таблицы больше некуда ставить
+        admitted.append(write_all())
+        await writer.close()
+        return admitted
+
+    admitted = asyncio.run(main())
+
+    assert admitted == [
+        {"dialog": True, "update": True, "bot_send": True},
+        {"dialog": True, "update": True, "bot_send": False},
+        {"dialog": True, "update": False, "bot_send": False},
+        {"dialog": False, "update": False, "bot_send": False},
+    ]
+    assert len(sink.get_rows("dialog")) == 7
+    assert len(sink.get_rows("update")) == 2
+    assert len(sink.get_rows("bot_send")) == 1
+
+    # Статистика позволяет пересчитать полные значения
+    stats = {row["table"]: row for row in sink.get_rows(ANALYTICS_SAMPLING_STATS_TABLE)}
+    assert {
+        table_name: (row["seen"], row["written"], row["shed"], row["dropped"]) for table_name, row in stats.items()
+    } == {
+        "dialog": (8, 7, 0, 1),
+        "update": (4, 2, 2, 0),
+        "bot_send": (4, 1, 3, 0),
+    }
+    assert stats["update"]["rate"] == 1
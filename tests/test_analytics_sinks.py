@@ -0,0 +1,97 @@
+import asyncio
+import gzip
+import zlib
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import orjson
+from djgram.contrib.analytics.sinks import PART_SUFFIX, FileSink, MemorySink, dump_ndjson
+
+DATE = datetime(2026, 1, 1, tzinfo=UTC)
+
+
+def columns(*values: int) -> dict[str, list[Any]]:
+    return {"id": list(values), "date": [DATE] * len(values), "event": [b'{"x": 1}'] * len(values)}
+
+
+def read_rows(path: Path) -> list[dict[str, Any]]:
+    data = path.read_bytes()
+    if path.name.endswith(f".gz{PART_SUFFIX}"):
+        # Файл, в который ещё идёт запись, не закончен, поэтому распаковывается потоково
+        data = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16).decompress(data)
+    elif path.name.endswith(".gz"):
+        data = gzip.decompress(data)
+    return [orjson.loads(line) for line in data.splitlines()]
+
+
+def test_dump_ndjson():
+    assert dump_ndjson(columns(1, 2)).splitlines() == [
+        b'{"id":1,"date":"2026-01-01T00:00:00+00:00","event":"{\\"x\\": 1}"}',
+        b'{"id":2,"date":"2026-01-01T00:00:00+00:00","event":"{\\"x\\": 1}"}',
+    ]
+
+
+def test_file_sink_rotates_and_seals_files(tmp_path: Path):
+    sink = FileSink(tmp_path, max_file_size=1, max_file_age=3600)
+
+    async def main() -> None:
+        await sink.write("update", columns(1, 2))
+        await sink.write("update", columns(3))
+        await sink.write("bot_send_analytics", columns(4))
+
+        # Файл больше max_file_size закрыт и переименован, в новый ещё идёт запись
+        update_files = sorted(path.name for path in (tmp_path / "update").iterdir())
+        assert len(update_files) == 2
+        assert not update_files[0].endswith(PART_SUFFIX)
+        assert update_files[1].endswith(f".ndjson.gz{PART_SUFFIX}")
+
+        # Записанный пакет читается до закрытия файла
+        part = tmp_path / "update" / update_files[1]
+        assert [row["id"] for row in read_rows(part)] == [3]
+
+        await sink.close()
+
+    asyncio.run(main())
+
+    paths = sorted(tmp_path.glob("*/*"))
+    assert all(path.name.endswith(".ndjson.gz") for path in paths)
+    assert [[row["id"] for row in read_rows(path)] for path in paths] == [[4], [1, 2], [3]]
+    assert read_rows(paths[1])[0] == {"id": 1, "date": "2026-01-01T00:00:00+00:00", "event": '{"x": 1}'}
+
+
+def test_file_sink_appends_until_limits_without_compression(tmp_path: Path):
+    sink = FileSink(tmp_path, compresslevel=None)
+
+    async def main() -> None:
+        for value in range(3):
+            await sink.write("update", columns(value))
+        await sink.close()
+
+    asyncio.run(main())
+
+    (path,) = (tmp_path / "update").iterdir()
+    assert path.name.endswith(".ndjson")
+    assert [row["id"] for row in read_rows(path)] == [0, 1, 2]
+
+
+def test_file_sink_rotates_by_age(tmp_path: Path):
+    sink = FileSink(tmp_path, max_file_age=0)
+
+    async def main() -> None:
+        await sink.write("update", columns(1))
+        await sink.write("update", columns(2))
+        await sink.close()
+
+    asyncio.run(main())
+
+    assert len(list((tmp_path / "update").iterdir())) == 2
+
+
+def test_memory_sink_keeps_last_rows():
+    sink = MemorySink(capacity=2)
+
+    asyncio.run(sink.write("update", columns(1, 2, 3)))
+
+    assert [row["id"] for row in sink.get_rows("update")] == [2, 3]
+    assert sink.get_rows("other") == []
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+from djgram.contrib.analytics.spill import SpillLog, SpillRecord, encode_record, read_records
+
+
+def columns(*values: int) -> dict[str, list]:
+    return {
+        "id": list(values),
+        "date": [datetime(2026, 1, 1, tzinfo=UTC)] * len(values),
+        "payload": [b"\x00\x01"] * len(values),
+    }
+
+
+def test_encode_record_roundtrip(tmp_path: Path):
+    path = tmp_path / "segment"
+    path.write_bytes(encode_record("update", columns(1, 2)) + encode_record("update", columns(3)))
+
+    records = list(read_records(path))
+
+    assert [record.columns for record, _ in records] == [columns(1, 2), columns(3)]
+    assert records[-1][1] == path.stat().st_size
+    # Одинаковые пакеты дают одинаковый ключ дедупликации, разные - разный
+    assert encode_record("update", columns(1)) == encode_record("update", columns(1))
+    assert records[0][0].token != records[1][0].token
+
+
+def test_read_records_skips_truncated_tail(tmp_path: Path):
+    path = tmp_path / "segment"
+    first = encode_record("update", columns(1))
+    path.write_bytes(first + encode_record("update", columns(2))[:-3])
+
+    assert [record.columns["id"] for record, _ in read_records(path)] == [[1]]
+    assert list(read_records(path, len(first))) == []
+
+
+def test_replay_in_order_and_removes_segments(tmp_path: Path):
+    spill = SpillLog(tmp_path, segment_size=1)
+    for value in range(3):
+        assert spill.append_sync("update", columns(value))
+
+    inserted: list[SpillRecord] = []
+
+    async def insert(record: SpillRecord) -> None:
+        inserted.append(record)
+
+    assert len(spill.get_segments()) == 3
+    assert asyncio.run(spill.replay(insert)) == 3
+    assert [record.columns["id"] for record in inserted] == [[0], [1], [2]]
+    assert spill.get_segments() == []
+    assert not spill.pending
+    assert spill.stats.replayed_records == 3
+
+
+def test_replay_resumes_after_failed_insert(tmp_path: Path):
+    spill = SpillLog(tmp_path)
+    for value in range(3):
+        spill.append_sync("update", columns(value))
+
+    inserted: list[int] = []
+
+    async def failing_insert(record: SpillRecord) -> None:
+        if record.columns["id"] == [1]:
+            raise ConnectionError
+        inserted.extend(record.columns["id"])
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(spill.replay(failing_insert))
+
+    assert inserted == [0]
+    assert spill.pending
+
+    async def insert(record: SpillRecord) -> None:
+        inserted.extend(record.columns["id"])
+
+    # Позиция сохранена после успешной записи, повторяется только упавшая
+    assert asyncio.run(SpillLog(tmp_path).replay(insert)) == 2
+    assert inserted == [0, 1, 2]
+
+
+def test_append_drops_over_max_size(tmp_path: Path):
+    spill = SpillLog(tmp_path, max_size=len(encode_record("update", columns(1))))
+
+    assert spill.append_sync("update", columns(1))
+    assert not spill.append_sync("update", columns(2))
+    assert spill.stats.dropped_rows == 1
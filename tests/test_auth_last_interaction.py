@@ -0,0 +1,103 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from djgram.contrib.auth import last_interaction
+from djgram.contrib.auth.last_interaction import LastInteractionWriter
+from djgram.contrib.auth.models import User
+from djgram.contrib.telegram.models import TelegramUser
+from djgram.db.models import Base
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+pytest.importorskip("aiosqlite")
+
+NOW = datetime(2026, 1, 1, tzinfo=UTC)
+USER_IDS = (1, 2, 3)
+
+
+async def create_engine(monkeypatch: pytest.MonkeyPatch, queries: list[str]) -> AsyncEngine:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(
+            lambda sync_connection: Base.metadata.create_all(
+                sync_connection,
+                tables=[TelegramUser.__table__, User.__table__],
+            ),
+        )
+
+    async with AsyncSession(engine) as session:
+        session.add_all(TelegramUser(id=user_id, is_bot=False, first_name="user") for user_id in USER_IDS)
+        await session.flush()
+        session.add_all(User(id=user_id, telegram_user_id=user_id, last_interaction=NOW) for user_id in USER_IDS)
+        await session.commit()
+
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def get_autocommit_session() -> AsyncIterator[AsyncSession]:
+        async with sessionmaker() as session, session.begin():
+            yield session
+
+    monkeypatch.setattr(last_interaction, "get_autocommit_session", get_autocommit_session)
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2].split()[0]))
+    return engine
+
+
+async def get_last_interactions(engine: AsyncEngine) -> dict[int, datetime]:
+    async with AsyncSession(engine) as session:
+        return {user.id: user.last_interaction.replace(tzinfo=UTC) for user in await session.scalars(select(User))}
+
+
+def test_flush_writes_latest_time_in_one_update(monkeypatch: pytest.MonkeyPatch):
+    queries: list[str] = []
+    writer = LastInteractionWriter(flush_interval=3600)
+
+    async def main() -> dict[int, datetime]:
+        engine = await create_engine(monkeypatch, queries)
+        writer.touch(1, NOW + timedelta(minutes=1))
+        writer.touch(1, NOW + timedelta(minutes=2))
+        writer.touch(2, NOW + timedelta(minutes=3))
+        # Более раннее время не затирает записанное другим процессом
+        writer.touch(3, NOW - timedelta(minutes=1))
+        assert len(writer) == 3
+
+        await writer.close()
+        assert queries == ["UPDATE"]
+        return await get_last_interactions(engine)
+
+    assert asyncio.run(main()) == {
+        1: NOW + timedelta(minutes=2),
+        2: NOW + timedelta(minutes=3),
+        3: NOW,
+    }
+    assert writer.coalesced == 1
+    assert writer.written == 3
+    assert len(writer) == 0
+
+
+def test_flush_requeues_failed_chunk(monkeypatch: pytest.MonkeyPatch):
+    writer = LastInteractionWriter(flush_interval=3600)
+
+    @asynccontextmanager
+    async def broken_session() -> AsyncIterator[AsyncSession]:
+        raise ConnectionError
+        yield
+
+    async def main() -> dict[int, datetime]:
+        engine = await create_engine(monkeypatch, [])
+        writer.touch(1, NOW + timedelta(minutes=1))
+        with monkeypatch.context() as patch:
+            patch.setattr(last_interaction, "get_autocommit_session", broken_session)
+            await writer.flush()
+
+        assert len(writer) == 1
+        assert writer.written == 0
+
+        await writer.close()
+        return await get_last_interactions(engine)
+
+    assert asyncio.run(main())[1] == NOW + timedelta(minutes=1)
+    assert writer.written == 1
@@ -0,0 +1,130 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from djgram.db import clickhouse
+from djgram.db.clickhouse import split_sql_statements
+from djgram.db.clickhouse_migrations import (
+    ClickHouseMigrator,
+    MigrationError,
+    MigrationLockedError,
+    get_migrations,
+    render_migration,
+)
+from fake_clickhouse import FakeClickHouse
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch) -> FakeClickHouse:
+    fake = FakeClickHouse()
+    monkeypatch.setattr(clickhouse, "connection", fake.connection)
+    return fake
+
+
+def write_migrations(directory: Path, **files: str) -> Path:
+    for name, sql in files.items():
+        (directory / name).write_text(sql, encoding="utf-8")
+    return directory
+
+
+def test_split_sql_statements():
+    sql = """
+    -- комментарий; с точкой с запятой
+    CREATE TABLE a (`x;y` String DEFAULT 'a;b');
+    /* блок; комментария */
+    INSERT INTO a VALUES ('--', "q;")  ;
+    -- только комментарий;
+    """
+    # Комментарии перед запросом остаются в нём, запрос только из комментариев отбрасывается
+    assert split_sql_statements(sql) == [
+        "-- комментарий; с точкой с запятой\n    CREATE TABLE a (`x;y` String DEFAULT 'a;b')",
+        "/* блок; комментария */\n    INSERT INTO a VALUES ('--', \"q;\")",
+    ]
+
+
+def test_get_migrations_order_and_errors(tmp_path: Path):
+    write_migrations(tmp_path, **{"0002_b.sql": "", "0001_a.sql": "", "0010_c.sql": ""})
+    assert [migration.version for migration in get_migrations(tmp_path)] == [1, 2, 10]
+
+    write_migrations(tmp_path, **{"0002_other.sql": ""})
+    with pytest.raises(MigrationError, match="same version"):
+        get_migrations(tmp_path)
+
+    (tmp_path / "0002_other.sql").unlink()
+    write_migrations(tmp_path, **{"wrong.sql": ""})
+    with pytest.raises(MigrationError, match="Wrong migration file name"):
+        get_migrations(tmp_path)
+
+
+def test_render_migration():
+    assert render_migration("TTL ${DAYS} DAY, $$x", {"DAYS": 7}) == "TTL 7 DAY, $x"
+    with pytest.raises(MigrationError, match="Unknown setting"):
+        render_migration("${MISSING}", {})
+
+
+def test_migrate_applies_pending_once(tmp_path: Path, server: FakeClickHouse):
+    write_migrations(
+        tmp_path,
+        **{
+            "0001_init.sql": "CREATE TABLE IF NOT EXISTS events (x Int64);",
+            "0002_ttl.sql": "ALTER TABLE events MODIFY TTL date + INTERVAL ${DAYS} DAY;",
+        },
+    )
+    migrator = ClickHouseMigrator(tmp_path, params={"DAYS": 30})
+
+    applied = asyncio.run(migrator.migrate(target=1))
+    assert [migration.version for migration in applied] == [1]
+
+    applied = asyncio.run(migrator.migrate())
+    assert [migration.version for migration in applied] == [2]
+    assert "ALTER TABLE events MODIFY TTL date + INTERVAL 30 DAY" in server.queries
+
+    assert asyncio.run(migrator.migrate()) == []
+    assert [row["version"] for row in server.tables["schema_migrations"]] == [1, 2]
+    # Замок снимается после применения
+    assert migrator.lock_table_name not in server.tables
+
+
+def test_migrate_is_locked_by_other_process(tmp_path: Path, server: FakeClickHouse):
+    write_migrations(tmp_path, **{"0001_init.sql": "CREATE TABLE IF NOT EXISTS events (x Int64);"})
+    migrator = ClickHouseMigrator(tmp_path, params={})
+    server.tables[migrator.lock_table_name] = [{"owner": "other:1", "locked_at": "2026-01-01"}]
+
+    with pytest.raises(MigrationLockedError, match="other:1"):
+        asyncio.run(migrator.migrate())
+    assert "events" not in server.tables
+    # Чужой замок не снимается
+    assert migrator.lock_table_name in server.tables
+
+    asyncio.run(migrator.unlock(server))  # pyright: ignore [reportArgumentType]
+    assert [migration.version for migration in asyncio.run(migrator.migrate())] == [1]
+
+
+def test_analytics_migrations_render():
+    from djgram.contrib.analytics.misc import MIGRATIONS_DIR
+    from djgram.db.clickhouse_migrations import get_migration_params
+
+    params = get_migration_params()
+    for migration in get_migrations(MIGRATIONS_DIR):
+        assert split_sql_statements(render_migration(migration.read(), params))
+
+
+def test_ensure_analytics_schema_applies_initial_migration(
+    server: FakeClickHouse,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+):
+    from djgram.contrib.analytics import schema
+
+    monkeypatch.setattr(schema, "_ensured", False)
+    asyncio.run(schema.ensure_analytics_schema())
+
+    # Начальная миграция применяется сразу, офлайн миграции только упоминаются в предупреждении
+    assert [row["version"] for row in server.tables["schema_migrations"]] == [schema.INITIAL_MIGRATION_VERSION]
+    assert {"update", "limiter_statistics", "analytics_sampling_statistics"} <= server.tables.keys()
+    assert "0002_update_layout.sql" in caplog.text
+
+    # При следующем запуске начальная миграция не применяется повторно
+    monkeypatch.setattr(schema, "_ensured", False)
+    asyncio.run(schema.ensure_analytics_schema())
+    assert [row["version"] for row in server.tables["schema_migrations"]] == [schema.INITIAL_MIGRATION_VERSION]
@@ -0,0 +1,105 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+
+import pytest
+from djgram.db.utils import ReturnState, insert_or_update, upsert_many
+from sqlalchemy import DateTime, String, event, func
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+aiosqlite = pytest.importorskip("aiosqlite")
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Item(Base):
+    __tablename__ = "item"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    code: Mapped[str] = mapped_column(String, unique=True)
+    name: Mapped[str] = mapped_column(String)
+    updated_at: Mapped[datetime | None] = mapped_column(DateTime, onupdate=func.now())
+
+
+def run(test: Callable[[AsyncSession, list[str]], Awaitable[None]]) -> None:
+    async def main() -> None:
+        engine = create_async_engine("sqlite+aiosqlite://")
+        queries: list[str] = []
+        event.listen(
+            engine.sync_engine,
+            "before_cursor_execute",
+            lambda *args: queries.append(args[2].split()[0]),
+        )
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            queries.clear()
+            await test(session, queries)
+
+        await engine.dispose()
+
+    asyncio.run(main())
+
+
+def test_upsert_many_states():
+    async def test(session: AsyncSession, queries: list[str]) -> None:
+        rows = [{"code": "a", "name": "A"}, {"code": "b", "name": "B"}]
+        results = await upsert_many(session, Item, rows, ["code"])
+        await session.commit()
+
+        assert [(item.name, state) for item, state in results] == [
+            ("A", ReturnState.CREATED),
+            ("B", ReturnState.CREATED),
+        ]
+        assert results[0][0].updated_at is None
+
+        rows = [{"code": "a", "name": "A"}, {"code": "b", "name": "BB"}, {"code": "c", "name": "C"}]
+        results = await upsert_many(session, Item, rows, ["code"])
+        await session.commit()
+
+        assert [(item.name, state) for item, state in results] == [
+            ("A", ReturnState.NOT_MODIFIED),
+            ("BB", ReturnState.UPDATED),
+            ("C", ReturnState.CREATED),
+        ]
+        # onupdate значения проставляются при изменении
+        assert results[0][0].updated_at is None
+        assert results[1][0].updated_at is not None
+        assert "INSERT" in queries
+        assert "UPDATE" in queries
+
+    run(test)
+
+
+def test_upsert_many_validates_rows():
+    async def test(session: AsyncSession, queries: list[str]) -> None:
+        assert await upsert_many(session, Item, [], ["code"]) == []
+
+        with pytest.raises(ValueError, match="same fields"):
+            await upsert_many(session, Item, [{"code": "a", "name": "A"}, {"code": "b"}], ["code"])
+
+        with pytest.raises(ValueError, match="duplicate keys"):
+            await upsert_many(session, Item, [{"code": "a", "name": "A"}, {"code": "a", "name": "B"}], ["code"])
+
+        assert queries == []
+
+    run(test)
+
+
+def test_insert_or_update():
+    async def test(session: AsyncSession, queries: list[str]) -> None:
+        item, state = await insert_or_update(session, Item, {"code": "a"}, {"name": "A"})
+        assert state == ReturnState.CREATED
+
+        queries.clear()
+        same, state = await insert_or_update(session, Item, {"code": "a"}, {"name": "A"})
+        assert state == ReturnState.NOT_MODIFIED
+        assert same.id == item.id
+        # Без изменений достаточно одного запроса
+        assert queries == ["SELECT"]
+
+    run(test)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from djgram.contrib.limits.adaptive import (
+    DEFAULT_CEILING_FACTOR,
+    AdaptiveRateControl,
+    AIMDController,
+    get_default_controllers,
+)
+from djgram.contrib.limits.backoff import CHAT_SCOPE_KIND, GLOBAL_SCOPE_KIND, GROUP_SCOPE_KIND
+from djgram.contrib.limits.constants import (
+    MAX_MESSAGES_PER_GROUP_PER_SECOND,
+    MAX_MESSAGES_PER_SECOND,
+    MAX_MESSAGES_PER_USER_PER_SECOND,
+)
+from djgram.contrib.limits.gcra import GCRAStore
+from djgram.contrib.limits.limiter import LimitCaller
+
+
+def make_controller(**kwargs) -> AIMDController:
+    return AIMDController(**{"rate": 5, "floor": 1, "ceiling": 10, "increase": 1, **kwargs})
+
+
+def test_increase_only_after_wait():
+    controller = make_controller()
+
+    # Запрос прошёл без ожидания, скорость не ограничивала нагрузку
+    assert not controller.on_success(0, wait=0)
+    assert not controller.on_success(1, wait=0.01)
+    assert controller.rate == 5
+
+    assert controller.on_success(2, wait=0.1)
+    assert controller.rate == 6
+    # Не чаще раза в increase_period
+    assert not controller.on_success(2.5, wait=0.1)
+    assert controller.on_success(3, wait=0.1)
+    assert controller.rate == 7
+
+
+def test_increase_stops_at_ceiling():
+    controller = make_controller(rate=9.5)
+
+    assert controller.on_success(0, wait=1)
+    assert controller.rate == 10
+    assert not controller.on_success(1, wait=1)
+    assert controller.increases == 1
+
+
+def test_single_chat_does_not_increase_kind_rate():
+    controller = make_controller(min_keys=3)
+
+    for now in range(10):
+        assert not controller.on_success(now, wait=1, key=1)
+    assert controller.rate == 5
+
+    assert not controller.on_success(9.5, wait=1, key=2)
+    assert controller.on_success(9.6, wait=1, key=3)
+    assert controller.rate == 6
+
+
+def test_keys_expire_after_period():
+    controller = make_controller(min_keys=2)
+
+    assert not controller.on_success(0, wait=1, key=1)
+    assert not controller.on_success(1.5, wait=1, key=2)
+    assert controller.on_success(1.6, wait=1, key=1)
+
+
+def test_decrease_with_cooldown_and_floor():
+    controller = make_controller(rate=4)
+
+    assert controller.on_retry_after(0)
+    assert controller.rate == 2
+    # Ошибки от запросов со старой скоростью игнорируются
+    assert not controller.on_retry_after(0.5)
+    assert controller.on_retry_after(1)
+    assert controller.rate == 1
+    assert not controller.on_retry_after(2)
+    assert controller.rate == 1
+    # После уменьшения скорость не растёт целый период
+    assert not controller.on_success(2.5, wait=1)
+    assert controller.on_success(3, wait=1)
+
+
+def test_invalid_controller():
+    with pytest.raises(ValueError, match="floor"):
+        make_controller(floor=20)
+    with pytest.raises(ValueError, match="decrease_factor"):
+        make_controller(decrease_factor=1)
+    with pytest.raises(ValueError, match="min_keys"):
+        make_controller(min_keys=0)
+
+
+def test_default_controllers_can_exceed_documented_limits():
+    controllers = get_default_controllers()
+
+    for kind, documented in (
+        (GLOBAL_SCOPE_KIND, MAX_MESSAGES_PER_SECOND),
+        (CHAT_SCOPE_KIND, MAX_MESSAGES_PER_USER_PER_SECOND),
+        (GROUP_SCOPE_KIND, MAX_MESSAGES_PER_GROUP_PER_SECOND),
+    ):
+        assert controllers[kind].rate == controllers[kind].floor == documented
+        assert controllers[kind].ceiling == documented * DEFAULT_CEILING_FACTOR
+    assert controllers[CHAT_SCOPE_KIND].min_keys > 1
+
+
+def test_control_applies_rate_and_saves(tmp_path: Path):
+    state_path = tmp_path / "rates.json"
+    control = AdaptiveRateControl({"chat": make_controller()}, state_path=state_path, save_period=0)
+    store = GCRAStore(1)
+    control.bind("chat", store)
+    assert store.rate == 5
+
+    control.on_retry_after("chat")
+    assert store.rate == 2.5
+    assert json.loads(state_path.read_text()) == {"chat": 2.5}
+
+    # Скорость восстанавливается из файла с учётом рамок контроллера
+    state_path.write_text(json.dumps({"chat": 100, "unknown": 1}))
+    assert AdaptiveRateControl({"chat": make_controller()}, state_path=state_path).rates == {"chat": 10}
+    assert [path.name for path in tmp_path.iterdir()] == ["rates.json"]
+
+
+def test_control_saves_in_thread_inside_event_loop(tmp_path: Path):
+    state_path = tmp_path / "rates.json"
+    control = AdaptiveRateControl({"chat": make_controller()}, state_path=state_path, save_period=0)
+
+    async def main() -> None:
+        control.on_retry_after("chat")
+        # Файл записывается в фоне, а не прямо в обработчике
+        assert not state_path.exists()
+        await asyncio.gather(*control._save_tasks)
+
+    asyncio.run(main())
+
+    assert json.loads(state_path.read_text()) == {"chat": 2.5}
+    assert [path.name for path in tmp_path.iterdir()] == ["rates.json"]
+
+
+def test_limit_caller_does_not_grow_without_wait():
+    adaptive = AdaptiveRateControl(
+        {
+            GLOBAL_SCOPE_KIND: make_controller(rate=1000, ceiling=2000, increase=100),
+            CHAT_SCOPE_KIND: make_controller(increase_period=0),
+        },
+    )
+    caller = LimitCaller(adaptive=adaptive)
+
+    async def request() -> int:
+        return 1
+
+    async def main() -> None:
+        # Каждый запрос в свой чат, лимиты чатов не ждут
+        for chat_id in range(1, 4):
+            assert await caller.call(chat_id, request()) == 1
+
+    asyncio.run(main())
+
+    assert adaptive.rates == {GLOBAL_SCOPE_KIND: 1000, CHAT_SCOPE_KIND: 5}
+
+
+def test_limit_caller_grows_when_chat_waits():
+    adaptive = AdaptiveRateControl({CHAT_SCOPE_KIND: make_controller(rate=20, ceiling=30, increase_period=0)})
+    caller = LimitCaller(adaptive=adaptive)
+
+    async def request() -> None:
+        return None
+
+    async def main() -> None:
+        # Запас лимита чата 3 запроса, четвёртый ждёт
+        for _ in range(4):
+            await caller.call(1, request())
+
+    asyncio.run(main())
+
+    assert adaptive.rates == {CHAT_SCOPE_KIND: 21}
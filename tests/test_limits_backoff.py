@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+from djgram.contrib.limits import backoff
+from djgram.contrib.limits.backoff import (
+    CHAT_SCOPE_KIND,
+    GLOBAL_SCOPE,
+    GLOBAL_SCOPE_KIND,
+    GROUP_SCOPE_KIND,
+    RetryAfterBackoff,
+    Scope,
+    get_chat_scope,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(backoff.time, "monotonic", clock)
+    monkeypatch.setattr(backoff.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def wait(backoff_: RetryAfterBackoff, scope: Scope) -> None:
+    asyncio.run(backoff_.wait(scope))
+
+
+def test_get_chat_scope():
+    assert get_chat_scope(None) == GLOBAL_SCOPE
+    assert get_chat_scope(1) == (CHAT_SCOPE_KIND, 1)
+    assert get_chat_scope(-100) == (GROUP_SCOPE_KIND, -100)
+    assert get_chat_scope("@channel") == (GROUP_SCOPE_KIND, "@channel")
+
+
+def test_wait_only_in_parked_scope(clock: Clock):
+    retry_after = RetryAfterBackoff(sleep_gap=0.1)
+
+    assert retry_after.park(get_chat_scope(1), 5) == get_chat_scope(1)
+
+    # Другие чаты не ждут
+    wait(retry_after, get_chat_scope(2))
+    assert clock.sleeps == []
+
+    wait(retry_after, get_chat_scope(1))
+    assert clock.sleeps == pytest.approx([5.1])
+
+    # После окончания ожидания чат снова не ждёт
+    wait(retry_after, get_chat_scope(1))
+    assert clock.sleeps == pytest.approx([5.1])
+
+
+def test_later_deadline_wins(clock: Clock):
+    retry_after = RetryAfterBackoff(sleep_gap=0)
+    scope = get_chat_scope(1)
+
+    retry_after.park(scope, 10)
+    retry_after.park(scope, 2)
+    wait(retry_after, scope)
+
+    assert clock.sleeps == pytest.approx([10])
+
+
+def test_wait_is_extended_while_sleeping(clock: Clock, monkeypatch: pytest.MonkeyPatch):
+    retry_after = RetryAfterBackoff(sleep_gap=0)
+    scope = get_chat_scope(1)
+    retry_after.park(scope, 1)
+
+    async def sleep(delay: float) -> None:
+        await clock.sleep(delay)
+        # Во время ожидания пришла ещё одна ошибка
+        if len(clock.sleeps) == 1:
+            retry_after.park(scope, 3)
+
+    monkeypatch.setattr(backoff.asyncio, "sleep", sleep)
+    wait(retry_after, scope)
+
+    assert clock.sleeps == pytest.approx([1, 3])
+    stats = retry_after.stats[CHAT_SCOPE_KIND]
+    assert stats.parked_requests == 1
+    assert stats.parked_seconds == pytest.approx(4)
+
+
+def test_escalate_to_global_after_three_scopes(clock: Clock):
+    retry_after = RetryAfterBackoff(sleep_gap=0)
+
+    assert retry_after.park(get_chat_scope(1), 5) == get_chat_scope(1)
+    clock.now += 0.4
+    assert retry_after.park(get_chat_scope(-2), 5) == get_chat_scope(-2)
+    clock.now += 0.4
+    # Повторная ошибка той же области не считается новой областью
+    assert retry_after.park(get_chat_scope(1), 5) == get_chat_scope(1)
+    assert retry_after.park(get_chat_scope(3), 5) == GLOBAL_SCOPE
+
+    # Теперь ждут все, включая чаты без ошибок
+    wait(retry_after, get_chat_scope(4))
+    assert clock.sleeps == pytest.approx([5])
+    assert retry_after.stats[GLOBAL_SCOPE_KIND].parked_requests == 1
+    # Ошибки учитываются по области, в которой они пришли
+    assert retry_after.stats[CHAT_SCOPE_KIND].retry_after_events == 3
+    assert retry_after.stats[GROUP_SCOPE_KIND].retry_after_events == 1
+
+
+def test_no_escalation_outside_window(clock: Clock):
+    retry_after = RetryAfterBackoff(sleep_gap=0)
+
+    for chat_id in range(1, 4):
+        assert retry_after.park(get_chat_scope(chat_id), 1) == get_chat_scope(chat_id)
+        clock.now += 0.6
+
+    wait(retry_after, get_chat_scope(4))
+    assert clock.sleeps == []
+
+
+def test_escalation_disabled(clock: Clock):
+    retry_after = RetryAfterBackoff(global_escalation_threshold=0)
+
+    for chat_id in range(1, 10):
+        assert retry_after.park(get_chat_scope(chat_id), 1) == get_chat_scope(chat_id)
+
+
+def test_global_park_blocks_every_scope(clock: Clock):
+    retry_after = RetryAfterBackoff(sleep_gap=0)
+
+    assert retry_after.park(GLOBAL_SCOPE, 2) == GLOBAL_SCOPE
+    retry_after.park(get_chat_scope(1), 5)
+
+    # Ожидание определяет самая поздняя из областей чата и глобальной
+    wait(retry_after, get_chat_scope(2))
+    wait(retry_after, get_chat_scope(1))
+    assert clock.sleeps == pytest.approx([2, 3])
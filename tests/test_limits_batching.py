@@ -0,0 +1,167 @@
+import asyncio
+from typing import Any
+
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError
+from aiogram.methods import (
+    CopyMessage,
+    CopyMessages,
+    DeleteMessage,
+    DeleteMessages,
+    SendMessage,
+    TelegramMethod,
+)
+from aiogram.types import MessageId
+from djgram.contrib.limits.batching import BatchResultMismatchError, MethodBatcher, split_ascending
+
+CHAT_ID = 1
+TARGET_CHAT_ID = 2
+
+
+class FakeApi:
+    def __init__(
+        self,
+        missing: frozenset[int] = frozenset(),
+        *,
+        fail_delete: bool = False,
+        batch_error: Exception | None = None,
+    ):
+        self.calls: list[tuple[TelegramMethod[Any], int | None]] = []
+        self.missing = missing
+        self.fail_delete = fail_delete
+        self.batch_error = batch_error
+        self._next_id = 100
+
+    def _copy(self, message_id: int) -> MessageId:
+        if message_id in self.missing:
+            raise TelegramBadRequest(CopyMessage, "message to copy not found")
+        self._next_id += 1
+        return MessageId(message_id=self._next_id)
+
+    async def __call__(self, bot: Bot, method: TelegramMethod[Any], request_timeout: int | None = None) -> Any:
+        self.calls.append((method, request_timeout))
+        await asyncio.sleep(0)
+        if isinstance(method, CopyMessages):
+            if self.batch_error is not None:
+                raise self.batch_error
+            return [self._copy(message_id) for message_id in method.message_ids if message_id not in self.missing]
+        if isinstance(method, CopyMessage):
+            return self._copy(method.message_id)
+        if isinstance(method, DeleteMessages) and self.fail_delete:
+            raise TelegramBadRequest(method, "message can't be deleted")
+        if isinstance(method, SendMessage):
+            return method.text
+        return True
+
+
+@pytest.fixture
+def bot() -> Bot:
+    return Bot("42:TEST")
+
+
+def copy(message_id: int) -> CopyMessage:
+    return CopyMessage(chat_id=TARGET_CHAT_ID, from_chat_id=CHAT_ID, message_id=message_id)
+
+
+async def call_all(batcher: MethodBatcher, bot: Bot, *calls: tuple[TelegramMethod[Any], int | None]) -> list[Any]:
+    return await asyncio.gather(
+        *(batcher.call(bot, method, request_timeout) for method, request_timeout in calls),
+        return_exceptions=True,
+    )
+
+
+def test_split_ascending():
+    assert split_ascending([3, 5, 4, 7, 1]) == [[3, 5], [4, 7], [1]]
+    assert split_ascending([]) == []
+
+
+def test_copies_are_batched_in_call_order(bot: Bot):
+    api = FakeApi()
+    batcher = MethodBatcher(api)
+
+    results = asyncio.run(call_all(batcher, bot, (copy(1), None), (copy(3), None), (copy(2), None)))
+
+    # Копии созданы в порядке вызовов, каждый получил свою
+    assert [type(method) for method, _ in api.calls] == [CopyMessages, CopyMessage]
+    assert api.calls[0][0].message_ids == [1, 3]
+    assert [result.message_id for result in results] == [101, 102, 103]
+    assert batcher.sent_batches == 1
+    assert batcher.batched_calls == 2
+
+
+def test_batch_uses_max_request_timeout(bot: Bot):
+    api = FakeApi()
+    batcher = MethodBatcher(api)
+
+    asyncio.run(call_all(batcher, bot, (copy(1), 10), (copy(2), 30), (copy(3), None)))
+    assert api.calls[0][1] == bot.session.timeout
+
+    api.calls.clear()
+    asyncio.run(call_all(batcher, bot, (copy(1), 10), (copy(2), 30)))
+    assert api.calls[0][1] == 30
+
+
+def test_partial_copy_is_retried_one_by_one(bot: Bot):
+    api = FakeApi(missing=frozenset({2}))
+    batcher = MethodBatcher(api)
+
+    results = asyncio.run(call_all(batcher, bot, (copy(1), None), (copy(2), None), (copy(3), None)))
+
+    # Копии из пакета удалены, каждое сообщение скопировано отдельно
+    assert isinstance(api.calls[1][0], DeleteMessages)
+    assert api.calls[1][0].message_ids == [101, 102]
+    assert results[0] == MessageId(message_id=103)
+    assert isinstance(results[1], TelegramBadRequest)
+    assert results[2] == MessageId(message_id=104)
+
+
+def test_partial_copy_without_rollback(bot: Bot):
+    api = FakeApi(missing=frozenset({2}), fail_delete=True)
+    batcher = MethodBatcher(api)
+
+    results = asyncio.run(call_all(batcher, bot, (copy(1), None), (copy(2), None)))
+
+    assert all(isinstance(result, BatchResultMismatchError) for result in results)
+    assert isinstance(results[0].__cause__, TelegramBadRequest)
+
+
+def test_rejected_batch_is_sent_one_by_one(bot: Bot):
+    api = FakeApi(batch_error=TelegramBadRequest(CopyMessages, "message to copy not found"))
+    batcher = MethodBatcher(api)
+
+    results = asyncio.run(call_all(batcher, bot, (copy(1), None), (copy(2), None)))
+
+    assert [type(method) for method, _ in api.calls] == [CopyMessages, CopyMessage, CopyMessage]
+    assert results == [MessageId(message_id=101), MessageId(message_id=102)]
+
+
+def test_network_error_is_not_resent(bot: Bot):
+    error = TelegramNetworkError(CopyMessages, "timeout")
+    api = FakeApi(batch_error=error)
+    batcher = MethodBatcher(api)
+
+    results = asyncio.run(call_all(batcher, bot, (copy(1), None), (copy(2), None)))
+
+    # Пакет мог выполниться, поэтому сообщения не копируются повторно
+    assert [type(method) for method, _ in api.calls] == [CopyMessages]
+    assert results == [error, error]
+
+
+def test_deletes_are_batched(bot: Bot):
+    api = FakeApi()
+    batcher = MethodBatcher(api)
+
+    results = asyncio.run(
+        call_all(
+            batcher,
+            bot,
+            (DeleteMessage(chat_id=CHAT_ID, message_id=2), None),
+            (DeleteMessage(chat_id=CHAT_ID, message_id=1), None),
+            (SendMessage(chat_id=CHAT_ID, text="text"), None),
+        ),
+    )
+
+    assert results == [True, True, "text"]
+    assert [type(method) for method, _ in api.calls] == [SendMessage, DeleteMessages]
+    assert api.calls[1][0].message_ids == [1, 2]
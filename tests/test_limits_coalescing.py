@@ -0,0 +1,110 @@
+import asyncio
+from typing import Any
+
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageCaption, EditMessageReplyMarkup, EditMessageText, SendMessage, TelegramMethod
+from djgram.contrib.limits.coalescing import EditCoalescer
+
+CHAT_ID = 1
+
+
+class FakeApi:
+    def __init__(self):
+        self.calls: list[TelegramMethod[Any]] = []
+
+    async def __call__(self, bot: Bot, method: TelegramMethod[Any], request_timeout: int | None = None) -> Any:
+        self.calls.append(method)
+        await asyncio.sleep(0)
+        if isinstance(method, EditMessageText) and method.text == "same":
+            raise TelegramBadRequest(method, "Bad Request: message is not modified")
+        if isinstance(method, SendMessage | EditMessageText):
+            return method.text
+        return True
+
+
+@pytest.fixture
+def bot() -> Bot:
+    return Bot("42:TEST")
+
+
+def edit(text: str, message_id: int = 1) -> EditMessageText:
+    return EditMessageText(chat_id=CHAT_ID, message_id=message_id, text=text)
+
+
+def markup() -> EditMessageReplyMarkup:
+    return EditMessageReplyMarkup(chat_id=CHAT_ID, message_id=1)
+
+
+def describe(method: TelegramMethod[Any]) -> str:
+    return getattr(method, "text", None) or type(method).__name__
+
+
+def test_edits_are_coalesced(bot: Bot):
+    api = FakeApi()
+    coalescer = EditCoalescer(api)
+
+    async def main() -> list[Any]:
+        return await asyncio.gather(
+            coalescer.call(bot, edit("first")),
+            coalescer.call(bot, edit("second")),
+            coalescer.call(bot, edit("third")),
+            coalescer.call(bot, markup()),
+        )
+
+    results = asyncio.run(main())
+
+    # Отправлено только последнее изменение текста, клавиатура меняется после него
+    assert [describe(method) for method in api.calls] == ["third", "EditMessageReplyMarkup"]
+    assert results == ["third", "third", "third", True]
+    assert coalescer.coalesced == 2
+
+
+def test_queued_edit_is_replaced_only_by_same_type(bot: Bot):
+    api = FakeApi()
+    coalescer = EditCoalescer(api)
+
+    async def main() -> list[Any]:
+        return await asyncio.gather(
+            coalescer.call(bot, edit("first")),
+            coalescer.call(bot, markup()),
+            coalescer.call(bot, edit("second")),
+            coalescer.call(bot, edit("third")),
+            coalescer.call(bot, EditMessageCaption(chat_id=CHAT_ID, message_id=1, caption="caption")),
+            coalescer.call(bot, markup()),
+        )
+
+    results = asyncio.run(main())
+
+    # Изменения разных видов идут по порядку, заменяется только последнее изменение того же вида
+    assert [describe(method) for method in api.calls] == [
+        "first",
+        "EditMessageReplyMarkup",
+        "third",
+        "EditMessageCaption",
+        "EditMessageReplyMarkup",
+    ]
+    assert results == ["first", True, "third", "third", True, True]
+    assert coalescer.coalesced == 1
+
+
+def test_edits_of_different_messages_are_not_coalesced(bot: Bot):
+    api = FakeApi()
+    coalescer = EditCoalescer(api)
+
+    async def main() -> list[Any]:
+        return await asyncio.gather(
+            coalescer.call(bot, edit("first", message_id=1)),
+            coalescer.call(bot, edit("second", message_id=2)),
+            coalescer.call(bot, SendMessage(chat_id=CHAT_ID, text="text")),
+        )
+
+    assert asyncio.run(main()) == ["first", "second", "text"]
+    assert coalescer.coalesced == 0
+
+
+def test_not_modified_is_ignored(bot: Bot):
+    coalescer = EditCoalescer(FakeApi())
+
+    assert asyncio.run(coalescer.call(bot, edit("same"))) is True
@@ -0,0 +1,76 @@
+import pytest
+from djgram.contrib.limits import gcra
+from djgram.contrib.limits.gcra import GCRALimiter, GCRAStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(gcra.time, "monotonic", clock)
+    return clock
+
+
+def test_store_burst_then_rate(clock: Clock):
+    store = GCRAStore(rate=10, burst=3)
+
+    delays = [store.reserve("chat") for _ in range(5)]
+
+    # Первые burst запросов проходят сразу, следующие через интервал 1 / rate
+    assert delays == pytest.approx([0, 0, 0, 0.1, 0.2])
+    # Другие чаты не ограничиваются
+    assert store.reserve("other") == 0
+
+
+def test_store_cost_and_recovery(clock: Clock):
+    store = GCRAStore(rate=2, burst=1)
+
+    assert store.reserve("chat", cost=3) == pytest.approx(1)
+    clock.now += 1.5
+    assert store.reserve("chat") == pytest.approx(0)
+    assert "chat" in store
+
+    clock.now += 1
+    assert "chat" not in store
+
+
+def test_store_sweep(clock: Clock):
+    store = GCRAStore(rate=1, sweep_period=10)
+    store.reserve("old")
+    clock.now += 5
+    store.reserve("new")
+    assert len(store) == 2
+
+    # Запись old устарела и удаляется при следующем обращении после sweep_period
+    clock.now += 5
+    store.reserve("new")
+    assert len(store) == 1
+
+
+def test_rate_change(clock: Clock):
+    store = GCRAStore(rate=1)
+    store.rate = 4
+    store.reserve("chat")
+    assert store.reserve("chat") == pytest.approx(0.25)
+
+    with pytest.raises(ValueError, match="rate"):
+        store.rate = 0
+    with pytest.raises(ValueError, match="burst"):
+        GCRAStore(rate=1, burst=0)
+
+
+def test_limiter(clock: Clock):
+    limiter = GCRALimiter(rate=30, burst=3)
+
+    assert [limiter.reserve() for _ in range(4)] == pytest.approx([0, 0, 0, 1 / 30])
+    assert limiter.reserve(tokens=3) == pytest.approx(4 / 30)
+
+    clock.now += 10
+    assert limiter.reserve() == 0
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Any
+
+import pytest
+from aiogram import Bot
+from aiogram.methods import GetChat, GetMe, SendMediaGroup, SendMessage, TelegramMethod
+from aiogram.types import InputMediaPhoto
+from djgram.contrib.limits import limiter, methods
+from djgram.contrib.limits.methods import get_method_chat_id, get_method_cost, register_method_cost
+
+
+@pytest.fixture(autouse=True)
+def method_costs(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(methods, "_method_costs", dict(methods._method_costs))
+
+
+def test_method_costs():
+    media = [InputMediaPhoto(media="photo")] * 3
+
+    assert get_method_cost(SendMessage(chat_id=1, text="text")) == methods.DEFAULT_METHOD_COST
+    assert get_method_cost(SendMediaGroup(chat_id=1, media=media)) == 3
+    # Получение информации и методы без чата не ограничиваются
+    assert get_method_cost(GetChat(chat_id=1)) == 0
+    assert get_method_cost(GetMe()) == 0
+
+
+def test_register_method_cost():
+    register_method_cost(SendMessage, 2)
+    register_method_cost(GetMe, lambda _: -1)
+
+    assert get_method_cost(SendMessage(chat_id=1, text="text")) == 2
+    assert get_method_cost(GetMe()) == 0
+
+    with pytest.raises(ValueError, match="cost"):
+        register_method_cost(SendMessage, -1)
+
+
+def test_get_method_chat_id():
+    assert get_method_chat_id(SendMessage(chat_id="@channel", text="text")) == "@channel"
+    assert get_method_chat_id(GetMe()) is None
+
+
+def test_limited_bot_after_patch(monkeypatch: pytest.MonkeyPatch):
+    sent: list[TelegramMethod[Any]] = []
+
+    async def original_call(self: Bot, method: TelegramMethod[Any], request_timeout: int | None = None) -> str:
+        sent.append(method)
+        return "ok"
+
+    monkeypatch.setattr(Bot, "__call__", original_call)
+    monkeypatch.setattr(Bot, "__original__call__", None, raising=False)
+    limiter.patch_bot_with_limiter()
+
+    # LimitedBot не должен вызывать сам себя через подменённый Bot.__call__
+    bot = limiter.LimitedBot("42:TEST", limiter.LimitCaller())
+    method = SendMessage(chat_id=1, text="text")
+
+    assert asyncio.run(bot(method)) == "ok"
+    assert asyncio.run(Bot("42:TEST")(method)) == "ok"
+    assert sent == [method, method]
@@ -0,0 +1,111 @@
+import asyncio
+import re
+from typing import Any
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage, TelegramMethod
+from djgram.configs import ANALYTICS_LIMITER_STATS_TABLE
+from djgram.contrib.analytics import limiter_analytics
+from djgram.contrib.analytics.limiter_analytics import LimiterStatsCollector
+from djgram.contrib.analytics.misc import MIGRATIONS_DIR
+from djgram.contrib.limits.backoff import CHAT_SCOPE_KIND, GLOBAL_SCOPE_KIND, GROUP_SCOPE_KIND, RetryAfterBackoff
+from djgram.contrib.limits.limiter import LimitCaller, LimitedBot
+from djgram.contrib.limits.metrics import DEFAULT_WAIT_TIME_BUCKETS, WaitHistogram
+
+_COLUMN = re.compile(r"^\s*`(\w+)`", re.MULTILINE)
+
+
+def get_table_columns(table_name: str) -> set[str]:
+    sql = (MIGRATIONS_DIR / "0001_initial.sql").read_text(encoding="utf-8")
+    match = re.search(rf"CREATE TABLE IF NOT EXISTS {table_name}\s*\((.+?)\)\s*ENGINE", sql, re.DOTALL)
+    assert match is not None
+    return set(_COLUMN.findall(match[1]))
+
+
+def test_wait_histogram():
+    histogram = WaitHistogram((0.1, 1))
+    before = histogram.copy()
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.total == pytest.approx(5.65)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1
+    assert histogram.quantile(1) == float("inf")
+    assert WaitHistogram().quantile(0.5) == 0
+
+    # Разница двух снимков - наблюдения за период между ними
+    histogram.observe(0.5)
+    period = histogram - before
+    assert period.counts == [2, 2, 1]
+    assert period.count == 5
+    assert before.count == 0
+
+
+def test_limit_caller_metrics_are_exported(monkeypatch: pytest.MonkeyPatch):
+    caller = LimitCaller(max_retries=1, backoff=RetryAfterBackoff(sleep_gap=0.01))
+    bot = LimitedBot("42:TEST", caller)
+    flood_control = [True]
+
+    async def original_call(method: TelegramMethod[Any], request_timeout: int | None = None) -> bool:
+        if isinstance(method, SendMessage) and method.chat_id == 1 and flood_control:
+            flood_control.pop()
+            raise TelegramRetryAfter(method, "Flood control exceeded", 0)
+        return True
+
+    monkeypatch.setattr(bot, "__original__call__", original_call)
+    written: list[tuple[str, dict[str, Any]]] = []
+    monkeypatch.setattr(
+        limiter_analytics,
+        "write_analytics",
+        lambda table_name, row, **_kwargs: written.append((table_name, row)),
+    )
+    collector = LimiterStatsCollector(42, caller)
+
+    async def main() -> None:
+        await bot(SendMessage(chat_id=1, text="text"))
+        await bot(SendMessage(chat_id=-100, text="text"))
+        # Бесплатные методы не проходят через лимитер
+        await bot(GetMe())
+
+    asyncio.run(main())
+
+    snapshot = caller.get_metrics()
+    # Запрос, получивший ошибку flood control, тоже учитывается
+    assert (snapshot.calls, snapshot.tokens, snapshot.in_flight, snapshot.queued) == (3, 3, 0, 0)
+    assert {kind: histogram.count for kind, histogram in snapshot.wait_time.items()} == {
+        CHAT_SCOPE_KIND: 2,
+        GROUP_SCOPE_KIND: 1,
+        GLOBAL_SCOPE_KIND: 3,
+    }
+    assert snapshot.retry_after_events == {CHAT_SCOPE_KIND: 1}
+    assert snapshot.parked_requests == {CHAT_SCOPE_KIND: 1}
+    assert snapshot.parked_seconds[CHAT_SCOPE_KIND] >= 0.01
+    assert snapshot.rates == {}
+
+    asyncio.run(collector.collect_and_save())
+
+    rows = {row["kind"]: row for _, row in written}
+    assert {table_name for table_name, _ in written} == {ANALYTICS_LIMITER_STATS_TABLE}
+    assert list(rows) == [CHAT_SCOPE_KIND, GLOBAL_SCOPE_KIND, GROUP_SCOPE_KIND]
+    # Строки вставляются в колонки таблицы из миграции
+    assert all(row.keys() == get_table_columns(ANALYTICS_LIMITER_STATS_TABLE) for row in rows.values())
+
+    chat = rows[CHAT_SCOPE_KIND]
+    assert (chat["bot_id"], chat["calls"], chat["tokens"]) == (42, 3, 3)
+    assert (chat["wait_count"], chat["retry_after_events"], chat["parked_requests"]) == (2, 1, 1)
+    assert chat["wait_buckets"] == list(DEFAULT_WAIT_TIME_BUCKETS)
+    assert sum(chat["wait_counts"]) == 2
+    assert chat["wait_p50"] <= chat["wait_p90"] <= chat["wait_p99"]
+    assert chat["rate"] is None
+    assert (rows[GLOBAL_SCOPE_KIND]["wait_count"], rows[GLOBAL_SCOPE_KIND]["retry_after_events"]) == (3, 0)
+
+    # Следующий период сохраняет только изменения
+    written.clear()
+    asyncio.run(collector.collect_and_save())
+
+    rows = {row["kind"]: row for _, row in written}
+    assert {(row["calls"], row["wait_count"], row["retry_after_events"]) for row in rows.values()} == {(0, 0, 0)}
+    assert rows[CHAT_SCOPE_KIND]["parked_seconds"] == 0
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+from djgram.contrib.limits import gcra
+from djgram.contrib.limits.policy import RatePolicy
+from djgram.contrib.limits.utils import limit_retry_call
+
+
+class RetryAfterError(Exception):
+    def __init__(self, retry_after: float | None = None):
+        super().__init__("Too many requests")
+        self.retry_after = retry_after
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(gcra.time, "monotonic", clock)
+    monkeypatch.setattr(gcra.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def test_invalid_max_concurrency():
+    with pytest.raises(ValueError, match="max_concurrency"):
+        RatePolicy(max_concurrency=0)
+
+
+def test_without_max_rate_calls_are_not_limited(clock: Clock):
+    @limit_retry_call(RetryAfterError)
+    async def call(value: int) -> int:
+        return value
+
+    async def main() -> list[int]:
+        return [await call(value) for value in range(100)]
+
+    assert asyncio.run(main()) == list(range(100))
+    assert clock.sleeps == []
+    assert call.policy.limiter is None  # pyright: ignore [reportFunctionMemberAccess]
+    assert call.policy.key_limiter is None  # pyright: ignore [reportFunctionMemberAccess]
+    assert call.policy.semaphore is None  # pyright: ignore [reportFunctionMemberAccess]
+
+
+def test_max_rate_with_key_limits_each_key_only(clock: Clock):
+    @limit_retry_call(RetryAfterError, max_rate=10, key=lambda user_id: user_id)
+    async def call(user_id: int) -> int:
+        return user_id
+
+    async def main() -> None:
+        for user_id in range(5):
+            await call(user_id)
+        assert clock.sleeps == []
+
+        # Повторные вызовы для одного ключа ждут, общего лимита нет
+        await call(1)
+        await call(1)
+        assert clock.sleeps == pytest.approx([0.1, 0.1])
+
+    asyncio.run(main())
+
+    assert call.policy.limiter is None  # pyright: ignore [reportFunctionMemberAccess]
+
+
+def test_max_rate_without_key_limits_all_calls(clock: Clock):
+    @limit_retry_call(RetryAfterError, max_rate=10, burst=2)
+    async def call(user_id: int) -> int:
+        return user_id
+
+    async def main() -> None:
+        for user_id in range(4):
+            await call(user_id)
+
+    asyncio.run(main())
+
+    assert clock.sleeps == pytest.approx([0.1, 0.1])
+
+
+def test_semaphore_is_released_when_call_raises():
+    running: list[int] = []
+
+    @limit_retry_call(RetryAfterError, max_concurrency=1)
+    async def call(value: int) -> int:
+        running.append(value)
+        assert len(running) == 1
+        await asyncio.sleep(0)
+        running.remove(value)
+        if value % 2:
+            raise ValueError(value)
+        return value
+
+    async def main() -> list[int | BaseException]:
+        results = await asyncio.gather(*(call(value) for value in range(4)), return_exceptions=True)
+        # Иначе следующий вызов ждал бы место вечно
+        results.append(await asyncio.wait_for(call(4), timeout=1))
+        return results
+
+    results = asyncio.run(main())
+
+    assert [result if isinstance(result, int) else type(result) for result in results] == [
+        0,
+        ValueError,
+        2,
+        ValueError,
+        4,
+    ]
+    policy: RatePolicy = call.policy  # pyright: ignore [reportFunctionMemberAccess]
+    assert policy.in_flight == 0
+    assert not policy.semaphore.locked()  # pyright: ignore [reportOptionalMemberAccess]
+
+
+def test_semaphore_is_released_when_retries_are_exhausted():
+    policy = RatePolicy(max_concurrency=1)
+
+    @limit_retry_call(RetryAfterError, policy=policy, sleep_gap=0)
+    async def call() -> None:
+        raise RetryAfterError(0)
+
+    with pytest.raises(RetryAfterError):
+        asyncio.run(call())
+
+    assert policy.in_flight == 0
+    assert not policy.semaphore.locked()  # pyright: ignore [reportOptionalMemberAccess]
@@ -0,0 +1,132 @@
+import asyncio
+from collections import Counter
+from typing import Any
+
+import pytest
+from djgram.contrib.communication.broadcast import broadcast
+from djgram.contrib.limits.priority import LIMITER_PRIORITY, Priority, WeightedFairQueue, limiter_priority
+
+
+class FakeLimiter:
+    """
+    Лимитер, который выдаёт токены по одному за шаг event loop и считает их
+    """
+
+    def __init__(self, error: Exception | None = None):
+        self.tokens = 0
+        self.error = error
+
+    async def acquire(self, tokens: int = 1) -> None:
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        self.tokens += tokens
+
+
+async def acquire(queue: WeightedFairQueue, priority: Priority, granted: list[Priority]) -> None:
+    await queue.acquire(1, priority)
+    granted.append(priority)
+
+
+def test_priority_context():
+    assert LIMITER_PRIORITY.get() == Priority.NORMAL
+    with limiter_priority(Priority.BULK):
+        assert LIMITER_PRIORITY.get() == Priority.BULK
+    assert LIMITER_PRIORITY.get() == Priority.NORMAL
+
+
+def test_invalid_weights():
+    with pytest.raises(ValueError, match="weights"):
+        WeightedFairQueue(FakeLimiter(), {Priority.BULK: 0})  # pyright: ignore [reportArgumentType]
+
+
+def test_weights_share_limit_under_contention():
+    queue = WeightedFairQueue(FakeLimiter())  # pyright: ignore [reportArgumentType]
+    granted: list[Priority] = []
+
+    async def main() -> None:
+        await asyncio.gather(*(acquire(queue, priority, granted) for priority in Priority for _ in range(26)))
+
+    asyncio.run(main())
+
+    # Пока в очереди есть запросы всех классов, лимит делится в отношении весов 8:4:1
+    assert Counter(granted[:26]) == {Priority.INTERACTIVE: 16, Priority.NORMAL: 8, Priority.BULK: 2}
+    # Когда запросы с большим весом кончились, остальные получают весь лимит
+    assert len(granted) == 78
+    assert granted[-1] == Priority.BULK
+
+
+def test_interactive_is_not_starved_by_broadcast():
+    limiter = FakeLimiter()
+    queue = WeightedFairQueue(limiter)  # pyright: ignore [reportArgumentType]
+    granted: list[Priority] = []
+
+    async def send(chat_id: int, **_kwargs: Any) -> None:
+        await acquire(queue, LIMITER_PRIORITY.get(), granted)
+
+    async def main() -> None:
+        # Несколько рассылок одновременно держат очередь заполненной запросами BULK
+        broadcasts = [
+            asyncio.create_task(broadcast(send, range(50), 50, broadcast_timeout=0, logging_period=3600))
+            for _ in range(5)
+        ]
+        for _ in range(50):
+            await asyncio.sleep(0)
+        assert len(queue) > 0
+
+        tokens_before = limiter.tokens
+        await acquire(queue, Priority.INTERACTIVE, granted)
+        # Ответ пользователю получает токен сразу после уже выдаваемого,
+        # а не после оставшихся сотен сообщений рассылки
+        assert limiter.tokens - tokens_before <= 2
+        assert limiter.tokens < 100
+
+        await asyncio.gather(*broadcasts)
+
+    asyncio.run(main())
+
+    assert Counter(granted) == {Priority.BULK: 250, Priority.INTERACTIVE: 1}
+
+
+def test_cancelled_waiter_is_skipped():
+    limiter = FakeLimiter()
+    queue = WeightedFairQueue(limiter)  # pyright: ignore [reportArgumentType]
+    granted: list[Priority] = []
+
+    async def main() -> None:
+        cancelled = asyncio.create_task(acquire(queue, Priority.NORMAL, granted))
+        waiting = asyncio.create_task(acquire(queue, Priority.NORMAL, granted))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        await waiting
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+        # Отменённый запрос не забрал токен, а насос остановился, когда очередь опустела
+        assert limiter.tokens == 1
+        assert len(queue) == 0
+        await asyncio.sleep(0)
+        assert queue._pump_task is None
+
+        # Следующий запрос снова запускает насос
+        await acquire(queue, Priority.BULK, granted)
+
+    asyncio.run(main())
+
+    assert granted == [Priority.NORMAL, Priority.BULK]
+    assert limiter.tokens == 2
+
+
+def test_limiter_error_is_passed_to_waiter():
+    error = ConnectionError("redis is down")
+    queue = WeightedFairQueue(FakeLimiter(error))  # pyright: ignore [reportArgumentType]
+
+    async def main() -> list[Any]:
+        return await asyncio.gather(
+            queue.acquire(1, Priority.NORMAL),
+            queue.acquire(1, Priority.BULK),
+            return_exceptions=True,
+        )
+
+    assert asyncio.run(main()) == [error, error]
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from djgram.contrib.limits.gcra import GCRALimiter  # noqa: E402
+from djgram.contrib.limits.redis_limiter import RedisLimiter  # noqa: E402
+from limiter import Limiter  # noqa: E402
+from redis.exceptions import ConnectionError as RedisConnectionError  # noqa: E402
+
+
+def test_tokens_are_shared_between_limiters():
+    redis = fakeredis.FakeAsyncRedis()
+    first = RedisLimiter(redis, rate=1, burst=3, prefetch=1)
+    second = RedisLimiter(redis, rate=1, burst=3, prefetch=1)
+
+    async def main() -> None:
+        await first.acquire(2)
+        await second.acquire(1)
+        # Корзина на 3 токена исчерпана обоими лимитерами вместе
+        assert await second._fetch(1) == (0, pytest.approx(1, abs=0.05))
+
+    asyncio.run(main())
+
+
+def test_rate_is_propagated_to_fallback():
+    limiter = RedisLimiter(fakeredis.FakeAsyncRedis(), rate=10)
+    assert isinstance(limiter.fallback, GCRALimiter)
+
+    limiter.rate = 5
+    assert limiter.fallback.rate == 5
+
+    limiter = RedisLimiter(fakeredis.FakeAsyncRedis(), rate=10, fallback=Limiter(10, 1))
+    limiter.rate = 5
+    assert limiter.fallback.rate == 5
+
+    with pytest.raises(ValueError, match="rate"):
+        limiter.rate = 0
+
+
+def test_fallback_when_redis_is_unavailable(monkeypatch: pytest.MonkeyPatch):
+    fallback = GCRALimiter(100)
+    limiter = RedisLimiter(fakeredis.FakeAsyncRedis(), rate=100, fallback=fallback)
+
+    async def broken_fetch(self: RedisLimiter, tokens: int) -> tuple[int, float]:
+        raise RedisConnectionError
+
+    monkeypatch.setattr(RedisLimiter, "_fetch", broken_fetch)
+
+    asyncio.run(limiter.acquire())
+
+    assert limiter._fallback_until > 0
+    assert fallback._tat > 0
+
+
+def test_prefetch_saves_round_trips_only_with_burst(monkeypatch: pytest.MonkeyPatch):
+    fetched: list[int] = []
+    original_fetch = RedisLimiter._fetch
+
+    async def fetch(self: RedisLimiter, tokens: int) -> tuple[int, float]:
+        fetched.append(tokens)
+        return await original_fetch(self, tokens)
+
+    monkeypatch.setattr(RedisLimiter, "_fetch", fetch)
+
+    # По умолчанию каждый токен запрашивается из redis отдельно
+    limiter = RedisLimiter(fakeredis.FakeAsyncRedis(), rate=1000)
+    assert limiter.prefetch == 1
+    # prefetch не может быть больше ёмкости корзины
+    assert RedisLimiter(fakeredis.FakeAsyncRedis(), rate=1000, prefetch=3).prefetch == 1
+
+    limiter = RedisLimiter(fakeredis.FakeAsyncRedis(), rate=1000, burst=3, prefetch=3)
+
+    async def main() -> None:
+        for _ in range(3):
+            await limiter.acquire()
+
+    asyncio.run(main())
+
+    assert fetched == [3]
@@ -0,0 +1,147 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import pytest
+from aiogram.dispatcher.middlewares.user_context import EVENT_CONTEXT_KEY, UserContextMiddleware
+from aiogram.types import InlineQuery, Update, User
+from djgram.contrib.telegram.cache import PersistedObjectCache, telegram_object_cache
+from djgram.contrib.telegram.middlewares import TelegramMiddleware
+from djgram.contrib.telegram.models import TelegramUser
+from djgram.db.models import Base
+from djgram.system_configs import MIDDLEWARE_DB_SESSION_KEY, MIDDLEWARE_TELEGRAM_USER_KEY
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+
+pytest.importorskip("aiosqlite")
+
+FINGERPRINT = ("user",)
+
+
+def run(test: Callable[[AsyncEngine, list[str]], Awaitable[None]]) -> None:
+    telegram_object_cache.clear()
+
+    async def main() -> None:
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(
+                lambda sync_connection: Base.metadata.create_all(sync_connection, tables=[TelegramUser.__table__]),
+            )
+
+        queries: list[str] = []
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2].split()[0]))
+
+        await test(engine, queries)
+        await engine.dispose()
+
+    asyncio.run(main())
+    telegram_object_cache.clear()
+
+
+async def create_user(engine: AsyncEngine, cache: PersistedObjectCache) -> None:
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        user = TelegramUser(id=1, is_bot=False, first_name="user")
+        session.add(user)
+        await session.commit()
+    cache.put(user, FINGERPRINT)
+
+
+def test_hit_does_not_query_database():
+    cache = PersistedObjectCache()
+
+    async def test(engine: AsyncEngine, queries: list[str]) -> None:
+        await create_user(engine, cache)
+        queries.clear()
+
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            user = await cache.get(session, TelegramUser, 1, FINGERPRINT)
+
+            assert user is not None
+            assert user in session
+            assert user.first_name == "user"
+            assert queries == []
+        assert cache.hits == 1
+
+    run(test)
+
+
+def test_changed_fingerprint_misses():
+    cache = PersistedObjectCache()
+
+    async def test(engine: AsyncEngine, _queries: list[str]) -> None:
+        await create_user(engine, cache)
+
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            assert await cache.get(session, TelegramUser, 1, ("other",)) is None
+            assert await cache.get(session, TelegramUser, 2, FINGERPRINT) is None
+        assert cache.misses == 2
+        assert cache.hits == 0
+
+    run(test)
+
+
+def test_update_and_delete_evict_entry():
+    async def test(engine: AsyncEngine, _queries: list[str]) -> None:
+        # События ORM сбрасывают записи общего кеша
+        await create_user(engine, telegram_object_cache)
+
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            user = await telegram_object_cache.get(session, TelegramUser, 1, FINGERPRINT)
+            assert user is not None
+            user.first_name = "renamed"
+            await session.commit()
+            assert await telegram_object_cache.get(session, TelegramUser, 1, FINGERPRINT) is None
+
+            telegram_object_cache.put(user, FINGERPRINT)
+            await session.delete(user)
+            await session.commit()
+            assert await telegram_object_cache.get(session, TelegramUser, 1, FINGERPRINT) is None
+
+    run(test)
+
+
+def make_update() -> Update:
+    # У inline запроса есть пользователь, но нет чата
+    user = User(id=1, is_bot=False, first_name="user")
+    return Update(update_id=1, inline_query=InlineQuery(id="1", from_user=user, query="", offset=""))
+
+
+def test_middleware_caches_only_committed_objects():
+    middleware = TelegramMiddleware()
+
+    async def handler(_update: Update, data: dict[str, Any]) -> TelegramUser:
+        return data[MIDDLEWARE_TELEGRAM_USER_KEY]
+
+    async def call(session: AsyncSession) -> TelegramUser:
+        update = make_update()
+        data = {
+            MIDDLEWARE_DB_SESSION_KEY: session,
+            EVENT_CONTEXT_KEY: UserContextMiddleware.resolve_event_context(update),
+        }
+        return await middleware(handler, update, data)
+
+    async def test(engine: AsyncEngine, queries: list[str]) -> None:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+
+            async def failed_commit() -> None:
+                raise ConnectionError
+
+            session.commit = failed_commit  # pyright: ignore [reportAttributeAccessIssue]
+            with pytest.raises(ConnectionError):
+                await call(session)
+            await session.rollback()
+
+        # Пользователь не сохранён, поэтому не попал в кеш и снова записывается в базу
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            queries.clear()
+            assert (await call(session)).first_name == "user"
+            assert "INSERT" in queries
+
+        # После коммита пользователь берётся из кеша без запросов
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            queries.clear()
+            user = await call(session)
+            assert user in session
+            assert queries == []
+
+    run(test)
@@ -0,0 +1,182 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime
+from typing import Any
+
+import pytest
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import GetChat
+from aiogram.types import Chat, ChatFullInfo
+from djgram.contrib.telegram import chat_full_info
+from djgram.contrib.telegram.cache import telegram_object_cache
+from djgram.contrib.telegram.chat_full_info import ChatFullInfoRefresher
+from djgram.contrib.telegram.middlewares import TelegramMiddleware
+from djgram.contrib.telegram.models import TelegramChatFullInfo
+from djgram.db import utils as db_utils
+from djgram.db.models import Base
+from djgram.system_configs import MIDDLEWARE_TELEGRAM_CHAT_FULL_INFO_KEY
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+pytest.importorskip("aiosqlite")
+
+
+class FakeBot:
+    def __init__(self, *, fail: bool = False):
+        self.fail = fail
+        self.requested: list[int] = []
+
+    async def get_chat(self, chat_id: int) -> ChatFullInfo:
+        self.requested.append(chat_id)
+        await asyncio.sleep(0)
+        if self.fail:
+            raise TelegramNetworkError(GetChat(chat_id=chat_id), "timeout")
+        return ChatFullInfo(
+            id=chat_id,
+            type="private",
+            title=f"chat {chat_id}",
+            accent_color_id=1,
+            max_reaction_count=11,
+        )
+
+
+def run(
+    monkeypatch: pytest.MonkeyPatch,
+    test: Callable[[async_sessionmaker[AsyncSession], list[str]], Awaitable[None]],
+) -> None:
+    telegram_object_cache.clear()
+
+    async def main() -> None:
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(
+                lambda sync_connection: Base.metadata.create_all(
+                    sync_connection,
+                    tables=[TelegramChatFullInfo.__table__],
+                ),
+            )
+
+        sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+        @asynccontextmanager
+        async def get_autocommit_session() -> AsyncIterator[AsyncSession]:
+            async with sessionmaker() as session, session.begin():
+                yield session
+
+        monkeypatch.setattr(chat_full_info, "get_autocommit_session", get_autocommit_session)
+        queries: list[str] = []
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2].split()[0]))
+
+        await test(sessionmaker, queries)
+        await engine.dispose()
+
+    asyncio.run(main())
+    telegram_object_cache.clear()
+
+
+async def get_titles(sessionmaker: async_sessionmaker[AsyncSession]) -> dict[int, str | None]:
+    async with sessionmaker() as session:
+        return {info.id: info.title for info in await session.scalars(select(TelegramChatFullInfo))}
+
+
+def test_requests_are_deduplicated_and_saved_in_one_batch(monkeypatch: pytest.MonkeyPatch):
+    refresher = ChatFullInfoRefresher(save_interval=0.01)
+    bot = FakeBot()
+    batches: list[list[int]] = []
+
+    async def upsert_many(session: AsyncSession, model: Any, rows: list[dict[str, Any]], *args: Any) -> Any:
+        batches.append(sorted(row["id"] for row in rows))
+        return await db_utils.upsert_many(session, model, rows, *args)
+
+    monkeypatch.setattr(chat_full_info, "upsert_many", upsert_many)
+
+    async def test(sessionmaker: async_sessionmaker[AsyncSession], _queries: list[str]) -> None:
+        futures = [refresher.request(bot, chat_id) for chat_id in (1, 2, 1, 3, 1)]  # pyright: ignore [reportArgumentType]
+        assert refresher.is_pending(1)
+
+        results = await asyncio.gather(*futures)
+
+        # Один getChat на чат, все ждущие одного чата получают один и тот же объект
+        assert sorted(bot.requested) == [1, 2, 3]
+        assert results[0] is results[2] is results[4]
+        assert [result.id for result in results] == [1, 2, 1, 3, 1]
+        assert refresher.requested == 5
+        assert refresher.deduplicated == 2
+        assert not refresher.is_pending(1)
+
+        # Все три чата записаны одним пакетом
+        assert batches == [[1, 2, 3]]
+        assert await get_titles(sessionmaker) == {1: "chat 1", 2: "chat 2", 3: "chat 3"}
+
+    run(monkeypatch, test)
+
+
+def test_buffered_request_is_saved_immediately_when_urgent(monkeypatch: pytest.MonkeyPatch):
+    refresher = ChatFullInfoRefresher(save_interval=3600)
+    bot = FakeBot()
+
+    async def test(sessionmaker: async_sessionmaker[AsyncSession], _queries: list[str]) -> None:
+        future = refresher.request(bot, 1)  # pyright: ignore [reportArgumentType]
+        # Информация получена и ждёт сохранения вместе с пакетом
+        await asyncio.sleep(0.01)
+        assert refresher._buffer
+        assert not future.done()
+
+        instance = await asyncio.wait_for(refresher.refresh(bot, 1), 1)  # pyright: ignore [reportArgumentType]
+
+        assert instance is not None
+        assert instance.title == "chat 1"
+        assert future.result() is instance
+        assert bot.requested == [1]
+        assert refresher.deduplicated == 1
+        assert await get_titles(sessionmaker) == {1: "chat 1"}
+
+        await refresher.close()
+
+    run(monkeypatch, test)
+
+
+def test_failed_request(monkeypatch: pytest.MonkeyPatch):
+    refresher = ChatFullInfoRefresher(save_interval=0.01)
+    bot = FakeBot(fail=True)
+
+    async def test(sessionmaker: async_sessionmaker[AsyncSession], queries: list[str]) -> None:
+        assert await refresher.refresh(bot, 1) is None  # pyright: ignore [reportArgumentType]
+
+        assert refresher.failed == 1
+        assert not refresher.is_pending(1)
+        assert queries == []
+
+        # Следующий запрос снова обращается к telegram
+        bot.fail = False
+        assert await refresher.refresh(bot, 1) is not None  # pyright: ignore [reportArgumentType]
+        assert bot.requested == [1, 1]
+        assert await get_titles(sessionmaker) == {1: "chat 1"}
+
+    run(monkeypatch, test)
+
+
+def test_waiting_middleware_keeps_loaded_info_on_failure(monkeypatch: pytest.MonkeyPatch):
+    refresher = ChatFullInfoRefresher(save_interval=0.01)
+    middleware = TelegramMiddleware(wait_for_chat_full_info_update=True, refresher=refresher)
+    bot = FakeBot()
+    chat = Chat(id=1, type="private")
+
+    async def test(sessionmaker: async_sessionmaker[AsyncSession], _queries: list[str]) -> None:
+        await refresher.refresh(bot, 1)  # pyright: ignore [reportArgumentType]
+        bot.fail = True
+
+        async with sessionmaker() as session:
+            data: dict[str, Any] = {}
+            await middleware.load_telegram_chat_full_info(data, session, chat, bot, chat_changed=True)  # pyright: ignore [reportArgumentType]
+
+            # Обновить не удалось, обработчик получает загруженную из базы информацию
+            loaded = data[MIDDLEWARE_TELEGRAM_CHAT_FULL_INFO_KEY]
+            assert loaded is not None
+            assert loaded.title == "chat 1"
+            assert loaded in session
+            assert loaded.updated_at.astimezone(UTC) <= datetime.now(tz=UTC)
+        assert bot.requested == [1, 1]
+
+    run(monkeypatch, test)